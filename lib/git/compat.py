@@ -8,6 +8,7 @@
 # flake8: noqa
 
 import sys
+from array import array
 
 from gitdb.utils.compat import (
     PY3,
@@ -50,6 +51,9 @@ else:
     def mviter(d):
         return d.itervalues()
 
+# array type code of unsigned integers of at least 32 bits, 'L' takes 64 bits on most 64 bit platforms
+UINT_TYPECODE = array('I').itemsize >= 4 and 'I' or 'L'
+
 
 def safe_decode(s):
     """Safely decodes a binary string to unicode"""
@@ -1,22 +1,27 @@
 """Module with our own gitdb implementation - it uses the git command"""
+import os
+from struct import unpack_from
+
 from gitdb.base import (
     OInfo,
     OStream
 )
 from gitdb.util import (
     bin_to_hex,
-    hex_to_bin
+    hex_to_bin,
+    mman
 )
 from gitdb.db import GitDB
 from gitdb.db import LooseObjectDB
 
+from .compat import byte_ord
 from .exc import (
     GitCommandError,
     BadObject
 )
 
 
-__all__ = ('GitCmdObjectDB', 'GitDB')
+__all__ = ('GitCmdObjectDB', 'GitDB', 'CommitGraphFile', 'CommitGraph')
 
 # class GitCmdObjectDB(CompoundDB, ObjectDBW):
 
@@ -61,3 +66,225 @@ class GitCmdObjectDB(LooseObjectDB):
         # END handle exceptions
 
     #} END interface
+
+
+class CommitGraphFile(object):
+
+    """A single commit-graph file, as written by git commit-graph write, which is memory mapped
+    using smmap. Commits are addressed by their position within the file, which is the
+    position of their sha within the sorted list of all shas it contains.
+
+    Within a chain of split commit-graph files, parents are referred to by their position
+    within the whole chain, see ``CommitGraph``."""
+    __slots__ = ('_path', '_cursor', '_fanout_table', '_oid_offset', '_data_offset', '_edge_offset',
+                 'base_count')
+
+    signature = b'CGPH'
+
+    # chunk ids
+    chunk_fanout = b'OIDF'
+    chunk_oid_lookup = b'OIDL'
+    chunk_commit_data = b'CDAT'
+    chunk_extra_edges = b'EDGE'
+
+    # parent positions with special meaning
+    parent_none = 0x70000000
+    parent_extra_edges = 0x80000000
+
+    commit_data_size = 36
+
+    def __init__(self, path):
+        self._path = path
+        self._cursor = mman.make_cursor(path).use_region()
+        # like pack indices, we assume the whole file fits into one mapped window
+        if mman.window_size() > 0 and self._cursor.file_size() > mman.window_size():
+            raise AssertionError("The commit-graph file at %s is too large to fit into a mapped window (%i > %i)"
+                                 % (path, self._cursor.file_size(), mman.window_size()))
+        # END assert window size
+
+        data = self._cursor.map()
+        if data[:4] != self.signature:
+            raise ValueError("Invalid commit-graph signature in %s" % path)
+        version, hash_version, num_chunks, self.base_count = (byte_ord(b) for b in data[4:8])
+        if version != 1 or hash_version != 1:
+            raise ValueError("Unsupported commit-graph version %i with hash version %i in %s"
+                             % (version, hash_version, path))
+        # END verify header
+
+        chunks = dict()
+        for i in range(num_chunks):
+            chunk_id, offset = unpack_from('>4sQ', data, 8 + i * 12)
+            chunks[chunk_id] = offset
+        # END for each chunk
+
+        try:
+            fanout = chunks[self.chunk_fanout]
+            self._oid_offset = chunks[self.chunk_oid_lookup]
+            self._data_offset = chunks[self.chunk_commit_data]
+        except KeyError as err:
+            raise ValueError("Required chunk %s is missing in %s" % (err, path))
+        # END handle missing chunks
+        self._edge_offset = chunks.get(self.chunk_extra_edges)
+        self._fanout_table = unpack_from('>256L', data, fanout)
+
+    def __len__(self):
+        return self._fanout_table[255]
+
+    def path(self):
+        """:return: path to the commit-graph file"""
+        return self._path
+
+    def sha(self, i):
+        """:return: 20 byte sha of the commit at the given position"""
+        base = self._oid_offset + i * 20
+        return self._cursor.map()[base:base + 20]
+
+    def sha_to_index(self, sha):
+        """:return: position of the given 20 byte sha, or None if the commit is not contained"""
+        first_byte = byte_ord(sha[0])
+        lo = 0
+        if first_byte != 0:
+            lo = self._fanout_table[first_byte - 1]
+        hi = self._fanout_table[first_byte]
+
+        data = self._cursor.map()
+        oid_offset = self._oid_offset
+        while lo < hi:
+            mid = (lo + hi) // 2
+            base = oid_offset + mid * 20
+            mid_sha = data[base:base + 20]
+            if sha < mid_sha:
+                hi = mid
+            elif sha == mid_sha:
+                return mid
+            else:
+                lo = mid + 1
+            # END handle midpoint
+        # END bisect
+        return None
+
+    def commit_data(self, i):
+        """:return: tuple(tree_binsha, tuple(parent_position, ...), generation, committed_date) of
+            the commit at the given position. Parent positions are relative to the whole chain"""
+        data = self._cursor.map()
+        tree, parent1, parent2, generation, date = unpack_from('>20sLLLL', data,
+                                                               self._data_offset + i * self.commit_data_size)
+        # the generation number takes the upper 30 bits, the commit date the lower 34
+        date |= (generation & 3) << 32
+        generation >>= 2
+
+        if parent1 == self.parent_none:
+            parents = ()
+        elif parent2 == self.parent_none:
+            parents = (parent1, )
+        elif parent2 & self.parent_extra_edges:
+            # octopus merge, all parents but the first are listed in the extra edge list
+            parents = [parent1]
+            offset = self._edge_offset + (parent2 & ~self.parent_extra_edges) * 4
+            while True:
+                edge = unpack_from('>L', data, offset)[0]
+                parents.append(edge & ~self.parent_extra_edges)
+                if edge & self.parent_extra_edges:
+                    break
+                offset += 4
+            # END for each extra edge
+            parents = tuple(parents)
+        else:
+            parents = (parent1, parent2)
+        # END handle parent count
+        return tree, parents, generation, date
+
+
+class CommitGraph(object):
+
+    """Provides the parents, root tree, commit date and generation number of commits without
+    reading and inflating them, using git's commit-graph file or chain of split commit-graph
+    files in the objects/info directory.
+
+    Commits written after the commit-graph are not contained, use ``__contains__``
+    or handle None return values to fall back to the object database."""
+    __slots__ = ('_files', '_bases')
+
+    def __init__(self, files):
+        """Initialize this instance with a list of CommitGraphFile instances, base graphs first"""
+        self._files = files
+        # amount of commits in all graphs before the respective one
+        self._bases = list()
+        count = 0
+        for graph in files:
+            self._bases.append(count)
+            count += len(graph)
+        # END for each graph
+
+    @classmethod
+    def from_objects_dir(cls, objects_dir):
+        """:return: CommitGraph for the commit-graph file or chain in the given objects directory,
+            or None if there is none"""
+        info_dir = os.path.join(objects_dir, 'info')
+        chain_path = os.path.join(info_dir, 'commit-graphs', 'commit-graph-chain')
+        if os.path.isfile(chain_path):
+            with open(chain_path, 'rb') as fp:
+                names = fp.read().decode('ascii').split()
+            # END read chain
+            return cls([CommitGraphFile(os.path.join(info_dir, 'commit-graphs', 'graph-%s.graph' % name))
+                        for name in names])
+        # END handle split chain
+
+        path = os.path.join(info_dir, 'commit-graph')
+        if os.path.isfile(path):
+            return cls([CommitGraphFile(path)])
+        return None
+
+    def __len__(self):
+        return sum(len(graph) for graph in self._files)
+
+    def __contains__(self, binsha):
+        return self.position(binsha) is not None
+
+    def position(self, binsha):
+        """:return: position of the commit with the given binary sha within the chain, or None"""
+        for graph, base in zip(reversed(self._files), reversed(self._bases)):
+            index = graph.sha_to_index(binsha)
+            if index is not None:
+                return base + index
+        # END for each graph, newest first
+        return None
+
+    def _locate(self, position):
+        """:return: tuple(graph, index) for the given position within the chain"""
+        for graph, base in zip(reversed(self._files), reversed(self._bases)):
+            if position >= base:
+                return graph, position - base
+        # END for each graph
+        raise IndexError("Invalid commit-graph position: %i" % position)
+
+    def sha(self, position):
+        """:return: binary sha of the commit at the given position within the chain"""
+        graph, index = self._locate(position)
+        return graph.sha(index)
+
+    def commit_data(self, position):
+        """:return: tuple(tree_binsha, tuple(parent_binsha, ...), generation, committed_date) for the
+            commit at the given position within the chain"""
+        graph, index = self._locate(position)
+        tree, parents, generation, date = graph.commit_data(index)
+        return tree, tuple(self.sha(p) for p in parents), generation, date
+
+    def header(self, binsha):
+        """:return: tuple(tree_binsha, tuple(parent_binsha, ...), committed_date) of the commit with
+            the given binary sha like ``git.objects.fun.commit_header_from_data``, or None if
+            it is not contained"""
+        position = self.position(binsha)
+        if position is None:
+            return None
+        tree, parents, generation, date = self.commit_data(position)
+        return tree, parents, date
+
+    def generation(self, binsha):
+        """:return: generation number of the commit with the given binary sha, or None if it is not
+            contained. Root commits have generation 1, all others a generation larger than the one
+            of any of their parents. 0 means the generation was not computed when the graph was written"""
+        position = self.position(binsha)
+        if position is None:
+            return None
+        return self.commit_data(position)[2]
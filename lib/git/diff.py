@@ -4,23 +4,34 @@
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
 import re
+import tempfile
+import zlib
+from stat import S_IFMT
 
-from gitdb.util import hex_to_bin
+from gitdb.util import to_bin_sha
 
 from .compat import binary_type
 from .objects.blob import Blob
+from .objects.fun import iter_trees_recursive
 from .objects.util import mode_str_to_int
 
 from git.compat import (
     defenc,
+    string_types,
     PY3
 )
 
-__all__ = ('Diffable', 'DiffIndex', 'Diff', 'NULL_TREE')
+__all__ = ('Diffable', 'DiffIndex', 'Diff', 'RenameDetector', 'NULL_TREE',
+           'PATCH_KEEP', 'PATCH_SKIP', 'PATCH_SPOOL')
 
 # Special object to compare against the empty tree in diffs
 NULL_TREE = object()
 
+# Ways to handle patch bodies when parsing diffs in patch format
+PATCH_KEEP = 'keep'
+PATCH_SKIP = 'skip'
+PATCH_SPOOL = 'spool'
+
 _octal_byte_re = re.compile(b'\\\\([0-9]{3})')
 
 
@@ -53,6 +64,88 @@ def decode_path(path, has_ab_prefix=True):
     return path
 
 
+# Diffs share equal mode integers and change type strings instead of each holding a copy
+_shared_modes = dict()
+_shared_change_types = dict()
+
+
+def _shared_mode(mode):
+    """:return: integer mode for the given mode string or integer, as an instance shared by all diffs"""
+    try:
+        return _shared_modes[mode]
+    except KeyError:
+        imode = mode
+        if not isinstance(mode, int):
+            imode = mode_str_to_int(mode)
+        imode = _shared_modes.get(imode, imode)
+        if len(_shared_modes) < 128:
+            _shared_modes[mode] = imode
+            _shared_modes[imode] = imode
+        # END keep the cache small
+        return imode
+    # END handle cache miss
+
+
+def _patch_header_complete(buf, start):
+    """:return: True if buf holds the complete diff header beginning at start. This is the case
+        once we see where its hunks begin, or have more lines than the largest header may have"""
+    if buf.find(b'\n@@ ', start) != -1:
+        return True
+    pos = start
+    for i in range(12):
+        pos = buf.find(b'\n', pos) + 1
+        if not pos:
+            return False
+    # END for each possible header line
+    return True
+
+
+def _iter_diffs_from_process(repo, proc, parse_method, **kwargs):
+    """Yield all Diff instances parsed by parse_method from the process' output
+    and finalize the process once its output is exhausted"""
+    for diff in parse_method(repo, proc.stdout, **kwargs):
+        yield diff
+    # END for each diff
+    proc.wait()
+
+
+def _tree_binsha(repo, treeish):
+    """:return: binary sha of the tree of the given Tree, Commit or revision string"""
+    if isinstance(treeish, string_types):
+        treeish = repo.tree(treeish)
+    # END resolve revisions
+    if treeish.type == 'commit':
+        treeish = treeish.tree
+    return treeish.binsha
+
+
+def _iter_native_diffs(repo, a_binsha, b_binsha, paths=None):
+    """Yield Diff instances for all blobs differing between the trees with the given binary shas,
+    either of which may be None to indicate the empty tree. Renames are not detected.
+
+    :param paths: None or list of paths limiting the diffs to themselves and everything below them.
+        Trees not on the way to these paths are not read"""
+    for a, b in iter_trees_recursive(repo.odb, [a_binsha, b_binsha], '', repo.tree_cache, skip_same=True,
+                                     paths=paths or None):
+        path = (a or b)[2]
+        if not isinstance(path, binary_type):
+            path = path.encode(defenc)
+        # END assure raw path
+
+        if a is None:
+            yield Diff(repo, path, path, None, b[0], 0, b[1], True, False, None, None, '', 'A')
+        elif b is None:
+            yield Diff(repo, path, path, a[0], None, a[1], 0, False, True, None, None, '', 'D')
+        else:
+            change_type = 'M'
+            if S_IFMT(a[1]) != S_IFMT(b[1]):
+                change_type = 'T'
+            # END handle type changes
+            yield Diff(repo, path, path, a[0], b[0], a[1], b[1], False, False, None, None, '', change_type)
+        # END handle change type
+    # END for each entry
+
+
 class Diffable(object):
 
     """Common interface for all object that can be diffed against another object of compatible type.
@@ -74,7 +167,7 @@ class Diffable(object):
             Subclasses can use it to alter the behaviour of the superclass"""
         return args
 
-    def diff(self, other=Index, paths=None, create_patch=False, **kwargs):
+    def diff(self, other=Index, paths=None, create_patch=False, lazy=False, patch_bodies=PATCH_KEEP, **kwargs):
         """Creates diffs between two items being trees, trees and index or an
         index and the working tree. It will detect renames automatically.
 
@@ -96,6 +189,19 @@ class Diffable(object):
             makes the self to other. Patches are somwhat costly as blobs have to be read
             and diffed.
 
+        :param lazy:
+            If True, git's output is parsed incrementally while it is read from the pipe.
+            The returned DiffIndex is filled on demand, iterating it yields Diff
+            instances as soon as they were parsed.
+            If no patch is created, git is asked for NUL terminated raw output ( -z ),
+            whose paths are taken literally, no unquoting is required.
+
+        :param patch_bodies:
+            Only used if create_patch is True. PATCH_KEEP keeps patches as bytes,
+            PATCH_SKIP drops them, and PATCH_SPOOL writes them into temporary files
+            which only stay in memory while they are small.
+            See Diff._iter_from_patch_format for details.
+
         :param kwargs:
             Additional arguments passed to git-diff, such as
             R=True to swap both sides of the diff.
@@ -114,6 +220,9 @@ class Diffable(object):
             args.append("-p")
         else:
             args.append("--raw")
+            if lazy:
+                args.append("-z")
+        # END handle output format
 
         # in any way, assure we don't see colored output,
         # fixes https://github.com/gitpython-developers/GitPython/issues/172
@@ -145,12 +254,70 @@ class Diffable(object):
         kwargs['as_process'] = True
         proc = diff_cmd(*self._process_diff_args(args), **kwargs)
 
-        diff_method = Diff._index_from_raw_format
         if create_patch:
-            diff_method = Diff._index_from_patch_format
-        index = diff_method(self.repo, proc.stdout)
+            diffs = _iter_diffs_from_process(self.repo, proc, Diff._iter_from_patch_format,
+                                             patch_bodies=patch_bodies)
+        elif lazy:
+            diffs = _iter_diffs_from_process(self.repo, proc, Diff._iter_from_raw_z_format)
+        else:
+            index = Diff._index_from_raw_format(self.repo, proc.stdout)
+            proc.wait()
+            return index
+        # END handle format
+
+        index = DiffIndex(diffs)
+        if not lazy:
+            # read all output now, the process must not be left behind
+            len(index)
+        # END handle lazy parsing
+        return index
+
+    def native_diff(self, other=NULL_TREE, paths=None, renames=True):
+        """Creates diffs between two trees, reading them from the object database
+        instead of running git. Renames are detected by a RenameDetector.
+
+        :param other:
+            Tree or Commit to compare us with, or a revision string pointing to one.
+            If git.NULL_TREE, we are compared to the empty tree, hence all our entries are
+            listed as added. This matches diff() only for root commits, as diff() compares
+            any other commit to its parent in that case.
+            The index and the working tree are not supported.
+
+        :param paths:
+            is a list of paths or a single path to limit the diff to. A path limits the
+            diff to itself and everything below it. Rename detection only sees diffs
+            within the given paths.
+
+        :param renames:
+            If True, renames are detected using the default RenameDetector settings.
+            It may be a RenameDetector instance to use, or False to disable rename detection.
+
+        :return: git.DiffIndex, sorted by path
+
+        :note: Copies are not detected, and there is no patch"""
+        repo = self.repo
+        if other is None or other is self.Index:
+            raise ValueError("Can only compare trees natively, got %r" % other)
+        # END handle unsupported targets
+
+        a_binsha = _tree_binsha(repo, self)
+        if other is NULL_TREE:
+            a_binsha, b_binsha = None, a_binsha
+        else:
+            b_binsha = _tree_binsha(repo, other)
+        # END handle empty tree
 
-        proc.wait()
+        if paths is not None and not isinstance(paths, (tuple, list)):
+            paths = [paths]
+
+        index = DiffIndex(_iter_native_diffs(repo, a_binsha, b_binsha, paths))
+        if renames:
+            if renames is True:
+                renames = RenameDetector()
+            # END use default settings
+            index = renames.detect(repo, index)
+        # END handle rename detection
+        index.sort(key=lambda d: d.b_rawpath or d.a_rawpath)
         return index
 
 
@@ -159,6 +326,15 @@ class DiffIndex(list):
     """Implements an Index for diffs, allowing a list of Diffs to be queried by
     the diff properties.
 
+    The index may be initialized with an iterable, like the one returned by a lazy
+    Diffable.diff, which is only consumed as far as required by the operation at hand.
+    Iterating the index streams the diffs while they are parsed. Code reading the list
+    storage directly, like list.__eq__(other, index), only sees the diffs pulled so far,
+    len(index) pulls all of them.
+
+    Queries build lookup tables on first use, which are kept until the index is altered.
+    This way, repeated queries only cost as much as the amount of diffs they return.
+
     The class improves the diff handling convenience"""
     # change type invariant identifying possible ways a blob can have changed
     # A = Added
@@ -167,6 +343,63 @@ class DiffIndex(list):
     # M = modified
     change_type = ("A", "D", "R", "M")
 
+    # iterator providing the diffs we did not yet pull, or None if we are complete
+    _source = None
+    # tuple(change_type_buckets, a_path_map, b_path_map) or None if not yet built
+    _lookup = None
+
+    def __init__(self, iterable=None):
+        super(DiffIndex, self).__init__()
+        if iterable is not None:
+            self._source = iter(iterable)
+        # END handle source
+
+    def _fill(self, size=-1):
+        """Pull diffs from our source until we hold at least size of them, or all if size is -1"""
+        source = self._source
+        if source is None:
+            return
+        append = super(DiffIndex, self).append
+        ownlen = super(DiffIndex, self).__len__
+        try:
+            while size < 0 or ownlen() < size:
+                append(next(source))
+            # END while more diffs are required
+        except StopIteration:
+            self._source = None
+        # END handle exhausted source
+
+    def _lookup_tables(self):
+        """:return: tuple(dict(change_type: list(Diff, ...)), dict(a_rawpath: list(Diff, ...)),
+            dict(b_rawpath: list(Diff, ...))), all lists being in index order"""
+        if self._lookup is not None:
+            return self._lookup
+
+        buckets = dict((ct, list()) for ct in self.change_type)
+        added, deleted, renamed, modified = (buckets[ct] for ct in self.change_type)
+        a_paths = dict()
+        b_paths = dict()
+        for diff in self:
+            change_type = diff.change_type
+            if change_type == "A" or diff.new_file:
+                added.append(diff)
+            if change_type == "D" or diff.deleted_file:
+                deleted.append(diff)
+            if change_type == "R" or diff.renamed:
+                renamed.append(diff)
+            if change_type == "M" or (diff.a_binsha and diff.b_binsha and diff.a_binsha != diff.b_binsha):
+                modified.append(diff)
+            # END sort diff into buckets
+
+            if diff.a_rawpath is not None:
+                a_paths.setdefault(diff.a_rawpath, list()).append(diff)
+            if diff.b_rawpath is not None:
+                b_paths.setdefault(diff.b_rawpath, list()).append(diff)
+        # END for each diff
+
+        self._lookup = (buckets, a_paths, b_paths)
+        return self._lookup
+
     def iter_change_type(self, change_type):
         """
         :return:
@@ -182,19 +415,109 @@ class DiffIndex(list):
         if change_type not in self.change_type:
             raise ValueError("Invalid change type: %s" % change_type)
 
-        for diff in self:
-            if diff.change_type == change_type:
-                yield diff
-            elif change_type == "A" and diff.new_file:
-                yield diff
-            elif change_type == "D" and diff.deleted_file:
-                yield diff
-            elif change_type == "R" and diff.renamed:
-                yield diff
-            elif change_type == "M" and diff.a_blob and diff.b_blob and diff.a_blob != diff.b_blob:
-                yield diff
+        for diff in self._lookup_tables()[0][change_type]:
+            yield diff
         # END for each diff
 
+    def iter_a_path(self, path):
+        """
+        :return: iterator yielding Diff instances whose a_path equals the given path
+        :param path: repository relative path, as text or as bytes"""
+        if not isinstance(path, binary_type):
+            path = path.encode(defenc)
+        for diff in self._lookup_tables()[1].get(path, ()):
+            yield diff
+        # END for each diff
+
+    def iter_b_path(self, path):
+        """As ``iter_a_path``, but yields Diff instances whose b_path equals the given path"""
+        if not isinstance(path, binary_type):
+            path = path.encode(defenc)
+        for diff in self._lookup_tables()[2].get(path, ()):
+            yield diff
+        # END for each diff
+
+    #{ List Protocol
+
+    def __iter__(self):
+        if self._source is None:
+            return super(DiffIndex, self).__iter__()
+        return self._iter_streaming()
+
+    def _iter_streaming(self):
+        """Yield the diffs we hold, pulling more from the source as we go"""
+        i = 0
+        ownlen = super(DiffIndex, self).__len__
+        getitem = super(DiffIndex, self).__getitem__
+        while True:
+            if i == ownlen():
+                self._fill(i + 1)
+                if i == ownlen():
+                    break
+            # END pull next diff
+            yield getitem(i)
+            i += 1
+        # END while there are diffs
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index > -1:
+            self._fill(index + 1)
+        else:
+            self._fill()
+        return super(DiffIndex, self).__getitem__(index)
+
+    def __bool__(self):
+        self._fill(1)
+        return super(DiffIndex, self).__len__() > 0
+
+    __nonzero__ = __bool__
+
+    def __radd__(self, other):
+        # lists would only concatenate the diffs we pulled so far
+        if not isinstance(other, list):
+            return NotImplemented
+        return other + list(self)
+
+    #} END list protocol
+
+
+def _make_draining_method(name, invalidates):
+    """:return: list method of the given name which makes sure all diffs were pulled
+        from the source before it runs, and which drops lookup tables if it alters the list.
+        Other DiffIndex instances it is given, like the one compared to, are drained as well"""
+    method = getattr(list, name)
+
+    def draining_method(self, *args, **kwargs):
+        if self._source is not None:
+            self._fill()
+        for arg in args:
+            if isinstance(arg, DiffIndex) and arg._source is not None:
+                arg._fill()
+        # END for each argument
+        if invalidates:
+            self._lookup = None
+        return method(self, *args, **kwargs)
+    # END draining method
+    draining_method.__name__ = name
+    return draining_method
+
+
+for _name, _invalidates in (('__len__', False), ('__contains__', False), ('__eq__', False), ('__ne__', False),
+                            ('__lt__', False), ('__le__', False), ('__gt__', False), ('__ge__', False),
+                            ('__reversed__', False), ('__repr__', False), ('__add__', False), ('copy', False),
+                            ('__reduce__', False), ('__reduce_ex__', False),
+                            ('__mul__', False), ('__getslice__', False), ('index', False), ('count', False),
+                            ('append', True), ('extend', True), ('insert', True), ('pop', True),
+                            ('remove', True), ('sort', True), ('reverse', True), ('clear', True),
+                            ('__setitem__', True), ('__delitem__', True), ('__iadd__', True),
+                            ('__imul__', True), ('__setslice__', True), ('__delslice__', True)):
+    if hasattr(list, _name):
+        setattr(DiffIndex, _name, _make_draining_method(_name, _invalidates))
+    # END only patch methods known to this python version
+# END for each list method
+del(_name)
+del(_invalidates)
+
 
 class Diff(object):
 
@@ -204,7 +527,8 @@ class Diff(object):
     "a" and "b" respectively to inidcate that.
 
     Diffs keep information about the changed blob objects, the file mode, renames,
-    deletions and new files.
+    deletions and new files. Blobs are created on access only, the diff itself just
+    keeps their binary shas in a_binsha and b_binsha.
 
     There are a few cases where None has to be expected as member variable value:
 
@@ -248,7 +572,10 @@ class Diff(object):
     NULL_HEX_SHA = "0" * 40
     NULL_BIN_SHA = b"\0" * 20
 
-    __slots__ = ("a_blob", "b_blob", "a_mode", "b_mode", "a_rawpath", "b_rawpath",
+    # amount of bytes of a spooled patch body to keep in memory before it goes to disk
+    patch_spool_size = 1024 * 1024
+
+    __slots__ = ("repo", "a_binsha", "b_binsha", "a_mode", "b_mode", "a_rawpath", "b_rawpath",
                  "new_file", "deleted_file", "raw_rename_from", "raw_rename_to",
                  "diff", "change_type")
 
@@ -256,28 +583,23 @@ class Diff(object):
                  b_mode, new_file, deleted_file, raw_rename_from,
                  raw_rename_to, diff, change_type):
 
-        self.a_mode = a_mode
-        self.b_mode = b_mode
+        self.repo = repo
 
         assert a_rawpath is None or isinstance(a_rawpath, binary_type)
         assert b_rawpath is None or isinstance(b_rawpath, binary_type)
         self.a_rawpath = a_rawpath
         self.b_rawpath = b_rawpath
 
-        if self.a_mode:
-            self.a_mode = mode_str_to_int(self.a_mode)
-        if self.b_mode:
-            self.b_mode = mode_str_to_int(self.b_mode)
+        self.a_mode = a_mode and _shared_mode(a_mode)
+        self.b_mode = b_mode and _shared_mode(b_mode)
 
-        if a_blob_id is None or a_blob_id == self.NULL_HEX_SHA:
-            self.a_blob = None
-        else:
-            self.a_blob = Blob(repo, hex_to_bin(a_blob_id), mode=self.a_mode, path=self.a_path)
-
-        if b_blob_id is None or b_blob_id == self.NULL_HEX_SHA:
-            self.b_blob = None
-        else:
-            self.b_blob = Blob(repo, hex_to_bin(b_blob_id), mode=self.b_mode, path=self.b_path)
+        # keep 20 byte shas only, blobs are created on access
+        self.a_binsha = None
+        if a_blob_id is not None and a_blob_id not in (self.NULL_HEX_SHA, self.NULL_BIN_SHA):
+            self.a_binsha = to_bin_sha(a_blob_id)
+        self.b_binsha = None
+        if b_blob_id is not None and b_blob_id not in (self.NULL_HEX_SHA, self.NULL_BIN_SHA):
+            self.b_binsha = to_bin_sha(b_blob_id)
 
         self.new_file = new_file
         self.deleted_file = deleted_file
@@ -289,6 +611,8 @@ class Diff(object):
         self.raw_rename_to = raw_rename_to or None
 
         self.diff = diff
+        if change_type is not None:
+            change_type = _shared_change_types.setdefault(change_type, change_type)
         self.change_type = change_type
 
     def __eq__(self, other):
@@ -337,8 +661,16 @@ class Diff(object):
             msg += '\nfile renamed to %r' % self.rename_to
         if self.diff:
             msg += '\n---'
+            diff = self.diff
+            if hasattr(diff, 'read'):
+                # a spooled patch body, leave it as we found it
+                pos = diff.tell()
+                diff.seek(0)
+                diff = diff.read()
+                self.diff.seek(pos)
+            # END handle spooled patch
             try:
-                msg += self.diff.decode(defenc)
+                msg += diff.decode(defenc)
             except UnicodeDecodeError:
                 msg += 'OMITTED BINARY DATA'
             # end handle encoding
@@ -353,6 +685,20 @@ class Diff(object):
         # end
         return res
 
+    @property
+    def a_blob(self):
+        """:return: Blob on our a side, or None if there is none"""
+        if self.a_binsha is None:
+            return None
+        return Blob(self.repo, self.a_binsha, mode=self.a_mode, path=self.a_path)
+
+    @property
+    def b_blob(self):
+        """:return: Blob on our b side, or None if there is none"""
+        if self.b_binsha is None:
+            return None
+        return Blob(self.repo, self.b_binsha, mode=self.b_mode, path=self.b_path)
+
     @property
     def a_path(self):
         return self.a_rawpath.decode(defenc, 'replace') if self.a_rawpath else None
@@ -396,59 +742,176 @@ class Diff(object):
 
         return None
 
+    @classmethod
+    def _from_patch_header(cls, repo, header):
+        """:return: Diff without patch body, created from the given match of our re_header"""
+        a_path_fallback, b_path_fallback, \
+            old_mode, new_mode, \
+            rename_from, rename_to, \
+            new_file_mode, deleted_file_mode, \
+            a_blob_id, b_blob_id, b_mode, \
+            a_path, b_path = header.groups()
+
+        new_file, deleted_file = bool(new_file_mode), bool(deleted_file_mode)
+
+        a_path = cls._pick_best_path(a_path, rename_from, a_path_fallback)
+        b_path = cls._pick_best_path(b_path, rename_to, b_path_fallback)
+
+        # Make sure the mode is set if the path is set. Otherwise the resulting blob is invalid
+        # We just use the one mode we should have parsed
+        a_mode = old_mode or deleted_file_mode or (a_path and (b_mode or new_mode or new_file_mode))
+        b_mode = b_mode or new_mode or new_file_mode or (b_path and a_mode)
+        return Diff(repo,
+                    a_path,
+                    b_path,
+                    a_blob_id and a_blob_id.decode(defenc),
+                    b_blob_id and b_blob_id.decode(defenc),
+                    a_mode and a_mode.decode(defenc),
+                    b_mode and b_mode.decode(defenc),
+                    new_file, deleted_file,
+                    rename_from,
+                    rename_to,
+                    None, None)
+
     @classmethod
     def _index_from_patch_format(cls, repo, stream):
         """Create a new DiffIndex from the given text which must be in patch format
         :param repo: is the repository we are operating on - it is required
         :param stream: result of 'git diff' as a stream (supporting file protocol)
         :return: git.DiffIndex """
-        # for now, we have to bake the stream
-        text = stream.read()
         index = DiffIndex()
-        previous_header = None
-        for header in cls.re_header.finditer(text):
-            a_path_fallback, b_path_fallback, \
-                old_mode, new_mode, \
-                rename_from, rename_to, \
-                new_file_mode, deleted_file_mode, \
-                a_blob_id, b_blob_id, b_mode, \
-                a_path, b_path = header.groups()
-
-            new_file, deleted_file = bool(new_file_mode), bool(deleted_file_mode)
-
-            a_path = cls._pick_best_path(a_path, rename_from, a_path_fallback)
-            b_path = cls._pick_best_path(b_path, rename_to, b_path_fallback)
-
-            # Our only means to find the actual text is to see what has not been matched by our regex,
-            # and then retro-actively assin it to our index
-            if previous_header is not None:
-                index[-1].diff = text[previous_header.end():header.start()]
-            # end assign actual diff
-
-            # Make sure the mode is set if the path is set. Otherwise the resulting blob is invalid
-            # We just use the one mode we should have parsed
-            a_mode = old_mode or deleted_file_mode or (a_path and (b_mode or new_mode or new_file_mode))
-            b_mode = b_mode or new_mode or new_file_mode or (b_path and a_mode)
-            index.append(Diff(repo,
-                              a_path,
-                              b_path,
-                              a_blob_id and a_blob_id.decode(defenc),
-                              b_blob_id and b_blob_id.decode(defenc),
-                              a_mode and a_mode.decode(defenc),
-                              b_mode and b_mode.decode(defenc),
-                              new_file, deleted_file,
-                              rename_from,
-                              rename_to,
-                              None, None))
-
-            previous_header = header
-        # end for each header we parse
-        if index:
-            index[-1].diff = text[header.end():]
-        # end assign last diff
-
+        index.extend(cls._iter_from_patch_format(repo, stream))
         return index
 
+    @classmethod
+    def _iter_from_patch_format(cls, repo, stream, patch_bodies=PATCH_KEEP, chunk_size=64 * 1024):
+        """Incrementally parse the given stream which must be in patch format.
+
+        The stream is read chunk-wise, and only the section of the file currently being
+        parsed is buffered. A Diff is yielded as soon as its section is complete.
+
+        :param repo: is the repository we are operating on - it is required
+        :param stream: result of 'git diff' as a stream (supporting file protocol)
+        :param patch_bodies:
+            Defines what happens with the patch text following each header, namely
+
+            * PATCH_KEEP to keep it as bytes in the diff attribute
+            * PATCH_SKIP to drop it, the diff attribute will be None
+            * PATCH_SPOOL to write it into a temporary file which is kept in memory only
+              while it is smaller than Diff.patch_spool_size bytes. The diff attribute
+              is the file object, positioned at its beginning.
+        :param chunk_size: amount of bytes to read from the stream at once
+        :return: iterator yielding Diff instances"""
+        if patch_bodies not in (PATCH_KEEP, PATCH_SKIP, PATCH_SPOOL):
+            raise ValueError("Invalid patch body handling: %r" % patch_bodies)
+        # END check patch bodies
+
+        read = stream.read
+        marker = b'\ndiff --git '
+        overlap = len(marker) - 1   # amount of bytes which may contain the start of a partial marker
+
+        # the virtual newline lets us find the very first header like any other one
+        buf = b'\n'
+        eof = False
+        diff = None         # the diff whose patch body we are reading, or None while looking for a header
+        body = None         # list of body parts or file, depending on patch_bodies
+        put = None          # method to hand body data to body, or None if bodies are skipped
+        body_start = 0      # offset into buf at which unconsumed body data starts
+        scan = 0            # offset into buf at which to look for the next marker
+        while True:
+            if diff is None:
+                start = buf.find(marker)
+                if start == -1:
+                    if eof:
+                        break
+                    # anything before the first header is no diff, like the commit line of diff-tree
+                    chunk = read(chunk_size)
+                    eof = not chunk
+                    buf = buf[-overlap:] + chunk
+                    continue
+                # END handle missing header
+
+                # we need all header lines before we can match it, and at least one line
+                # beyond so that the last of them is not taken for a truncated one
+                if not eof and not _patch_header_complete(buf, start + 1):
+                    chunk = read(chunk_size)
+                    eof = not chunk
+                    buf = buf[start:] + chunk
+                    continue
+                # END read complete header
+
+                header = cls.re_header.match(buf, start + 1)
+                diff = cls._from_patch_header(repo, header)
+                if patch_bodies == PATCH_KEEP:
+                    body = list()
+                    put = body.append
+                elif patch_bodies == PATCH_SPOOL:
+                    body = tempfile.SpooledTemporaryFile(max_size=cls.patch_spool_size)
+                    put = body.write
+                # END prepare body
+
+                # the header ends behind a newline, which starts the next marker if there is no body
+                body_start = header.end()
+                scan = body_start - 1
+            # END handle header
+
+            end = buf.find(marker, scan)
+            if end == -1 and not eof:
+                # hand over all we have, except for what may be the beginning of the next marker
+                cut = max(body_start, len(buf) - overlap)
+                if put is not None and cut > body_start:
+                    put(buf[body_start:cut])
+                chunk = read(chunk_size)
+                eof = not chunk
+                buf = buf[cut:] + chunk
+                body_start = scan = 0
+                continue
+            # END read more body data
+
+            # the body includes the newline preceding the next header
+            end = len(buf) if end == -1 else end + 1
+            if put is not None:
+                put(buf[body_start:end])
+                if patch_bodies == PATCH_KEEP:
+                    diff.diff = b''.join(body)
+                else:
+                    body.seek(0)
+                    diff.diff = body
+                # END assign body
+            # END handle body
+
+            yield diff
+            diff = body = put = None
+
+            # keep the newline, the marker of the next header starts with it
+            buf = buf[end - 1:]
+        # END while there is data
+
+    @classmethod
+    def _from_raw_record(cls, repo, meta, a_path, b_path):
+        """:return: Diff created from the decoded meta data of a raw format record, like
+            '100644 100644 687099101... 37c5e30c8... M', and the raw source and destination paths"""
+        old_mode, new_mode, a_blob_id, b_blob_id, change_type = meta.split(None, 4)
+        deleted_file = False
+        new_file = False
+        rename_from = None
+        rename_to = None
+
+        # NOTE: We cannot conclude from the existance of a blob to change type
+        # as diffs with the working do not have blobs yet
+        if change_type == 'D':
+            b_blob_id = None
+            deleted_file = True
+        elif change_type == 'A':
+            a_blob_id = None
+            new_file = True
+        elif change_type[0] == 'R':     # parses RXXX, where XXX is a confidence value
+            rename_from, rename_to = a_path, b_path
+        # END add/remove handling
+
+        return Diff(repo, a_path, b_path, a_blob_id, b_blob_id, old_mode, new_mode,
+                    new_file, deleted_file, rename_from, rename_to, '', change_type)
+
     @classmethod
     def _index_from_raw_format(cls, repo, stream):
         """Create a new DiffIndex from the given stream which must be in raw format.
@@ -462,33 +925,296 @@ class Diff(object):
                 continue
             # END its not a valid diff line
             meta, _, path = line[1:].partition('\t')
-            old_mode, new_mode, a_blob_id, b_blob_id, change_type = meta.split(None, 4)
             path = path.strip()
-            a_path = path.encode(defenc)
-            b_path = path.encode(defenc)
-            deleted_file = False
-            new_file = False
-            rename_from = None
-            rename_to = None
-
-            # NOTE: We cannot conclude from the existance of a blob to change type
-            # as diffs with the working do not have blobs yet
-            if change_type == 'D':
-                b_blob_id = None
-                deleted_file = True
-            elif change_type == 'A':
-                a_blob_id = None
-                new_file = True
-            elif change_type[0] == 'R':     # parses RXXX, where XXX is a confidence value
+            if meta.rsplit(None, 1)[-1][0] == 'R':
                 a_path, b_path = path.split('\t', 1)
-                a_path = a_path.encode(defenc)
-                b_path = b_path.encode(defenc)
-                rename_from, rename_to = a_path, b_path
-            # END add/remove handling
-
-            diff = Diff(repo, a_path, b_path, a_blob_id, b_blob_id, old_mode, new_mode,
-                        new_file, deleted_file, rename_from, rename_to, '', change_type)
-            index.append(diff)
+                a_path, b_path = a_path.encode(defenc), b_path.encode(defenc)
+            else:
+                a_path = b_path = path.encode(defenc)
+            # END handle rename
+            index.append(cls._from_raw_record(repo, meta, a_path, b_path))
         # END for each line
 
         return index
+
+    @classmethod
+    def _iter_from_raw_z_format(cls, repo, stream, chunk_size=64 * 1024, headers=False):
+        """Incrementally parse the given stream which must be in NUL terminated raw format,
+        as produced by git diff --raw -z.
+
+        Records look like ':meta\0path\0', or ':meta\0src_path\0dst_path\0' for renames
+        and copies. The stream is read chunk-wise, and a Diff is yielded as soon as its
+        last field was received, keeping memory usage independent of the size of the diff.
+        Only the meta data is decoded, paths are kept as the bytes git gave us.
+
+        :param stream: stream supporting the read method. If it supports read1, it is used
+            instead to get hold of available data without waiting for a full chunk.
+        :param chunk_size: amount of bytes to read from the stream at once
+        :param headers: if True, fields which are no part of a record, like the commit
+            shas printed by git diff-tree --stdin, are yielded as bytes as well.
+        :return: iterator yielding Diff instances"""
+        read = getattr(stream, 'read1', stream.read)
+        buf = b''
+        pos = 0
+        meta = None         # decoded meta data of the current record, if we are within one
+        paths = list()      # paths received for the current record so far
+        npaths = 0          # amount of paths the current record requires
+        while True:
+            end = buf.find(b'\0', pos)
+            if end == -1:
+                chunk = read(chunk_size)
+                if not chunk:
+                    break
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            # END fetch more data
+
+            field = buf[pos:end]
+            pos = end + 1
+
+            if meta is None:
+                if not field.startswith(b':'):
+                    if headers and field:
+                        yield field
+                    continue
+                # END handle everything that is not a record, like commit shas
+                meta = field[1:].decode(defenc)
+                # renames and copies are followed by two paths, everything else by one
+                npaths = 1
+                if meta.rsplit(None, 1)[-1][0] in 'RC':
+                    npaths = 2
+                # END handle amount of paths
+                continue
+            # END handle meta data
+
+            paths.append(field)
+            if len(paths) < npaths:
+                continue
+            # END wait for all paths
+
+            yield cls._from_raw_record(repo, meta, paths[0], paths[-1])
+            meta = None
+            del(paths[:])
+        # END for each field
+
+
+#{ Rename Detection
+
+def _fingerprint(data):
+    """:return: dict(chunk_hash: byte_count) describing the given blob data. Chunks end at
+        newlines or after 64 bytes, whichever comes first. Every byte of the data is counted
+        exactly once"""
+    counts = dict()
+    get = counts.get
+    for line in data.splitlines(True):
+        for i in range(0, len(line), 64):
+            chunk = line[i:i + 64]
+            # unlike hash(), crc32 does not change between processes, nor do the chunks sampled
+            key = zlib.crc32(chunk) & 0xffffffff
+            counts[key] = get(key, 0) + len(chunk)
+        # END for each chunk of the line
+    # END for each line
+    return counts
+
+
+def _sample_level(counts, max_size):
+    """:return: smallest sample level at which the fingerprint has no more than max_size hashes.
+        At level n, only hashes divisible by 2 ** n are kept"""
+    level = 0
+    size = len(counts)
+    while size > max_size:
+        level += 1
+        mask = (1 << level) - 1
+        size = sum(1 for key in counts if not key & mask)
+    # END while the sample is too large
+    return level
+
+
+def _sample(counts, level):
+    """:return: fingerprint with only those hashes kept which belong to the given sample level"""
+    if not level:
+        return counts
+    mask = (1 << level) - 1
+    return dict((key, size) for key, size in counts.items() if not key & mask)
+
+
+class RenameDetector(object):
+
+    """Pairs deleted and added blobs of a diff into renames without running git.
+
+    First, blobs with identical content are paired using a table of added blobs keyed by
+    their binary sha, preferring those with the same file name. The blobs left over are then
+    compared by content, which is summarized as a fingerprint of the hashed chunks making up
+    their data. The similarity of two blobs is the amount of bytes their fingerprints
+    have in common, relative to the size of the larger one.
+
+    Fingerprints of large blobs are sampled by only keeping the hashes divisible by a power
+    of two. Two fingerprints are compared at the sample level of the coarser one, hence
+    they always see the same subset of chunks."""
+    __slots__ = ("similarity", "max_candidates", "max_fingerprint_size")
+
+    def __init__(self, similarity=50, max_candidates=1000 * 1000, max_fingerprint_size=4096):
+        """
+        :param similarity: minimum similarity in percent for two blobs to be considered a rename
+        :param max_candidates: if there are more pairs of deleted and added blobs than this,
+            only renames of identical content are detected
+        :param max_fingerprint_size: amount of chunk hashes a fingerprint may keep before
+            it is sampled"""
+        self.similarity = similarity
+        self.max_candidates = max_candidates
+        self.max_fingerprint_size = max_fingerprint_size
+
+    def _fingerprints(self, repo, binshas):
+        """:return: dict(binsha: (sample_level, fingerprint, size)) for all given blob shas"""
+        out = dict()
+        stream = repo.odb.stream
+        for binsha in binshas:
+            if binsha in out:
+                continue
+            data = stream(binsha).read()
+            counts = _fingerprint(data)
+            level = _sample_level(counts, self.max_fingerprint_size)
+            out[binsha] = (level, _sample(counts, level), len(data))
+        # END for each blob
+        return out
+
+    def _score(self, a, b):
+        """:return: similarity of the given fingerprint records in percent"""
+        a_level, a_counts, a_size = a
+        b_level, b_counts, b_size = b
+        if a_size < b_size:
+            a_size, b_size = b_size, a_size
+        if b_size * 100 < a_size * self.similarity:
+            return 0
+        # END reject pairs of very different size
+
+        if a_level < b_level:
+            a_counts = _sample(a_counts, b_level)
+        elif b_level < a_level:
+            b_counts = _sample(b_counts, a_level)
+        # END compare at the same sample level
+        if len(a_counts) > len(b_counts):
+            a_counts, b_counts = b_counts, a_counts
+
+        get = b_counts.get
+        common = 0
+        for key, size in a_counts.items():
+            common += min(size, get(key, 0))
+        # END for each chunk hash
+        total = max(sum(a_counts.values()), sum(b_counts.values()))
+        if not total:
+            return 0
+        return common * 100 // total
+
+    def detect(self, repo, diffs):
+        """Replace pairs of deleted and added blobs within the given diffs by renames.
+
+        :param repo: repository to read blob data from
+        :param diffs: iterable of Diff instances, as produced by a diff without rename detection.
+            Diffs against the working tree have no blob shas and are never paired.
+        :return: DiffIndex with all diffs that were not paired, in their original order,
+            followed by one Diff per detected rename. Its change_type is 'RXXX', XXX being
+            the similarity in percent"""
+        diffs = list(diffs)
+        deleted = list()        # indices of deleted diffs
+        added = list()          # indices of added diffs
+        for i, d in enumerate(diffs):
+            if d.deleted_file and d.a_binsha:
+                deleted.append(i)
+            elif d.new_file and d.b_binsha:
+                added.append(i)
+        # END for each diff
+
+        pairs = list()          # list of (deleted_index, added_index, score)
+        if deleted and added:
+            pairs = self._exact_pairs(diffs, deleted, added)
+            paired = set(p[0] for p in pairs) | set(p[1] for p in pairs)
+            deleted = [i for i in deleted if i not in paired]
+            added = [i for i in added if i not in paired]
+            if deleted and added and len(deleted) * len(added) <= self.max_candidates:
+                pairs.extend(self._inexact_pairs(repo, diffs, deleted, added))
+            # END detect renames of changed content
+        # END if there are candidates
+
+        paired = set(p[0] for p in pairs) | set(p[1] for p in pairs)
+        index = DiffIndex(d for i, d in enumerate(diffs) if i not in paired)
+        for di, ai, score in pairs:
+            d, a = diffs[di], diffs[ai]
+            index.append(Diff(repo, d.a_rawpath, a.b_rawpath, d.a_binsha, a.b_binsha, d.a_mode, a.b_mode,
+                              False, False, d.a_rawpath, a.b_rawpath, '', 'R%03d' % score))
+        # END for each rename
+        return index
+
+    def _exact_pairs(self, diffs, deleted, added):
+        """:return: list of (deleted_index, added_index, 100) tuples for blobs with identical content"""
+        by_sha = dict()
+        for ai in added:
+            by_sha.setdefault(diffs[ai].b_binsha, list()).append(ai)
+        # END for each added blob
+
+        pairs = list()
+        for di in deleted:
+            d = diffs[di]
+            candidates = by_sha.get(d.a_binsha)
+            if not candidates:
+                continue
+            # END skip blobs without twin
+
+            ftype = S_IFMT(d.a_mode)
+            name = d.a_rawpath.rsplit(b'/', 1)[-1]
+            best = None
+            for ci, ai in enumerate(candidates):
+                a = diffs[ai]
+                if S_IFMT(a.b_mode) != ftype:
+                    continue
+                if best is None:
+                    best = ci
+                if a.b_rawpath.rsplit(b'/', 1)[-1] == name:
+                    best = ci
+                    break
+                # END prefer same names
+            # END for each candidate
+            if best is not None:
+                pairs.append((di, candidates.pop(best), 100))
+        # END for each deleted blob
+        return pairs
+
+    def _inexact_pairs(self, repo, diffs, deleted, added):
+        """:return: list of (deleted_index, added_index, score) tuples for blobs with similar content,
+            each blob being part of one pair at most"""
+        prints = self._fingerprints(repo, [diffs[i].a_binsha for i in deleted] +
+                                    [diffs[i].b_binsha for i in added])
+        scores = list()
+        for di in deleted:
+            d = diffs[di]
+            ftype = S_IFMT(d.a_mode)
+            name = d.a_rawpath.rsplit(b'/', 1)[-1]
+            dprint = prints[d.a_binsha]
+            for ai in added:
+                a = diffs[ai]
+                if S_IFMT(a.b_mode) != ftype:
+                    continue
+                score = self._score(dprint, prints[a.b_binsha])
+                if score < self.similarity:
+                    continue
+                same_name = a.b_rawpath.rsplit(b'/', 1)[-1] == name
+                scores.append((score, same_name, -di, -ai))
+            # END for each added blob
+        # END for each deleted blob
+
+        # the best scoring pairs win, ties go to same names, then to the first diffs
+        scores.sort(reverse=True)
+        pairs = list()
+        done = set()
+        for score, same_name, di, ai in scores:
+            di, ai = -di, -ai
+            if di in done or ai in done:
+                continue
+            done.add(di)
+            done.add(ai)
+            pairs.append((di, ai, score))
+        # END for each candidate pair
+        return pairs
+
+#} END rename detection
@@ -15,6 +15,8 @@ from stat import S_ISLNK
 from .typ import (
     BaseIndexEntry,
     IndexEntry,
+    IndexEntries,
+    CacheTree
 )
 
 from .util import (
@@ -62,6 +64,8 @@ from .fun import (
     entry_key,
     write_cache,
     read_cache,
+    read_cache_tree,
+    write_cache_tree,
     aggressive_tree_merge,
     write_tree_from_cache,
     stat_mode_to_index_mode,
@@ -90,7 +94,8 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
     ``Entries``
 
     The index contains an entries dict whose keys are tuples of type IndexEntry
-    to facilitate access.
+    to facilitate access. Entries read from an index file are kept in a compact
+    IndexEntries mapping, which creates IndexEntry instances only when accessed.
 
     You may read the entries dict or manipulate it using IndexEntry instance, i.e.::
 
@@ -99,7 +104,7 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
     Make sure you use index.write() once you are done manipulating the index directly
     before operating on it using the git command"""
     __slots__ = ("repo", "version", "entries", "_extension_data", "_file_path")
-    _VERSION = 2            # latest version we support
+    _VERSION = 2            # version of new index files, versions up to 4 can be read and written
     S_IFGITLINK = S_IFGITLINK  # a submodule
 
     def __init__(self, repo, file_path=None):
@@ -165,19 +170,26 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
 
     def _deserialize(self, stream):
         """Initialize this instance with index values read from the given stream"""
-        self.version, self.entries, self._extension_data, conten_sha = read_cache(stream)
+        self.version, self.entries, extension_data, conten_sha = read_cache(stream)
+        self.entries.cache_tree, self._extension_data = read_cache_tree(extension_data)
         return self
 
     def _entries_sorted(self):
-        """:return: list of entries, in a sorted fashion, first by path, then by stage"""
+        """:return: sequence of entries, in a sorted fashion, first by path, then by stage"""
+        if isinstance(self.entries, IndexEntries):
+            return self.entries.sorted_values()
         return sorted(self.entries.values(), key=lambda e: (e.path, e.stage))
 
     def _serialize(self, stream, ignore_extension_data=False):
         entries = self._entries_sorted()
         extension_data = self._extension_data
+        cache_tree = getattr(self.entries, 'cache_tree', None)
+        if cache_tree is not None:
+            extension_data = write_cache_tree(cache_tree) + extension_data
+        # END write cache tree first, as git does
         if ignore_extension_data:
             extension_data = None
-        write_cache(entries, stream, extension_data)
+        write_cache(entries, stream, extension_data, version=max(self.version, self._VERSION))
         return self
 
     #} END serializable interface
@@ -194,13 +206,9 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         :param ignore_extension_data:
             If True, the TREE type extension data read in the index will not
             be written to disk. NOTE that no extension data is actually written.
-            Use this if you have altered the index and
-            would like to use git-write-tree afterwards to create a tree
-            representing your written changes.
-            If this data is present in the written index, git-write-tree
-            will instead write the stored/cached tree.
-            Alternatively, use IndexFile.write_tree() to handle this case
-            automatically
+            The TREE extension is kept up to date with the changes made to the
+            entries, it invalidates the trees of all directories containing them,
+            which git-write-tree and IndexFile.write_tree() will write again
 
         :return: self"""
         # make sure we have our entries read before getting a write lock
@@ -269,7 +277,7 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
             New IndexFile instance. Its path will be undefined.
             If you intend to write such a merged Index, supply an alternate file_path
             to its 'write' method."""
-        base_entries = aggressive_tree_merge(repo.odb, [to_bin_sha(str(t)) for t in tree_sha])
+        base_entries = aggressive_tree_merge(repo.odb, [to_bin_sha(str(t)) for t in tree_sha], repo.tree_cache)
 
         inst = cls(repo)
         # convert to entries dict
@@ -536,7 +544,15 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
         # If we are a new index, the entries access will load our data accordingly
         mdb = MemoryDB()
         entries = self._entries_sorted()
-        binsha, tree_items = write_tree_from_cache(entries, mdb, slice(0, len(entries)))
+        # the cache tree lets us skip all directories without changes
+        cache_tree = None
+        if isinstance(self.entries, IndexEntries):
+            if self.entries.cache_tree is None:
+                self.entries.cache_tree = CacheTree()
+            # END create cache tree
+            cache_tree = self.entries.cache_tree
+        # END handle cache tree
+        binsha, tree_items = write_tree_from_cache(entries, mdb, slice(0, len(entries)), 0, cache_tree)
 
         # copy changed trees only
         mdb.stream_copy(mdb.sha_iter(), self.repo.odb)
@@ -715,13 +731,12 @@ class IndexFile(LazyMixin, diff.Diffable, Serializable):
             the changes only exist in memory and are not available to git commands.
 
         :param write_extension_data:
-            If True, extension data will be written back to the index. This can lead to issues in case
-            it is containing the 'TREE' extension, which will cause the `git commit` command to write an
-            old tree, instead of a new one representing the now changed index.
-            This doesn't matter if you use `IndexFile.commit()`, which ignores the `TREE` extension altogether.
-            You should set it to True if you intend to use `IndexFile.commit()` exclusively while maintaining
-            support for third-party extensions. Besides that, you can usually safely ignore the built-in
-            extensions when using GitPython on repositories that are not handled manually at all.
+            If True, extension data will be written back to the index. The 'TREE' extension is
+            invalidated for all directories containing the added entries, which lets `git commit`
+            and `IndexFile.commit()` write only the trees of these directories.
+            You should set it to True to maintain support for third-party extensions. Besides that,
+            you can usually safely ignore the built-in extensions when using GitPython on repositories
+            that are not handled manually at all.
             All current built-in extensions are listed here:
             http://opensource.apple.com/source/Git/Git-26/src/git-htmldocs/technical/index-format.txt
 
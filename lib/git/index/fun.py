@@ -11,6 +11,8 @@ from stat import (
 )
 
 from io import BytesIO
+from mmap import mmap
+from struct import Struct
 import os
 import subprocess
 
@@ -21,20 +23,26 @@ from git.exc import (
 )
 from git.objects.fun import (
     tree_to_stream,
-    traverse_tree_recursive,
-    traverse_trees_recursive
+    iter_tree_recursive,
+    iter_trees_recursive
 )
 
 from .typ import (
     BaseIndexEntry,
-    IndexEntry,
+    IndexEntries,
+    CacheTree,
     CE_NAMEMASK,
-    CE_STAGESHIFT
+    CE_STAGEMASK,
+    CE_STAGESHIFT,
+    CE_EXTENDED,
+    CE_EXTENDED_SHIFT,
+    CE_INTENT_TO_ADD
 )
 
 from .util import (
     pack,
-    unpack
+    unpack,
+    unpack_from
 )
 
 from gitdb.base import IStream
@@ -42,14 +50,26 @@ from gitdb.typ import str_tree_type
 from git.compat import (
     defenc,
     force_text,
-    force_bytes
+    force_bytes,
+    byte_ord,
+    xrange
 )
 
 S_IFGITLINK = S_IFLNK | S_IFDIR     # a submodule
 CE_NAMEMASK_INV = ~CE_NAMEMASK
+CE_EXTENDED_INV = ~CE_EXTENDED
+CE_FLAGS_INV = ~(CE_NAMEMASK | CE_EXTENDED)
 
-__all__ = ('write_cache', 'read_cache', 'write_tree_from_cache', 'entry_key',
-           'stat_mode_to_index_mode', 'S_IFGITLINK', 'run_commit_hook', 'hook_path')
+# dev, ino, mode, uid, gid, size and flags of an entry, which are surrounded by its ctime and mtime
+# as well as its sha, and followed by its path
+_entry_struct = Struct(">16xLLLLLL20xH")
+# all fields of an entry in the order they are written, optionally followed by extended flags
+_write_entry_struct = Struct(">8s8sLLLLLL20sH")
+_write_extended_entry_struct = Struct(">8s8sLLLLLL20sHH")
+_header_struct = Struct(">4sLL")
+
+__all__ = ('write_cache', 'read_cache', 'write_tree_from_cache', 'entry_key', 'read_cache_tree',
+           'write_cache_tree', 'stat_mode_to_index_mode', 'S_IFGITLINK', 'run_commit_hook', 'hook_path')
 
 
 def hook_path(name, git_dir):
@@ -96,7 +116,51 @@ def stat_mode_to_index_mode(mode):
     return S_IFREG | 0o644 | (mode & 0o111)       # blobs with or without executable bit
 
 
-def write_cache(entries, stream, extension_data=None, ShaStreamCls=IndexFileSHA1Writer):
+def _encode_varint(value):
+    """:return: bytes encoding the given non-negative integer as a variable length integer, which
+        stores 7 bits per byte, most significant first, and adds one to all but the last group
+        of bits. Used by index version 4"""
+    varint = [value & 127]
+    value >>= 7
+    while value:
+        value -= 1
+        varint.append(128 | (value & 127))
+        value >>= 7
+    # END for each group of 7 bits
+    varint.reverse()
+    return bytes(bytearray(varint))
+
+
+def _decode_varint(data, offset):
+    """:return: tuple(value, offset_after_varint) of the variable length integer encoded at the given
+        offset of data, see ``_encode_varint``"""
+    c = byte_ord(data[offset])
+    offset += 1
+    value = c & 127
+    while c & 128:
+        c = byte_ord(data[offset])
+        offset += 1
+        value = ((value + 1) << 7) | (c & 127)
+    # END for each byte
+    return value, offset
+
+
+def _common_prefix_length(a, b):
+    """:return: length of the common prefix of the given strings"""
+    lo = 0
+    hi = min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+        # END bisect
+    # END while not found
+    return lo
+
+
+def write_cache(entries, stream, extension_data=None, ShaStreamCls=IndexFileSHA1Writer, version=2):
     """Write the cache represented by entries to a stream
 
     :param entries: **sorted** list of entries
@@ -107,34 +171,59 @@ def write_cache(entries, stream, extension_data=None, ShaStreamCls=IndexFileSHA1
         while writing to it, before the data is passed on to the wrapped stream
 
     :param extension_data: any kind of data to write as a trailer, it must begin
-        a 4 byte identifier, followed by its size ( 4 bytes )"""
-    # wrap the stream into a compatible writer
-    stream = ShaStreamCls(stream)
-
-    tell = stream.tell
-    write = stream.write
-
-    # header
-    version = 2
-    write(b"DIRC")
-    write(pack(">LL", version, len(entries)))
-
-    # body
-    for entry in entries:
-        beginoffset = tell()
-        write(entry[4])         # ctime
-        write(entry[5])         # mtime
-        path = entry[3]
-        path = force_bytes(path, encoding=defenc)
-        plen = len(path) & CE_NAMEMASK      # path length
-        assert plen == len(path), "Path %s too long to fit into index" % entry[3]
-        flags = plen | (entry[2] & CE_NAMEMASK_INV)     # clear possible previous values
-        write(pack(">LLLLLL20sH", entry[6], entry[7], entry[0],
-                   entry[8], entry[9], entry[10], entry[1], flags))
-        write(path)
-        real_size = ((tell() - beginoffset + 8) & ~7)
-        write(b"\0" * ((beginoffset + real_size) - tell()))
+        a 4 byte identifier, followed by its size ( 4 bytes )
+
+    :param version: version of the index format to write, from 2 to 4. Version 3 is
+        used instead of 2 if entries have extended flags. Version 4 compresses each
+        path by omitting the prefix it shares with the previous one"""
+    assert 2 <= version <= 4, "Cannot write index version %i" % version
+    # all entries are packed into a single buffer, which is grown as needed. It is zeroed,
+    # which leaves the null bytes terminating and padding each path in place already
+    buf = bytearray(12 + len(entries) * 96)
+    pack_entry = _write_entry_struct.pack_into
+    pack_extended_entry = _write_extended_entry_struct.pack_into
+    pos = 12
+    num_entries = 0
+    prev_path = b""
+    for mode, binsha, flags, path, ctime, mtime, dev, inode, uid, gid, size in entries:
+        if not isinstance(path, bytes):
+            path = path.encode(defenc)
+        # END encode path
+        extended_flags = flags >> CE_EXTENDED_SHIFT
+        # longer paths are stored with all bits of the length set, and are null-terminated
+        flags = (len(path) < CE_NAMEMASK and len(path) or CE_NAMEMASK) | (flags & CE_FLAGS_INV & 0xffff)
+        path_start = pos + (extended_flags and 64 or 62)
+        if version == 4:
+            common = _common_prefix_length(prev_path, path)
+            prev_path, path = path, _encode_varint(len(prev_path) - common) + path[common:]
+            end = path_start + len(path) + 1
+        else:
+            # entries are padded with 1 to 8 null bytes to a multiple of 8 bytes
+            end = pos + ((path_start - pos + len(path) + 8) & ~7)
+        # END handle path compression
+        if end > len(buf):
+            buf.extend(bytearray(max(len(buf), end - len(buf))))
+        # END grow buffer
+
+        if extended_flags:
+            if version == 2:
+                version = 3
+            # END upgrade version
+            pack_extended_entry(buf, pos, ctime, mtime, dev, inode, mode, uid, gid, size, binsha,
+                                flags | CE_EXTENDED, extended_flags)
+        else:
+            pack_entry(buf, pos, ctime, mtime, dev, inode, mode, uid, gid, size, binsha, flags)
+        # END handle extended flags
+        buf[path_start:path_start + len(path)] = path
+        pos = end
+        num_entries += 1
     # END for each entry
+    del(buf[pos:])
+    _header_struct.pack_into(buf, 0, b"DIRC", version, num_entries)
+
+    # wrap the stream into a compatible writer, which hashes the whole buffer at once
+    stream = ShaStreamCls(stream)
+    stream.write(buf)
 
     # write previously cached extensions data
     if extension_data is not None:
@@ -151,8 +240,7 @@ def read_header(stream):
         raise AssertionError("Invalid index file header: %r" % type_id)
     version, num_entries = unpack(">LL", stream.read(4 * 2))
 
-    # TODO: handle version 3: extended data, see read-cache.c
-    assert version in (1, 2)
+    assert version in (1, 2, 3, 4)
     return version, num_entries
 
 
@@ -166,35 +254,87 @@ def entry_key(*entry):
     # END handle entry
 
 
+def _cache_data(stream):
+    """:return: tuple(data, offset) with data supporting slices and the buffer protocol, holding the
+        contents of the given stream, and the offset of the stream's position within it.
+        Memory maps are used directly, nothing is copied"""
+    if isinstance(stream, mmap):
+        return stream, stream.tell()
+    try:
+        getvalue = stream.getvalue
+    except AttributeError:
+        return stream.read(), 0
+    # END handle streams without buffer
+    return getvalue(), stream.tell()
+
+
 def read_cache(stream):
     """Read a cache file from the given stream
     :return: tuple(version, entries_dict, extension_data, content_sha)
-    * version is the integer version number
-    * entries dict is a dictionary which maps IndexEntry instances to a path at a stage
+    * version is the integer version number, from 1 to 4
+    * entries dict is an IndexEntries mapping of path and stage to IndexEntry instances
     * extension_data is '' or 4 bytes of type + 4 bytes of size + size bytes
-    * content_sha is a 20 byte sha on all cache file contents"""
-    version, num_entries = read_header(stream)
-    count = 0
-    entries = dict()
-
-    read = stream.read
-    tell = stream.tell
-    while count < num_entries:
-        beginoffset = tell()
-        ctime = unpack(">8s", read(8))[0]
-        mtime = unpack(">8s", read(8))[0]
-        (dev, ino, mode, uid, gid, size, sha, flags) = \
-            unpack(">LLLLLL20sH", read(20 + 4 * 6 + 2))
-        path_size = flags & CE_NAMEMASK
-        path = read(path_size).decode(defenc)
-
-        real_size = ((tell() - beginoffset + 8) & ~7)
-        read((beginoffset + real_size) - tell())
-        entry = IndexEntry((mode, sha, flags, path, ctime, mtime, dev, ino, uid, gid, size))
-        # entry_key would be the method to use, but we safe the effort
-        entries[(path, entry.stage)] = entry
-        count += 1
+    * content_sha is a 20 byte sha on all cache file contents
+    :note: entries are unpacked right from the stream's memory if it is memory mapped or
+        a BytesIO, other streams are read at once"""
+    data, pos = _cache_data(stream)
+    type_id, version, num_entries = unpack_from(">4sLL", data, pos)
+    if type_id != b"DIRC":
+        raise AssertionError("Invalid index file header: %r" % type_id)
+    assert version in (1, 2, 3, 4)
+    pos += 12
+
+    columns = IndexEntries.columns()
+    modes, shas, flagss, paths, path_ends, times, devs, inodes, uids, gids, sizes = columns
+    unpack_entry = _entry_struct.unpack_from
+    find = data.find
+    ordered = True
+    prev_key = (b"", -1)
+    for _ in xrange(num_entries):
+        dev, ino, mode, uid, gid, size, flags = unpack_entry(data, pos)
+        path_start = pos + 62
+        if flags & CE_EXTENDED:
+            # the marker is implied by the extended flags, which we keep above the regular ones
+            flags = flags & CE_EXTENDED_INV | unpack_from(">H", data, path_start)[0] << CE_EXTENDED_SHIFT
+            path_start += 2
+        # END handle extended flags
+        if version == 4:
+            # the path replaces the given amount of bytes at the end of the previous one
+            strip, path_start = _decode_varint(data, path_start)
+            path_end = find(b"\0", path_start)
+            prev_path = prev_key[0]
+            path = prev_path[:len(prev_path) - strip] + data[path_start:path_end]
+            next_pos = path_end + 1
+        else:
+            path_end = path_start + (flags & CE_NAMEMASK)
+            if path_end - path_start == CE_NAMEMASK:
+                # the length of longer paths is only known by their terminating null byte
+                path_end = find(b"\0", path_start)
+            # END handle long paths
+            path = data[path_start:path_end]
+            # entries are padded with 1 to 8 null bytes to a multiple of 8 bytes
+            next_pos = pos + ((path_end - pos + 8) & ~7)
+        # END handle path compression
+        key = (path, (flags & CE_STAGEMASK) >> CE_STAGESHIFT)
+        if key <= prev_key:
+            ordered = False
+        # END check order
+        prev_key = key
+
+        times += data[pos:pos + 16]
+        shas += data[pos + 40:pos + 60]
+        paths += path
+        path_ends.append(len(paths))
+        modes.append(mode)
+        flagss.append(flags)
+        devs.append(dev)
+        inodes.append(ino)
+        uids.append(uid)
+        gids.append(gid)
+        sizes.append(size)
+        pos = next_pos
     # END for each entry
+    entries = IndexEntries(columns, ordered)
 
     # the footer contains extension data and a sha on the content so far
     # Keep the extension footer,and verify we have a sha in the end
@@ -202,7 +342,7 @@ def read_cache(stream):
     # 4 bytes ID
     # 4 bytes length of chunk
     # repeated 0 - N times
-    extension_data = stream.read(~0)
+    extension_data = data[pos:]
     assert len(extension_data) > 19, "Index Footer was not at least a sha on content as it was only %i bytes in size"\
                                      % len(extension_data)
 
@@ -214,7 +354,84 @@ def read_cache(stream):
     return (version, entries, extension_data, content_sha)
 
 
-def write_tree_from_cache(entries, odb, sl, si=0):
+def _read_cache_tree(data):
+    """:return: root CacheTree of the given data of a TREE extension, whose nodes are stored
+        depth first, each as its null-terminated name, its entry count and amount of subtrees
+        in ascii, and the sha of its tree unless it was invalidated"""
+    root = None
+    stack = list()      # list of [node, amount of subtrees still to be read]
+    pos = 0
+    while pos < len(data):
+        name_end = data.index(b"\0", pos)
+        name = data[pos:name_end].decode(defenc)
+        line_end = data.index(b"\n", name_end)
+        entry_count, num_subtrees = (int(n) for n in data[name_end + 1:line_end].split(b" "))
+        binsha = None
+        pos = line_end + 1
+        if entry_count > -1:
+            binsha = data[pos:pos + 20]
+            pos += 20
+        # END handle valid tree
+        node = CacheTree(entry_count, binsha)
+        if stack:
+            stack[-1][0].children[name] = node
+        else:
+            root = node
+        # END handle root
+        stack.append([node, num_subtrees])
+        while stack and not stack[-1][1]:
+            stack.pop()
+            if stack:
+                stack[-1][1] -= 1
+            # END count subtree as read
+        # END for each completed node
+    # END for each node
+    return root
+
+
+def read_cache_tree(extension_data):
+    """Separate the TREE extension from the given extension data, as returned by ``read_cache``
+
+    :return: tuple(cache_tree, extension_data) of the root CacheTree stored in the TREE extension,
+        or None if there is no such extension, and the data of all other extensions"""
+    cache_tree = None
+    other_data = list()
+    pos = 0
+    while pos + 8 <= len(extension_data):
+        signature, size = unpack_from(">4sL", extension_data, pos)
+        end = pos + 8 + size
+        if signature == b"TREE":
+            cache_tree = _read_cache_tree(extension_data[pos + 8:end])
+        else:
+            other_data.append(extension_data[pos:end])
+        # END handle extension
+        pos = end
+    # END for each extension
+    other_data.append(extension_data[pos:])
+    return cache_tree, b"".join(other_data)
+
+
+def write_cache_tree(cache_tree):
+    """:return: data of the TREE extension, including its header, storing the given root CacheTree
+        as read by ``read_cache_tree``"""
+    data = list()
+    stack = [(b"", cache_tree)]
+    while stack:
+        name, node = stack.pop()
+        data.append(name + b"\0" + ("%i %i\n" % (node.entry_count, len(node.children))).encode("ascii"))
+        if node.entry_count > -1:
+            data.append(node.binsha)
+        # END handle valid tree
+        # git orders subtrees by the length of their names first
+        children = sorted((len(name), name, child) for name, child in
+                          ((force_bytes(name, defenc), child) for name, child in node.children.items()))
+        stack.extend((name, child) for length, name, child in reversed(children))
+    # END for each node
+    data = b"".join(data)
+    return b"TREE" + pack(">L", len(data)) + data
+
+
+def write_tree_from_cache(entries, odb, sl, si=0, cache_tree=None):
     """Create a tree from the given sorted list of entries and put the respective
     trees into the given object database
 
@@ -222,10 +439,17 @@ def write_tree_from_cache(entries, odb, sl, si=0):
     :param odb: object database to store the trees in
     :param si: start index at which we should start creating subtrees
     :param sl: slice indicating the range we should process on the entries list
+    :param cache_tree: if not None, CacheTree of the directory to write. The trees of
+        its valid subtrees are used as they are, they are neither written nor are their
+        entries read. It is updated to represent the tree written
     :return: tuple(binsha, list(tree_entry, ...)) a tuple of a sha and a list of
-        tree entries being a tuple of hexsha, mode, name"""
+        tree entries being a tuple of hexsha, mode, name
+    :note: like git, entries added with intent to add are left out, as are directories
+        containing nothing else. The cache tree of their directories remains invalid"""
     tree_items = list()
+    subtrees = dict()
     tree_items_append = tree_items.append
+    contains_ita = False
     ci = sl.start
     end = sl.stop
     while ci < end:
@@ -237,23 +461,53 @@ def write_tree_from_cache(entries, odb, sl, si=0):
         rbound = entry.path.find('/', si)
         if rbound == -1:
             # its not a tree
+            if entry.flags & CE_INTENT_TO_ADD:
+                contains_ita = True
+                continue
+            # END skip entries to be added
             tree_items_append((entry.binsha, entry.mode, entry.path[si:]))
         else:
-            # find common base range
             base = entry.path[si:rbound]
-            xi = ci
-            while xi < end:
-                oentry = entries[xi]
-                orbound = oentry.path.find('/', si)
-                if orbound == -1 or oentry.path[si:orbound] != base:
-                    break
-                # END abort on base mismatch
-                xi += 1
-            # END find common base
-
-            # enter recursion
-            # ci - 1 as we want to count our current item as well
-            sha, tree_entry_list = write_tree_from_cache(entries, odb, slice(ci - 1, xi), rbound + 1)
+            subtree = None
+            if cache_tree is not None:
+                subtree = cache_tree.children.get(base)
+                if subtree is None:
+                    subtree = CacheTree()
+                # END create subtree
+                subtrees[base] = subtree
+            # END handle cache tree
+
+            # the entries of a valid subtree follow in the amount it stores, which is checked
+            # at the bounds to be safe
+            prefix = entry.path[:rbound + 1]
+            xi = ci - 1 + subtree.entry_count if subtree is not None else -1
+            if ci <= xi <= end and entries[xi - 1].path.startswith(prefix) and \
+                    (xi == end or not entries[xi].path.startswith(prefix)):
+                sha = subtree.binsha
+            else:
+                # find common base range
+                xi = ci
+                while xi < end:
+                    oentry = entries[xi]
+                    orbound = oentry.path.find('/', si)
+                    if orbound == -1 or oentry.path[si:orbound] != base:
+                        break
+                    # END abort on base mismatch
+                    xi += 1
+                # END find common base
+
+                # enter recursion
+                # ci - 1 as we want to count our current item as well
+                sha, tree_entry_list = write_tree_from_cache(entries, odb, slice(ci - 1, xi), rbound + 1, subtree)
+                if subtree is not None and subtree.entry_count < 0:
+                    contains_ita = True
+                # END propagate entries to be added
+                if not tree_entry_list:
+                    # only entries to be added, there is no tree
+                    ci = xi
+                    continue
+                # END skip empty trees
+            # END handle valid subtree
             tree_items_append((sha, S_IFDIR, base))
 
             # skip ahead
@@ -267,6 +521,16 @@ def write_tree_from_cache(entries, odb, sl, si=0):
     sio.seek(0)
 
     istream = odb.store(IStream(str_tree_type, len(sio.getvalue()), sio))
+    if cache_tree is not None:
+        if contains_ita:
+            cache_tree.entry_count = -1
+            cache_tree.binsha = None
+        else:
+            cache_tree.entry_count = end - sl.start
+            cache_tree.binsha = istream.binsha
+        # END handle entries to be added
+        cache_tree.children = subtrees
+    # END update cache tree
     return (istream.binsha, tree_items)
 
 
@@ -274,7 +538,7 @@ def _tree_entry_to_baseindexentry(tree_entry, stage):
     return BaseIndexEntry((tree_entry[1], tree_entry[0], stage << CE_STAGESHIFT, tree_entry[2]))
 
 
-def aggressive_tree_merge(odb, tree_shas):
+def aggressive_tree_merge(odb, tree_shas, cache=None):
     """
     :return: list of BaseIndexEntries representing the aggressive merge of the given
         trees. All valid entries are on stage 0, whereas the conflicting ones are left
@@ -282,14 +546,15 @@ def aggressive_tree_merge(odb, tree_shas):
         2 to our tree and 3 to 'their' tree.
     :param tree_shas: 1, 2 or 3 trees as identified by their binary 20 byte shas
         If 1 or two, the entries will effectively correspond to the last given tree
-        If 3 are given, a 3 way merge is performed"""
+        If 3 are given, a 3 way merge is performed
+    :param cache: git.util.LRUCache to read trees through, see tree_entries_from_sha"""
     out = list()
     out_append = out.append
 
     # one and two way is the same for us, as we don't have to handle an existing
     # index, instrea
     if len(tree_shas) in (1, 2):
-        for entry in traverse_tree_recursive(odb, tree_shas[-1], ''):
+        for entry in iter_tree_recursive(odb, tree_shas[-1], '', cache):
             out_append(_tree_entry_to_baseindexentry(entry, 0))
         # END for each entry
         return out
@@ -299,7 +564,7 @@ def aggressive_tree_merge(odb, tree_shas):
         raise ValueError("Cannot handle %i trees at once" % len(tree_shas))
 
     # three trees
-    for base, ours, theirs in traverse_trees_recursive(odb, tree_shas, ''):
+    for base, ours, theirs in iter_trees_recursive(odb, tree_shas, '', cache):
         if base is not None:
             # base version exists
             if ours is not None:
@@ -1,15 +1,38 @@
 """Module with additional types used by the index"""
 
+from array import array
 from binascii import b2a_hex
+from bisect import bisect_left
+from itertools import compress
+
+try:
+    from collections.abc import (
+        MutableMapping,
+        ItemsView,
+        ValuesView
+    )
+except ImportError:
+    from collections import (
+        MutableMapping,
+        ItemsView,
+        ValuesView
+    )
+# END handle python 2
 
 from .util import (
     pack,
     unpack
 )
 from git.objects import Blob
+from git.compat import (
+    defenc,
+    force_bytes,
+    xrange,
+    UINT_TYPECODE
+)
 
 
-__all__ = ('BlobFilter', 'BaseIndexEntry', 'IndexEntry')
+__all__ = ('BlobFilter', 'BaseIndexEntry', 'IndexEntry', 'IndexEntries', 'CacheTree')
 
 #{ Invariants
 CE_NAMEMASK = 0x0fff
@@ -18,6 +41,15 @@ CE_EXTENDED = 0x4000
 CE_VALID = 0x8000
 CE_STAGESHIFT = 12
 
+# extended flags of index version 3 and later, stored above the 16 bits of regular flags
+CE_INTENT_TO_ADD = 0x20000000
+CE_SKIP_WORKTREE = 0x40000000
+CE_EXTENDED_FLAGS = CE_INTENT_TO_ADD | CE_SKIP_WORKTREE
+CE_EXTENDED_SHIFT = 16
+
+# translation table turning a mask of removed rows into one of rows to keep
+_KEEP_TABLE = bytes(bytearray([1]) + bytearray(255))
+
 #} END invariants
 
 
@@ -98,7 +130,8 @@ class BaseIndexEntry(tuple):
 
     @property
     def flags(self):
-        """:return: flags stored with this entry"""
+        """:return: flags stored with this entry, including the extended flags of index version 3
+            and later, see CE_EXTENDED_FLAGS"""
         return self[2]
 
     @classmethod
@@ -174,3 +207,343 @@ class IndexEntry(BaseIndexEntry):
         time = pack(">LL", 0, 0)
         return IndexEntry((blob.mode, blob.binsha, stage << CE_STAGESHIFT, blob.path,
                            time, time, 0, 0, 0, 0, blob.size))
+
+
+class CacheTree(object):
+
+    """Node of git's cache tree, which remembers the sha of the tree of a directory of the index
+    and the amount of index entries below it, as stored in the TREE extension of an index file.
+
+    Nodes whose entry_count is -1 were invalidated by changes to the entries below them, their
+    tree needs to be written again."""
+    __slots__ = ('entry_count', 'binsha', 'children')
+
+    def __init__(self, entry_count=-1, binsha=None):
+        self.entry_count = entry_count
+        self.binsha = binsha
+        self.children = dict()      # name -> CacheTree of each subdirectory
+
+    def invalidate(self, path):
+        """Invalidate the trees of all directories containing the entry at the given path"""
+        names = path.split('/')
+        node = self
+        for name in names[:-1]:
+            node.entry_count = -1
+            node.binsha = None
+            node = node.children.get(name)
+            if node is None:
+                return
+            # END stop at unknown directories
+        # END for each directory
+        node.entry_count = -1
+        node.binsha = None
+        # a directory replaced by a file is gone
+        node.children.pop(names[-1], None)
+
+    def copy(self):
+        """:return: copy of this node and of all nodes below it"""
+        node = CacheTree(self.entry_count, self.binsha)
+        for name, child in self.children.items():
+            node.children[name] = child.copy()
+        # END for each child
+        return node
+
+
+class _SortedIndexEntries(object):
+
+    """Sequence of the entries of an IndexEntries instance sorted by path and stage, which
+    creates IndexEntry instances only when accessed, and only once"""
+    __slots__ = ('_entries', '_rows', '_changed', '_positions', '_created')
+
+    def __init__(self, entries):
+        self._entries = entries
+        rows = entries._order or xrange(len(entries._flags))
+        if entries._nremoved:
+            keep = entries._removed.translate(_KEEP_TABLE)
+            if entries._order:
+                keep = bytearray(keep[row] for row in rows)
+            # END reorder mask
+            rows = array(UINT_TYPECODE, compress(rows, keep))
+        # END skip removed rows
+        self._rows = rows
+
+        # entries set later are placed between the rows
+        changed = sorted((force_bytes(path, defenc), stage, entry)
+                         for (path, stage), entry in entries._changed.items())
+        self._changed = [entry for path, stage, entry in changed]
+        self._positions = [entries._bisect(rows, path, stage << CE_STAGESHIFT) + i
+                           for i, (path, stage, entry) in enumerate(changed)]
+        # entries created so far, by index, as write_tree_from_cache reads each once per directory level
+        self._created = [None] * len(self)
+
+    def __len__(self):
+        return len(self._rows) + len(self._changed)
+
+    def __getitem__(self, index):
+        entry = self._created[index]
+        if entry is not None:
+            return entry
+        # END handle known entry
+        if index < 0:
+            index += len(self)
+        # END handle negative indices
+        positions = self._positions
+        ci = bisect_left(positions, index)
+        if ci < len(positions) and positions[ci] == index:
+            return self._changed[ci]
+        # END handle changed entry
+        entry = self._entries._entry(self._rows[index - ci])
+        self._created[index] = entry
+        return entry
+
+    def __iter__(self):
+        positions = self._positions
+        changed = self._changed
+        entry = self._entries._entry
+        ci = 0
+        for index, row in enumerate(self._rows):
+            while ci < len(positions) and positions[ci] == index + ci:
+                yield changed[ci]
+                ci += 1
+            # END for each changed entry before this row
+            yield entry(row)
+        # END for each row
+        for ci in xrange(ci, len(changed)):
+            yield changed[ci]
+        # END for each remaining changed entry
+
+
+class _IndexEntriesValues(ValuesView):
+
+    def __iter__(self):
+        return self._mapping.itervalues()
+
+
+class _IndexEntriesItems(ItemsView):
+
+    def __iter__(self):
+        return self._mapping.iteritems()
+
+
+class IndexEntries(MutableMapping):
+
+    """Mapping of (path, stage) keys to IndexEntry instances, as read from an index file.
+
+    The entries read are kept in parallel arrays and a single blob of encoded paths, and
+    IndexEntry instances are created only when they are accessed. Lookups use binary search
+    on the entries ordered by their keys. Entries set later are kept in a regular dictionary.
+
+    If cache_tree is not None, it is the CacheTree of the entries, whose directories are
+    invalidated as entries change."""
+    __slots__ = ('_modes', '_shas', '_flags', '_paths', '_path_ends', '_times', '_devs', '_inodes',
+                 '_uids', '_gids', '_sizes', '_order', '_removed', '_nremoved', '_changed', 'cache_tree')
+
+    @staticmethod
+    def columns():
+        """:return: tuple(modes, shas, flags, paths, path_ends, times, devs, inodes, uids, gids, sizes)
+            of empty columns to be filled with the data of all entries, row by row, and passed to
+            our constructor. shas, paths and times are bytearrays receiving the binary sha, the encoded
+            path and ctime followed by mtime of each entry, path_ends the end offset of each path
+            within paths. All other columns are arrays of unsigned integers"""
+        uint = UINT_TYPECODE
+        return (array(uint), bytearray(), array(uint), bytearray(), array(uint), bytearray(),
+                array(uint), array(uint), array(uint), array(uint), array(uint))
+
+    def __init__(self, columns=None, ordered=True):
+        """:param columns: columns as returned by ``columns()``, filled with the data of all entries,
+            or None to start out empty
+        :param ordered: if True, the rows of the columns are sorted by path and stage already"""
+        if columns is None:
+            columns = self.columns()
+        # END handle empty mapping
+        (self._modes, shas, self._flags, paths, self._path_ends, times,
+         self._devs, self._inodes, self._uids, self._gids, self._sizes) = columns
+        self._shas = bytes(shas)
+        self._paths = bytes(paths)
+        self._times = bytes(times)
+        self._removed = bytearray(len(self._modes))
+        self._nremoved = 0
+        self._changed = dict()
+        self.cache_tree = None
+        self._order = None
+        if not ordered:
+            self._order = array(UINT_TYPECODE, sorted(xrange(len(self._modes)), key=self._row_key))
+        # END sort rows
+
+    #{ Utilities
+
+    def _row_key(self, row):
+        """:return: tuple(encoded_path, stage) of the given row"""
+        path_ends = self._path_ends
+        return (self._paths[row and path_ends[row - 1]:path_ends[row]],
+                (self._flags[row] & CE_STAGEMASK) >> CE_STAGESHIFT)
+
+    def _bisect(self, rows, path, stage_flags):
+        """:return: index into the given sequence of rows, sorted by their keys, at which the entry
+            with the given encoded path and stage shifted into flags would be inserted"""
+        paths = self._paths
+        path_ends = self._path_ends
+        flags = self._flags
+        lo = 0
+        hi = len(rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = rows[mid]
+            row_path = paths[row and path_ends[row - 1]:path_ends[row]]
+            if row_path < path or (row_path == path and flags[row] & CE_STAGEMASK < stage_flags):
+                lo = mid + 1
+            else:
+                hi = mid
+            # END bisect
+        # END while not found
+        return lo
+
+    def _find(self, key):
+        """:return: index of the row with the given key, or -1 if there is no such row
+            or if it was removed"""
+        try:
+            path, stage = key
+            path = force_bytes(path, defenc)
+            stage_flags = stage << CE_STAGESHIFT
+        except (TypeError, ValueError):
+            return -1
+        # END handle invalid keys
+        rows = self._order or xrange(len(self._flags))
+        index = self._bisect(rows, path, stage_flags)
+        if index == len(rows):
+            return -1
+        row = rows[index]
+        if self._removed[row] or self._row_key(row) != (path, stage):
+            return -1
+        return row
+
+    def _remove(self, row):
+        self._removed[row] = 1
+        self._nremoved += 1
+
+    def _iter_rows(self):
+        """:return: iterator over the rows which were not removed, in order of their keys"""
+        removed = self._removed
+        for row in (self._order or xrange(len(self._modes))):
+            if not removed[row]:
+                yield row
+            # END skip removed rows
+        # END for each row
+
+    def _entry(self, row):
+        """:return: IndexEntry of the given row"""
+        path_ends = self._path_ends
+        sha = row * 20
+        time = row * 16
+        times = self._times
+        return IndexEntry((self._modes[row], self._shas[sha:sha + 20], self._flags[row],
+                           self._paths[row and path_ends[row - 1]:path_ends[row]].decode(defenc),
+                           times[time:time + 8], times[time + 8:time + 16], self._devs[row],
+                           self._inodes[row], self._uids[row], self._gids[row], self._sizes[row]))
+
+    #} END utilities
+
+    #{ Interface
+
+    def __getitem__(self, key):
+        try:
+            return self._changed[key]
+        except KeyError:
+            pass
+        # END handle changed entries
+        row = self._find(key)
+        if row < 0:
+            raise KeyError(key)
+        return self._entry(row)
+
+    def __setitem__(self, key, entry):
+        row = self._find(key)
+        if row > -1:
+            self._remove(row)
+        # END replace existing row
+        self._changed[key] = entry
+        if self.cache_tree is not None:
+            self.cache_tree.invalidate(key[0])
+        # END invalidate cache tree
+
+    def __delitem__(self, key):
+        try:
+            del(self._changed[key])
+        except KeyError:
+            row = self._find(key)
+            if row < 0:
+                raise KeyError(key)
+            self._remove(row)
+        # END handle changed entries
+        if self.cache_tree is not None:
+            self.cache_tree.invalidate(key[0])
+        # END invalidate cache tree
+
+    def __contains__(self, key):
+        return key in self._changed or self._find(key) > -1
+
+    def __len__(self):
+        return len(self._modes) - self._nremoved + len(self._changed)
+
+    def __iter__(self):
+        path_ends = self._path_ends
+        paths = self._paths
+        flags = self._flags
+        for row in self._iter_rows():
+            yield (paths[row and path_ends[row - 1]:path_ends[row]].decode(defenc),
+                   (flags[row] & CE_STAGEMASK) >> CE_STAGESHIFT)
+        # END for each row
+        for key in self._changed:
+            yield key
+        # END for each changed entry
+
+    def itervalues(self):
+        """:return: iterator over all entries, those read from the index file first"""
+        for row in self._iter_rows():
+            yield self._entry(row)
+        # END for each row
+        for entry in self._changed.values():
+            yield entry
+        # END for each changed entry
+
+    def iteritems(self):
+        """:return: iterator over tuple(key, entry) pairs, see ``itervalues``"""
+        for row in self._iter_rows():
+            entry = self._entry(row)
+            yield ((entry.path, entry.stage), entry)
+        # END for each row
+        for item in self._changed.items():
+            yield item
+        # END for each changed entry
+
+    def values(self):
+        return _IndexEntriesValues(self)
+
+    def items(self):
+        return _IndexEntriesItems(self)
+
+    def sorted_values(self):
+        """:return: sequence of all entries sorted by path and stage, whose IndexEntry instances
+            are created only when accessed"""
+        return _SortedIndexEntries(self)
+
+    def clear(self):
+        self.__init__()
+
+    def copy(self):
+        """:return: copy of this mapping, which changes independently from us. It shares only
+            the columns of the entries read from the index file, which never change"""
+        other = type(self).__new__(type(self))
+        for name in ('_modes', '_shas', '_flags', '_paths', '_path_ends', '_times', '_devs', '_inodes',
+                     '_uids', '_gids', '_sizes', '_order'):
+            setattr(other, name, getattr(self, name))
+        # END for each column
+        other._removed = bytearray(self._removed)
+        other._nremoved = self._nremoved
+        other._changed = dict(self._changed)
+        other.cache_tree = self.cache_tree is not None and self.cache_tree.copy() or None
+        return other
+
+    __copy__ = copy
+
+    #} END interface
@@ -8,6 +8,7 @@ __all__ = ('TemporaryFileSwap', 'post_clear_cache', 'default_index', 'git_workin
 #{ Aliases
 pack = struct.pack
 unpack = struct.unpack
+unpack_from = struct.unpack_from
 
 
 #} END aliases
@@ -5,7 +5,14 @@
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
 
 from gitdb import IStream
-from gitdb.util import hex_to_bin
+from gitdb.exc import (
+    BadName,
+    BadObject
+)
+from gitdb.util import (
+    hex_to_bin,
+    bin_to_hex
+)
 from git.util import (
     Actor,
     Iterable,
@@ -16,17 +23,33 @@ from git.diff import Diffable
 
 from .tree import Tree
 from . import base
+from .fun import (
+    commit_header_from_data,
+    commit_fields_from_data,
+    tree_entries_by_path,
+    iter_commits_by_date,
+    GENERATION_INFINITY
+)
 from .util import (
     Traversable,
     Serializable,
     parse_date,
     altz_to_utctz_str,
     parse_actor_and_date,
+    utctz_to_altz,
+    intern_actor,
     from_timestamp,
 )
-from git.compat import text_type
+from git.compat import (
+    string_types,
+    text_type
+)
 
+from calendar import timegm
+from datetime import datetime
+from itertools import islice
 from time import (
+    mktime,
     time,
     daylight,
     altzone,
@@ -35,12 +58,47 @@ from time import (
 )
 import os
 from io import BytesIO
+from collections import deque as Deque
 import logging
 
 log = logging.getLogger('git.objects.commit')
 log.addHandler(logging.NullHandler())
 
-__all__ = ('Commit', )
+__all__ = ('Commit', 'CommitRecord')
+
+
+def _timestamp_from_date(date):
+    """:return: seconds since epoch for the given int, datetime or date string in git's internal
+        format, or None if git would have to interpret the date"""
+    if isinstance(date, int):
+        return date
+    if isinstance(date, datetime):
+        if date.tzinfo is None:
+            return int(mktime(date.timetuple()))
+        return timegm(date.utctimetuple())
+    # END handle date instances
+    if isinstance(date, string_types) and date.count(' ') == 1 and date.rfind(':') == -1:
+        try:
+            return parse_date(date)[0]
+        except ValueError:
+            pass
+        # END handle other formats
+    # END handle git's internal format
+    return None
+
+
+def _split_actor_line(line):
+    """:return: tuple(actor, int_seconds_since_epoch, utctz) parsed from the given undecoded
+        author or committer line, with the actor and git's utc timezone being undecoded bytes,
+        or None if the line is malformed"""
+    tokens = line.rsplit(b' ', 2)
+    if len(tokens) != 3 or not tokens[1].isdigit() or tokens[2][:1] not in (b'+', b'-') or \
+            not tokens[2][1:].isdigit():
+        return None
+    start = tokens[0].find(b' ')
+    if start < 0:
+        return None
+    return tokens[0][start + 1:], int(tokens[1]), tokens[2]
 
 
 class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
@@ -66,9 +124,15 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
     __slots__ = ("tree",
                  "author", "authored_date", "author_tz_offset",
                  "committer", "committed_date", "committer_tz_offset",
-                 "message", "parents", "encoding", "gpgsig")
+                 "message", "parents", "encoding", "gpgsig", "_raw")
     _id_attribute_ = "hexsha"
 
+    # attributes parsed from the author and committer lines, which are decoded only once queried
+    _actor_fields = (("author", "authored_date", "author_tz_offset"),
+                     ("committer", "committed_date", "committer_tz_offset"))
+    _actor_attrs = dict((attr, index) for index, attrs in enumerate(_actor_fields) for attr in attrs)
+    _lazy_attrs = tuple(_actor_attrs) + ("message", )
+
     def __init__(self, repo, binsha, tree=None, author=None, authored_date=None, author_tz_offset=None,
                  committer=None, committed_date=None, committer_tz_offset=None,
                  message=None, parents=None, encoding=None, gpgsig=None):
@@ -136,8 +200,49 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
     def _get_intermediate_items(cls, commit):
         return commit.parents
 
+    def _traverse_all(self, depth, branch_first, visit_once, ignore_self):
+        """Walk the binary shas of our ancestors, as read by ``_header_reader``, and create
+        Commit objects only for the commits to yield"""
+        repo = self.repo
+        read_header = self._header_reader(repo)
+        visited = set()
+        # only we are at depth 0, our parents may not have been written yet
+        stack = Deque((1, p.binsha) for p in reversed(self.parents))
+        if not ignore_self:
+            yield self
+        # END handle self
+        if depth == 0:
+            return
+        # END handle depth
+
+        while stack:
+            d, binsha = stack.pop()
+            if visit_once:
+                if binsha in visited:
+                    continue
+                visited.add(binsha)
+            # END handle visited commits
+
+            yield type(self)(repo, binsha)
+
+            d += 1
+            if depth > -1 and d > depth:
+                continue
+            parents = read_header(binsha)[1]
+            if branch_first:
+                stack.extendleft((d, p) for p in parents)
+            else:
+                stack.extend((d, p) for p in reversed(parents))
+            # END handle order
+        # END for each commit
+
     def _set_cache_(self, attr):
-        if attr in Commit.__slots__:
+        if attr in self._actor_attrs:
+            self._set_actor_cache_(attr, self._actor_attrs[attr])
+        elif attr == "message":
+            data, offset = self._raw[2:]
+            self.message = self._decode(data[offset:], "message")
+        elif attr in Commit.__slots__:
             # read the data in a chunk, its faster - then provide a file wrapper
             binsha, typename, self.size, stream = self.repo.odb.stream(self.binsha)
             self._deserialize(BytesIO(stream.read()))
@@ -145,6 +250,37 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
             super(Commit, self)._set_cache_(attr)
         # END handle attrs
 
+    def _decode(self, data, what):
+        """:return: the given bytes decoded using our encoding, or the default encoding if
+            ours is unknown"""
+        try:
+            return data.decode(self.encoding, 'replace')
+        except LookupError:
+            log.error("Failed to decode %s '%s' using encoding %s", what, data, self.encoding, exc_info=True)
+            return data.decode(self.default_encoding, 'replace')
+        # END exception handling
+
+    def _set_actor_cache_(self, attr, index):
+        """Set the attributes parsed from our undecoded author or committer line.
+        The date and timezone are read from the bytes directly, the actor is only decoded
+        if it is queried"""
+        actor_attr, date_attr, offset_attr = self._actor_fields[index]
+        line = self._raw[index] or b''
+        fields = _split_actor_line(line)
+        if fields is not None:
+            actor, date, utctz = fields
+            setattr(self, date_attr, date)
+            setattr(self, offset_attr, utctz_to_altz(utctz.decode('ascii')))
+            if attr == actor_attr:
+                setattr(self, actor_attr, intern_actor(self._decode(actor, actor_attr)))
+            # END decode actor on demand
+        else:
+            actor, date, offset = parse_actor_and_date(self._decode(line, actor_attr + " line"))
+            setattr(self, actor_attr, actor)
+            setattr(self, date_attr, date)
+            setattr(self, offset_attr, offset)
+        # END handle malformed lines
+
     @property
     def authored_datetime(self):
         return from_timestamp(self.authored_date, self.author_tz_offset)
@@ -198,11 +334,18 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
             ``max_count`` is the maximum number of commits to fetch
             ``skip`` is the number of commits to skip
             ``since`` all commits since i.e. '1970-01-01'
-        :return: iterator yielding Commit items"""
+        :return: iterator yielding Commit items
+        :note: Typical queries are answered by walking the commit graph in-process, see
+            ``_iter_native``. git rev-list is only used for everything else."""
         if 'pretty' in kwargs:
             raise ValueError("--pretty cannot be used as parsing expects single sha's only")
         # END handle pretty
 
+        commits = cls._iter_native(repo, rev, paths, kwargs)
+        if commits is not None:
+            return commits
+        # END handle native walk
+
         # use -- in any case, to prevent possibility of ambiguous arguments
         # see https://github.com/gitpython-developers/GitPython/issues/264
         args = ['--']
@@ -213,6 +356,210 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
         proc = repo.git.rev_list(rev, args, as_process=True, **kwargs)
         return cls._iter_from_process_or_stream(repo, proc)
 
+    @classmethod
+    def iter_records(cls, repo, rev, paths='', **kwargs):
+        """Find all commits matching the given criteria, like ``iter_items``, but yield compact
+        records instead of Commit objects. Use it to scan large histories, keeping the records around
+        takes a fraction of the memory.
+
+        :param repo: is the Repo
+        :param rev: revision specifier, see git-rev-parse for viable options
+        :param paths: optional path or list of paths, see ``iter_items``
+        :param kwargs: optional keyword arguments to git rev-list, see ``iter_items``
+        :return: iterator yielding CommitRecord items"""
+        if 'pretty' in kwargs:
+            raise ValueError("--pretty cannot be used as parsing expects single sha's only")
+        # END handle pretty
+
+        binshas = cls._iter_native_binshas(repo, rev, paths, kwargs)
+        if binshas is None:
+            args = ['--']
+            if paths:
+                args.extend((paths, ))
+            # END if paths
+            binshas = _iter_binsha_from_process_or_stream(repo.git.rev_list(rev, args, as_process=True, **kwargs))
+        # END handle native walk
+        return CommitRecord._iter_from_binshas(repo, binshas)
+
+    @classmethod
+    def _iter_native(cls, repo, rev, paths, kwargs):
+        """Walk the history like git rev-list would, see ``_iter_native_binshas``
+
+        :return: iterator yielding Commit items, or None if the query is not supported natively"""
+        binshas = cls._iter_native_binshas(repo, rev, paths, kwargs)
+        if binshas is None:
+            return None
+        return (cls(repo, binsha) for binsha in binshas)
+
+    @classmethod
+    def _iter_native_binshas(cls, repo, rev, paths, kwargs):
+        """Walk the history like git rev-list would, reading commits from the commit-graph
+        if there is one, or from the object database.
+        Supported are single revisions and 'A..B' ranges, plain paths, as well as the ``max_count``,
+        ``skip``, ``since``/``after``, ``until``/``before`` and ``first_parent`` options. Dates must
+        be timestamps, datetime instances or use git's internal format.
+
+        :return: iterator yielding binary shas of commits, or None if the query is not supported natively"""
+        options = dict()
+        for key, value in kwargs.items():
+            options[key.replace('-', '_')] = value
+        # END normalize option names
+
+        try:
+            max_count = int(options.pop('max_count', -1))
+            skip = int(options.pop('skip', 0))
+        except (TypeError, ValueError):
+            return None
+        # END handle invalid counts
+        first_parent = options.pop('first_parent', False)
+        since = options.pop('since', None)
+        since = options.pop('after', since)
+        until = options.pop('until', None)
+        until = options.pop('before', until)
+        if options or first_parent not in (True, False, None):
+            return None
+        # END handle unsupported options
+
+        if since is not None:
+            since = _timestamp_from_date(since)
+            if since is None:
+                return None
+        # END handle since
+        if until is not None:
+            until = _timestamp_from_date(until)
+            if until is None:
+                return None
+        # END handle until
+
+        # resolve revisions, git has to deal with anything we don't understand
+        if isinstance(rev, cls):
+            include, exclude = [rev.binsha], []
+        else:
+            if isinstance(rev, (tuple, list)):
+                return None
+            rev = text_type(rev)
+            if ' ' in rev or '...' in rev or rev.startswith('^') or rev.endswith(('^@', '^!')) or '^-' in rev:
+                return None
+            # END handle unsupported revision syntax
+            include, exclude = [rev], []
+            if '..' in rev:
+                start, end = rev.split('..', 1)
+                include, exclude = [end or 'HEAD'], [start or 'HEAD']
+            # END handle ranges
+            include = [cls._native_rev_binsha(repo, r) for r in include]
+            exclude = [cls._native_rev_binsha(repo, r) for r in exclude]
+            if None in include or None in exclude:
+                return None
+        # END handle revision
+
+        # path limiting, the pathspec magic is left to git
+        if paths and not isinstance(paths, (tuple, list)):
+            paths = [paths]
+        # END assure list
+        components = list()
+        for path in paths or ():
+            if not path:
+                continue
+            if os.path.isabs(path) or path.startswith(':') or any(c in path for c in '*?[\\'):
+                return None
+            path = tuple(c for c in path.split('/') if c)
+            if not path or '.' in path or '..' in path:
+                return None
+            components.append(path)
+        # END for each path
+
+        odb = repo.odb
+        read_header = cls._header_reader(repo)
+
+        if components:
+            entries = dict()
+            trees = dict()
+
+            def path_entries(tree_sha):
+                try:
+                    return entries[tree_sha]
+                except KeyError:
+                    # subtrees rarely change, keep them around while the walk goes on
+                    if len(trees) > 1024:
+                        trees.clear()
+                        entries.clear()
+                    # END bound memory usage
+                    entries[tree_sha] = rval = tree_entries_by_path(odb, tree_sha, components, trees)
+                    return rval
+                # END handle cache miss
+
+            def treesame(tree_sha, parent_tree_sha):
+                if tree_sha == parent_tree_sha:
+                    return True
+                ours = path_entries(tree_sha)
+                if parent_tree_sha is None:
+                    return not any(ours)
+                return ours == path_entries(parent_tree_sha)
+            # END path utilities
+        else:
+            treesame = None
+        # END handle paths
+
+        commits = iter_commits_by_date(read_header, include, exclude, first_parent, since, treesame)
+        if until is not None:
+            commits = (c for c in commits if c[1] <= until)
+        # END handle until
+        stop = None
+        if max_count > -1:
+            stop = skip + max_count
+        # END handle max count
+        commits = islice(commits, skip, stop)
+        return (binsha for binsha, date in commits)
+
+    @classmethod
+    def _native_rev_binsha(cls, repo, rev):
+        """:return: binary sha of the commit the given revision points to, or None if it is no commit
+            or we cannot resolve it, in which case git should be asked"""
+        if isinstance(rev, cls):
+            return rev.binsha
+        try:
+            obj = repo.rev_parse(text_type(rev))
+        except (BadName, BadObject, ValueError, IndexError, KeyError, NotImplementedError):
+            return None
+        # END handle unresolvable revisions
+        while obj.type == 'tag':
+            obj = obj.object
+        # END dereference tags
+        if obj.type != cls.type:
+            return None
+        return obj.binsha
+
+    @classmethod
+    def _header_reader(cls, repo):
+        """:return: callable(binsha) returning tuple(tree_binsha, tuple(parent_binsha, ...), committed_date)
+            of commits, read from the commit-graph if possible, or from the object database"""
+        odb = repo.odb
+        graph = repo.commit_graph
+
+        def read_header(binsha):
+            if graph is not None:
+                header = graph.header(binsha)
+                if header is not None:
+                    return header
+            # END use commit-graph
+            return commit_header_from_data(odb.stream(binsha).read())
+        return read_header
+
+    @classmethod
+    def _generation_reader(cls, repo):
+        """:return: callable(binsha) returning the generation number of commits according to the
+            commit-graph, or GENERATION_INFINITY if it is unknown"""
+        graph = repo.commit_graph
+        if graph is None:
+            return lambda binsha: GENERATION_INFINITY
+
+        def generation(binsha):
+            gen = graph.generation(binsha)
+            if gen is None:
+                return GENERATION_INFINITY
+            return gen
+        return generation
+
     def iter_parents(self, paths='', **kwargs):
         """Iterate _all_ parents of this commit.
 
@@ -254,28 +601,9 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
 
         :param proc: git-rev-list process instance - one sha per line
         :return: iterator returning Commit objects"""
-        stream = proc_or_stream
-        if not hasattr(stream, 'readline'):
-            stream = proc_or_stream.stdout
-
-        readline = stream.readline
-        while True:
-            line = readline()
-            if not line:
-                break
-            hexsha = line.strip()
-            if len(hexsha) > 40:
-                # split additional information, as returned by bisect for instance
-                hexsha, rest = line.split(None, 1)
-            # END handle extra info
-
-            assert len(hexsha) == 40, "Invalid line: %s" % hexsha
-            yield Commit(repo, hex_to_bin(hexsha))
-        # END for each line in stream
-        # TODO: Review this - it seems process handling got a bit out of control
-        # due to many developers trying to fix the open file handles issue
-        if hasattr(proc_or_stream, 'wait'):
-            finalize_process(proc_or_stream)
+        for binsha in _iter_binsha_from_process_or_stream(proc_or_stream):
+            yield Commit(repo, binsha)
+        # END for each commit
 
     @classmethod
     def create_from_tree(cls, repo, tree, message, parent_commits=None, head=False, author=None, committer=None,
@@ -441,88 +769,150 @@ class Commit(base.Object, Iterable, Diffable, Traversable, Serializable):
         return self
 
     def _deserialize(self, stream):
-        """:param from_rev_list: if true, the stream format is coming from the rev-list command
-        Otherwise it is assumed to be a plain data stream from our object"""
-        readline = stream.readline
-        self.tree = Tree(self.repo, hex_to_bin(readline().split()[1]), Tree.tree_id << 12, '')
-
-        self.parents = list()
-        next_line = None
-        while True:
-            parent_line = readline()
-            if not parent_line.startswith(b'parent'):
-                next_line = parent_line
-                break
-            # END abort reading parents
-            self.parents.append(type(self)(self.repo, hex_to_bin(parent_line.split()[-1].decode('ascii'))))
-        # END for each parent line
-        self.parents = tuple(self.parents)
-
-        # we don't know actual author encoding before we have parsed it, so keep the lines around
-        author_line = next_line
-        committer_line = readline()
-
-        # we might run into one or more mergetag blocks, skip those for now
-        next_line = readline()
-        while next_line.startswith(b'mergetag '):
-            next_line = readline()
-            while next_line.startswith(b' '):
-                next_line = readline()
-        # end skip mergetags
-
-        # now we can have the encoding line, or an empty line followed by the optional
-        # message.
-        self.encoding = self.default_encoding
+        """Read the commit from the given stream. Only the tree, parents, encoding and signature
+        are set right away, all other attributes are decoded from the raw data once queried"""
+        data = stream.read()
+        tree, parents, author, committer, encoding, gpgsig, offset = commit_fields_from_data(data)
 
-        # read headers
-        enc = next_line
-        buf = enc.strip()
-        while buf:
-            if buf[0:10] == b"encoding ":
-                self.encoding = buf[buf.find(' ') + 1:].decode('ascii')
-            elif buf[0:7] == b"gpgsig ":
-                sig = buf[buf.find(b' ') + 1:] + b"\n"
-                is_next_header = False
-                while True:
-                    sigbuf = readline()
-                    if not sigbuf:
-                        break
-                    if sigbuf[0:1] != b" ":
-                        buf = sigbuf.strip()
-                        is_next_header = True
-                        break
-                    sig += sigbuf[1:]
-                # end read all signature
-                self.gpgsig = sig.rstrip(b"\n").decode('ascii')
-                if is_next_header:
-                    continue
-            buf = readline().strip()
-        # decode the authors name
-
-        try:
-            self.author, self.authored_date, self.author_tz_offset = \
-                parse_actor_and_date(author_line.decode(self.encoding, 'replace'))
-        except UnicodeDecodeError:
-            log.error("Failed to decode author line '%s' using encoding %s", author_line, self.encoding,
-                      exc_info=True)
+        self.tree = Tree(self.repo, tree, Tree.tree_id << 12, '')
+        self.parents = tuple(type(self)(self.repo, binsha) for binsha in parents)
+        self.encoding = self.default_encoding
+        if encoding is not None:
+            self.encoding = encoding.decode('ascii')
+        if gpgsig is not None:
+            self.gpgsig = gpgsig.decode('ascii')
+        # END handle optional headers
 
+        # drop values decoded from previous data, they are decoded from the new one on access
         try:
-            self.committer, self.committed_date, self.committer_tz_offset = \
-                parse_actor_and_date(committer_line.decode(self.encoding, 'replace'))
-        except UnicodeDecodeError:
-            log.error("Failed to decode committer line '%s' using encoding %s", committer_line, self.encoding,
-                      exc_info=True)
-        # END handle author's encoding
-
-        # a stream from our data simply gives us the plain message
-        # The end of our message stream is marked with a newline that we strip
-        self.message = stream.read()
-        try:
-            self.message = self.message.decode(self.encoding, 'replace')
-        except UnicodeDecodeError:
-            log.error("Failed to decode message '%s' using encoding %s", self.message, self.encoding, exc_info=True)
-        # END exception handling
-
+            object.__getattribute__(self, '_raw')
+        except AttributeError:
+            pass
+        else:
+            for attr in self._lazy_attrs:
+                try:
+                    delattr(self, attr)
+                except AttributeError:
+                    pass
+            # END for each lazily decoded attribute
+        # END handle previous data
+        self._raw = (author, committer, data, offset)
         return self
 
     #} END serializable implementation
+
+
+class CommitRecord(object):
+
+    """Compact summary of a commit, meant to keep large amounts of history in memory.
+
+    Shas are kept as binary strings, dates as integers, and actors are interned, see
+    ``intern_actor``. The message is not kept at all, use ``to_commit`` to obtain a full
+    Commit object."""
+    __slots__ = ("repo", "binsha", "tree", "parents",
+                 "author", "authored_date", "author_tz_offset",
+                 "committer", "committed_date", "committer_tz_offset")
+
+    def __init__(self, repo, binsha, tree, parents, author, authored_date, author_tz_offset,
+                 committer, committed_date, committer_tz_offset):
+        """
+        :param binsha: 20 byte sha1 of the commit
+        :param tree: 20 byte sha1 of the commit's tree
+        :param parents: tuple of 20 byte sha1s of the parent commits
+        :note: see Commit for all other parameters"""
+        self.repo = repo
+        self.binsha = binsha
+        self.tree = tree
+        self.parents = parents
+        self.author = author
+        self.authored_date = authored_date
+        self.author_tz_offset = author_tz_offset
+        self.committer = committer
+        self.committed_date = committed_date
+        self.committer_tz_offset = committer_tz_offset
+
+    @classmethod
+    def _iter_from_binshas(cls, repo, binshas):
+        """:return: iterator yielding a CommitRecord for each of the given binary commit shas"""
+        stream = repo.odb.stream
+        for binsha in binshas:
+            yield cls._from_data(repo, binsha, stream(binsha).read())
+        # END for each commit
+
+    @classmethod
+    def _from_data(cls, repo, binsha, data):
+        """:return: CommitRecord parsed from the given raw commit data"""
+        tree, parents, author, committer, encoding, gpgsig, offset = commit_fields_from_data(data)
+        if encoding is not None:
+            encoding = encoding.decode('ascii')
+        # END handle encoding
+        return cls(repo, binsha, tree, parents,
+                   *(cls._parse_actor_line(author, encoding) + cls._parse_actor_line(committer, encoding)))
+
+    @classmethod
+    def _parse_actor_line(cls, line, encoding):
+        """:return: tuple(Actor, int_seconds_since_epoch, int_timezone_offset) of the given line"""
+        line = line or b''
+        fields = _split_actor_line(line)
+        if fields is None:
+            return tuple(parse_actor_and_date(line.decode(encoding or Commit.default_encoding, 'replace')))
+        # END handle malformed lines
+
+        actor, date, utctz = fields
+        return (intern_actor(actor.decode(encoding or Commit.default_encoding, 'replace')), date,
+                utctz_to_altz(utctz.decode('ascii')))
+
+    @property
+    def hexsha(self):
+        """:return: 40 byte hex version of our 20 byte binary sha"""
+        return bin_to_hex(self.binsha).decode('ascii')
+
+    def __eq__(self, other):
+        return self.binsha == getattr(other, 'binsha', None)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.binsha)
+
+    def __str__(self):
+        return self.hexsha
+
+    def __repr__(self):
+        return '<git.CommitRecord "%s">' % self.hexsha
+
+    def to_commit(self):
+        """:return: Commit object with all information of this record, which reads its message
+            and everything else from the object database on demand"""
+        return Commit(self.repo, self.binsha, Tree(self.repo, self.tree, Tree.tree_id << 12, ''),
+                      self.author, self.authored_date, self.author_tz_offset,
+                      self.committer, self.committed_date, self.committer_tz_offset,
+                      parents=tuple(Commit(self.repo, p) for p in self.parents))
+
+
+def _iter_binsha_from_process_or_stream(proc_or_stream):
+    """:return: iterator yielding the binary shas of the commits listed in the given git-rev-list
+        process or stream, one sha per line"""
+    stream = proc_or_stream
+    if not hasattr(stream, 'readline'):
+        stream = proc_or_stream.stdout
+
+    readline = stream.readline
+    while True:
+        line = readline()
+        if not line:
+            break
+        hexsha = line.strip()
+        if len(hexsha) > 40:
+            # split additional information, as returned by bisect for instance
+            hexsha, rest = line.split(None, 1)
+        # END handle extra info
+
+        assert len(hexsha) == 40, "Invalid line: %s" % hexsha
+        yield hex_to_bin(hexsha)
+    # END for each line in stream
+    # TODO: Review this - it seems process handling got a bit out of control
+    # due to many developers trying to fix the open file handles issue
+    if hasattr(proc_or_stream, 'wait'):
+        finalize_process(proc_or_stream)
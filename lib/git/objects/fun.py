@@ -1,15 +1,34 @@
 """Module with functions which are supposed to be as fast as possible"""
-from stat import S_ISDIR
+from heapq import (
+    heappush,
+    heappop
+)
+from stat import (
+    S_IFDIR,
+    S_ISDIR
+)
+from array import array
+from io import BytesIO
+import threading
+
+from gitdb.base import IStream
+from gitdb.typ import str_tree_type
+from gitdb.util import hex_to_bin
+
 from git.compat import (
     byte_ord,
     defenc,
     xrange,
     text_type,
-    bchr
+    bchr,
+    UINT_TYPECODE
 )
 
-__all__ = ('tree_to_stream', 'tree_entries_from_data', 'traverse_trees_recursive',
-           'traverse_tree_recursive')
+__all__ = ('tree_to_stream', 'tree_entry_sort_key', 'write_tree_with_changes', 'tree_entries_from_data',
+           'tree_entries_from_sha', 'tree_name_index_from_sha', 'TreePrefetcher', 'TreeEntryView',
+           'iter_tree_recursive', 'iter_trees_recursive', 'traverse_trees_recursive', 'traverse_tree_recursive',
+           'commit_header_from_data', 'commit_fields_from_data', 'tree_entries_by_path',
+           'iter_commits_by_date', 'merge_bases', 'is_ancestor', 'GENERATION_INFINITY')
 
 
 def tree_to_stream(entries, write):
@@ -41,170 +60,1007 @@ def tree_to_stream(entries, write):
     # END for each item
 
 
-def tree_entries_from_data(data):
-    """Reads the binary representation of a tree and returns tuples of Tree items
-    :param data: data block with tree data (as bytes)
-    :return: list(tuple(binsha, mode, tree_relative_path), ...)"""
+def tree_entry_sort_key(entry):
+    """:return: key to sort tree entries tuple(binsha, mode, name) with, in the order git keeps them
+        in trees. Git compares the names of trees as if they were ending with a slash.
+        Keys are bytes, as names which are no valid text are bytes, and both kinds may be compared"""
+    name = entry[2]
+    if isinstance(name, text_type):
+        name = name.encode(defenc)
+    # END encode name
+    if S_ISDIR(entry[1]):
+        return name + b'/'
+    return name
+
+
+# modes git writes into trees, mapped to their integer value
+_tree_modes = dict((mode, int(mode, 8)) for mode in
+                   (b'100644', b'100755', b'120000', b'40000', b'160000', b'040000', b'100664'))
+
+
+def _mode_from_bytes(mode_str):
+    """:return: integer mode parsed from the given octal string, in the way git reads it"""
     ord_zero = ord('0')
-    space_ord = ord(' ')
+    mode = 0
+    for char in bytearray(mode_str):
+        mode = (mode << 3) + (char - ord_zero)
+    # END for each character
+    return mode
+
+
+def _iter_tree_entry_offsets(data):
+    """:return: iterator yielding tuple(mode, name_offset, binsha_offset) for each entry of the given
+        raw tree data, the name ends right before the binsha
+    :raise ValueError: if the tree data is truncated"""
+    find = data.find
+    modes = _tree_modes
     len_data = len(data)
     i = 0
-    out = list()
     while i < len_data:
-        mode = 0
-
-        # read mode
-        # Some git versions truncate the leading 0, some don't
+        # Some git versions truncate the leading 0 of the mode, some don't
         # The type will be extracted from the mode later
-        while byte_ord(data[i]) != space_ord:
-            # move existing mode integer up one level being 3 bits
-            # and add the actual ordinal value of the character
-            mode = (mode << 3) + (byte_ord(data[i]) - ord_zero)
-            i += 1
-        # END while reading mode
+        space = find(b' ', i)
+        null = find(b'\0', space + 1)
+        if space < 0 or null < 0:
+            raise ValueError("Tree data is truncated at offset %i" % i)
+        # END handle truncated data
+
+        mode_str = data[i:space]
+        mode = modes.get(mode_str)
+        if mode is None:
+            mode = _mode_from_bytes(mode_str)
+        # END handle unusual modes
 
-        # byte is space now, skip it
-        i += 1
+        # the 20 byte binsha follows the NULL terminating the name
+        i = null + 21
+        yield mode, space + 1, null + 1
+    # END for each entry
 
-        # parse name, it is NULL separated
 
-        ns = i
-        while byte_ord(data[i]) != 0:
-            i += 1
-        # END while not reached NULL
+def tree_entries_from_data(data, as_view=False):
+    """Reads the binary representation of a tree and returns tuples of Tree items
+    :param data: data block with tree data (as bytes)
+    :param as_view: if True, return a TreeEntryView instead of a list, which keeps offsets into
+        data and creates the items on access
+    :return: list(tuple(binsha, mode, tree_relative_path), ...)"""
+    if as_view:
+        return TreeEntryView(data)
+    # END handle view
 
+    out = list()
+    append = out.append
+    for mode, ns, i in _iter_tree_entry_offsets(data):
         # default encoding for strings in git is utf8
         # Only use the respective unicode object if the byte stream was encoded
-        name = data[ns:i]
+        name = data[ns:i - 1]
         try:
             name = name.decode(defenc)
         except UnicodeDecodeError:
             pass
         # END handle encoding
-
-        # byte is NULL, get next 20
-        i += 1
-        sha = data[i:i + 20]
-        i = i + 20
-        out.append((sha, mode, name))
-    # END for each byte in data stream
+        append((data[i:i + 20], mode, name))
+    # END for each entry
     return out
 
 
-def _find_by_name(tree_data, name, is_dir, start_at):
-    """return data entry matching the given name and tree mode
-    or None.
-    Before the item is returned, the respective data item is set
-    None in the tree_data list to mark it done"""
+class TreeEntryView(object):
+
+    """Struct-of-arrays view on the entries of a tree, keeping the modes and offsets of
+    all entries in compact arrays. Items are the same tuples tree_entries_from_data returns,
+    but are only created once they are accessed"""
+    __slots__ = ('data', 'modes', 'name_offsets', 'binsha_offsets')
+
+    def __init__(self, data):
+        """:param data: raw tree data, which is kept as long as the view exists"""
+        self.data = data
+        self.modes = array(UINT_TYPECODE)
+        self.name_offsets = array(UINT_TYPECODE)
+        self.binsha_offsets = array(UINT_TYPECODE)
+        add_mode, add_name, add_binsha = self.modes.append, self.name_offsets.append, self.binsha_offsets.append
+        for mode, ns, i in _iter_tree_entry_offsets(data):
+            add_mode(mode)
+            add_name(ns)
+            add_binsha(i)
+        # END for each entry
+
+    def __len__(self):
+        return len(self.modes)
+
+    def __iter__(self):
+        for index in xrange(len(self.modes)):
+            yield self[index]
+        # END for each entry
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self.modes)))]
+        # END handle slices
+        return (self.binsha(index), self.modes[index], self.name(index))
+
+    def binsha(self, index):
+        """:return: 20 byte binary sha of the entry at the given index"""
+        offset = self.binsha_offsets[index]
+        return self.data[offset:offset + 20]
+
+    def mode(self, index):
+        """:return: integer mode of the entry at the given index"""
+        return self.modes[index]
+
+    def name(self, index):
+        """:return: name of the entry at the given index, decoded if it is valid utf8"""
+        name = self.data[self.name_offsets[index]:self.binsha_offsets[index] - 1]
+        try:
+            return name.decode(defenc)
+        except UnicodeDecodeError:
+            return name
+        # END handle encoding
+
+
+def _name_index(entries):
+    """:return: dict(name: position) of the given tree entries, the first one wins if names repeat"""
+    names = [e[2] for e in entries]
+    return dict(zip(reversed(names), xrange(len(names) - 1, -1, -1)))
+
+
+def _cached_tree(odb, binsha, cache):
+    """:return: list [entries, name index or None] of the tree with the given binary sha,
+        which is kept in the cache unless it is None"""
+    if cache is not None:
+        tree = cache.get(binsha)
+        if tree is not None:
+            return tree
+    # END handle cache hit
+    data = odb.stream(binsha).read()
+    tree = [tuple(tree_entries_from_data(data)), None]
+    if cache is not None:
+        cache.set(binsha, tree, len(data))
+    return tree
+
+
+def tree_entries_from_sha(odb, binsha, cache=None):
+    """
+    :return: tuple(tuple(binsha, mode, name), ...) with the entries of the tree with the given
+        binary sha, as returned by tree_entries_from_data
+    :param cache: git.util.LRUCache keeping the entries of trees read previously, or None.
+        The tuples are shared among all callers, copy them before making changes"""
+    return _cached_tree(odb, binsha, cache)[0]
+
+
+def tree_name_index_from_sha(odb, binsha, cache=None):
+    """
+    :return: tuple(entries, dict(name: position)) with the entries of the tree with the given binary
+        sha, as tree_entries_from_sha returns them, and the position of each name among them
+    :param cache: see tree_entries_from_sha, the index is kept along with the entries"""
+    tree = _cached_tree(odb, binsha, cache)
+    if tree[1] is None:
+        tree[1] = _name_index(tree[0])
+    # END build index
+    return tree[0], tree[1]
+
+
+class TreePrefetcher(object):
+
+    """Cache of parsed trees to read trees through, see tree_entries_from_sha, which reads the
+    subtrees of every tree it hands out ahead of time, using a bounded pool of threads.
+    As zlib releases the GIL while inflating objects, recursive tree walks speed up with the
+    amount of cores.
+
+    Subtrees are read most recent first, which follows depth first traversals. Trees which
+    are not yet being read when they are asked for are read by the caller instead.
+
+    :note: streams are obtained from the object database one at a time, holding a lock of its
+        own so lookups of cached trees never wait for it, but they are read concurrently.
+        GitCmdObjectDB reads all objects through a single git process, use a GitDB for the
+        same objects directory instead, as Repo.prefetch_trees does"""
+    __slots__ = ('_odb', '_odb_lock', '_cache', '_lock', '_done', '_queue', '_queued', '_reading', '_threads',
+                 '_closed', 'workers', 'max_pending')
+
+    def __init__(self, odb, cache, workers=4, max_pending=1024):
+        """
+        :param odb: object database to read trees from
+        :param cache: git.util.LRUCache to keep parsed trees in, like Repo.tree_cache
+        :param workers: amount of threads reading trees
+        :param max_pending: maximum amount of trees waiting to be read"""
+        self._odb = odb
+        self._odb_lock = threading.Lock()
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        # shas of the trees to read, most urgent last, and the same shas for quick lookups
+        self._queue = list()
+        self._queued = set()
+        self._reading = set()
+        self._threads = list()
+        self._closed = False
+        self.workers = workers
+        self.max_pending = max_pending
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _schedule(self, entries):
+        """Queue the subtrees among the given entries to be read, the first one being read first.
+        Must be called with the lock held"""
+        if self._closed:
+            return
+        queue = self._queue
+        queued = self._queued
+        for binsha, mode, name in reversed(entries):
+            if not S_ISDIR(mode) or binsha in queued or binsha in self._reading or binsha in self._cache:
+                continue
+            # END skip known trees
+            if len(queued) >= self.max_pending:
+                break
+            queue.append(binsha)
+            queued.add(binsha)
+        # END for each entry
+        while len(self._threads) < min(self.workers, len(queued)):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+        # END start workers
+        self._done.notify_all()
+
+    def _work(self):
+        """Read queued trees until we are closed"""
+        lock = self._lock
+        while True:
+            with lock:
+                while not self._queue and not self._closed:
+                    self._done.wait()
+                # END wait for work
+                if self._closed:
+                    return
+                binsha = self._queue.pop()
+                self._queued.remove(binsha)
+                self._reading.add(binsha)
+            # END with lock
+
+            tree = None
+            try:
+                with self._odb_lock:
+                    stream = self._odb.stream(binsha)
+                # END with database lock
+            except Exception:
+                stream = None
+            # END handle unreadable trees
+            if stream is not None:
+                try:
+                    data = stream.read()
+                    tree = [tuple(tree_entries_from_data(data)), None]
+                except Exception:
+                    pass
+                # END leave errors to the caller, who reads it again
+            # END handle stream
+
+            with lock:
+                self._reading.remove(binsha)
+                if tree is not None:
+                    self._cache.set(binsha, tree, len(data))
+                # END keep tree
+                self._done.notify_all()
+            # END with lock
+        # END for each tree
+
+    @property
+    def pending(self):
+        """:return: amount of trees waiting to be read"""
+        return len(self._queue)
+
+    def get(self, binsha, default=None):
+        """:return: parsed tree with the given binary sha, waiting for it if it is being read, or default
+            if it is unknown. Subtrees of the returned tree are queued to be read"""
+        with self._lock:
+            while binsha in self._reading:
+                self._done.wait()
+            # END wait for tree
+            if binsha in self._queued:
+                # we read it ourselves, most likely it is the tree queued last
+                self._queued.remove(binsha)
+                queue = self._queue
+                if queue[-1] == binsha:
+                    queue.pop()
+                else:
+                    queue.remove(binsha)
+                # END remove from queue
+            # END handle queued tree
+            tree = self._cache.get(binsha)
+            if tree is None:
+                return default
+            self._schedule(tree[0])
+            return tree
+        # END with lock
+
+    def set(self, binsha, tree, size=0):
+        """Keep the parsed tree read by the caller, and queue its subtrees to be read"""
+        with self._lock:
+            self._cache.set(binsha, tree, size)
+            self._schedule(tree[0])
+        # END with lock
+
+    def close(self):
+        """Stop all threads, trees still queued are not read anymore"""
+        with self._lock:
+            self._closed = True
+            del(self._queue[:])
+            self._queued.clear()
+            self._done.notify_all()
+        # END with lock
+        for thread in self._threads:
+            thread.join()
+        # END for each thread
+        del(self._threads[:])
+
+
+def _join_path(path_prefix, name, suffix=''):
+    """:return: path of the given name below path_prefix, followed by suffix. It is bytes if
+        any of them is, which is the case for names which are no valid text"""
     try:
-        item = tree_data[start_at]
-        if item and item[2] == name and S_ISDIR(item[1]) == is_dir:
-            tree_data[start_at] = None
-            return item
-    except IndexError:
-        pass
-    # END exception handling
-    for index, item in enumerate(tree_data):
-        if item and item[2] == name and S_ISDIR(item[1]) == is_dir:
-            tree_data[index] = None
-            return item
-        # END if item matches
-    # END for each item
-    return None
+        return path_prefix + name + suffix
+    except (TypeError, UnicodeDecodeError):
+        parts = [path_prefix, name, suffix]
+        for i, part in enumerate(parts):
+            if isinstance(part, text_type):
+                parts[i] = part.encode(defenc)
+        # END for each text part
+        return b''.join(parts)
+    # END handle bytes
 
 
 def _to_full_path(item, path_prefix):
     """Rebuild entry with given path prefix"""
     if not item:
         return item
-    return (item[0], item[1], path_prefix + item[2])
+    return (item[0], item[1], _join_path(path_prefix, item[2]))
 
 
-def traverse_trees_recursive(odb, tree_shas, path_prefix):
-    """
-    :return: list with entries according to the given binary tree-shas.
-        The result is encoded in a list
-        of n tuple|None per blob/commit, (n == len(tree_shas)), where
+def _path_filter(paths):
+    """:return: None if the given paths include everything, or dict(name: dict|True) with one entry per
+        tree or file on the way to the given paths, True marking everything below to be included"""
+    if paths is None:
+        return None
+    pathfilter = dict()
+    for path in paths:
+        path = path.strip('/')
+        if not path:
+            return None
+        # END handle root
+        tokens = path.split('/')
+        node = pathfilter
+        for token in tokens[:-1]:
+            child = node.get(token)
+            if child is True:
+                break
+            if child is None:
+                child = node[token] = dict()
+            node = child
+        else:
+            node[tokens[-1]] = True
+        # END for each tree on the way
+    # END for each path
+    return pathfilter
+
+
+def iter_trees_recursive(odb, tree_shas, path_prefix, cache=None, skip_same=False, paths=None):
+    """Iterate all entries of the given trees and their subtrees together, aligning entries
+    with the same path. Entries are yielded in the order git keeps them in trees, each
+    tree being read only once no matter how many of the given trees contain it.
+
+    :return: iterator yielding one tuple of n tuple|None per blob/commit, (n == len(tree_shas)), where
         * [0] == 20 byte sha
         * [1] == mode as int
         * [2] == path relative to working tree root
         The entry tuple is None if the respective blob/commit did not
         exist in the given tree.
-    :param tree_shas: iterable of shas pointing to trees. All trees must
-        be on the same level. A tree-sha may be None in which case None
+    :param tree_shas: list of binary shas pointing to trees. All trees must
+        be on the same level. A tree-sha may be None in which case None entries are yielded for it
     :param path_prefix: a prefix to be added to the returned paths on this level,
         set it '' for the first iteration
-    :note: The ordering of the returned items will be partially lost"""
-    trees_data = list()
+    :param cache: git.util.LRUCache to read trees through, see tree_entries_from_sha
+    :param skip_same: if True, entries and subtrees which are the same in all trees are skipped,
+        without reading these subtrees at all
+    :param paths: see iter_tree_recursive"""
+    return _iter_trees_recursive(odb, tree_shas, path_prefix, cache, skip_same, _path_filter(paths))
+
+
+def _iter_trees_recursive(odb, tree_shas, path_prefix, cache, skip_same, pathfilter):
+    """As iter_trees_recursive, with paths converted by _path_filter"""
     nt = len(tree_shas)
-    for tree_sha in tree_shas:
-        if tree_sha is None:
-            data = list()
-        else:
-            data = tree_entries_from_data(odb.stream(tree_sha).read())
-        # END handle muted trees
-        trees_data.append(data)
-    # END for each sha to get data for
+    trees = [tree_sha is not None and tree_entries_from_sha(odb, tree_sha, cache) or () for tree_sha in tree_shas]
+    positions = [0] * nt
+    # sort key of the next entry of each tree, or None once all its entries are done
+    keys = [entries and tree_entry_sort_key(entries[0]) or None for entries in trees]
+    tis = range(nt)
 
-    out = list()
-    out_append = out.append
-
-    # find all matching entries and recursively process them together if the match
-    # is a tree. If the match is a non-tree item, put it into the result.
-    # Processed items will be set None
-    for ti, tree_data in enumerate(trees_data):
-        for ii, item in enumerate(tree_data):
-            if not item:
+    while True:
+        key = None
+        for tkey in keys:
+            if tkey is not None and (key is None or tkey < key):
+                key = tkey
+        # END for each key
+        if key is None:
+            break
+        # END handle all trees done
+
+        # take the entry with the smallest key from all trees having it
+        items = [None] * nt
+        for ti in tis:
+            if keys[ti] != key:
                 continue
-            # END skip already done items
-            entries = [None for n in range(nt)]
-            entries[ti] = item
-            sha, mode, name = item                          # its faster to unpack
-            is_dir = S_ISDIR(mode)                          # type mode bits
-
-            # find this item in all other tree data items
-            # wrap around, but stop one before our current index, hence
-            # ti+nt, not ti+1+nt
-            for tio in range(ti + 1, ti + nt):
-                tio = tio % nt
-                entries[tio] = _find_by_name(trees_data[tio], name, is_dir, ii)
-            # END for each other item data
-
-            # if we are a directory, enter recursion
-            if is_dir:
-                out.extend(traverse_trees_recursive(
-                    odb, [((ei and ei[0]) or None) for ei in entries], path_prefix + name + '/'))
-            else:
-                out_append(tuple(_to_full_path(e, path_prefix) for e in entries))
-            # END handle recursion
+            entries = trees[ti]
+            pos = positions[ti]
+            items[ti] = entries[pos]
+            pos += 1
+            positions[ti] = pos
+            keys[ti] = pos < len(entries) and tree_entry_sort_key(entries[pos]) or None
+        # END for each tree
 
-            # finally mark it done
-            tree_data[ii] = None
+        for first in items:
+            if first is not None:
+                break
+        # END find an entry
+        sha, mode, name = first
+        subfilter = None
+        if pathfilter is not None:
+            subfilter = pathfilter.get(name)
+            if subfilter is None or (subfilter is not True and not S_ISDIR(mode)):
+                continue
+            if subfilter is True:
+                subfilter = None
+        # END apply path filter
+        same = True
+        for item in items:
+            if item is None or item[0] != sha or item[1] != mode:
+                same = False
+                break
+            # END handle difference
         # END for each item
+        if same and skip_same:
+            continue
+        # END skip same items
 
-        # we are done with one tree, set all its data empty
-        del(tree_data[:])
-    # END for each tree_data chunk
-    return out
+        if S_ISDIR(mode):
+            path = _join_path(path_prefix, name, '/')
+            if same:
+                # all trees are the same, walk it once
+                for entry in _iter_tree_recursive(odb, sha, path, cache, subfilter):
+                    yield (entry,) * nt
+                # END for each entry
+            else:
+                for entries in _iter_trees_recursive(odb, [item and item[0] for item in items], path,
+                                                     cache, skip_same, subfilter):
+                    yield entries
+                # END for each entries
+            # END handle same trees
+        elif same:
+            yield (_to_full_path(first, path_prefix),) * nt
+        else:
+            yield tuple(_to_full_path(item, path_prefix) for item in items)
+        # END handle item type
+    # END for each path
 
 
-def traverse_tree_recursive(odb, tree_sha, path_prefix):
+def traverse_trees_recursive(odb, tree_shas, path_prefix, cache=None):
     """
-    :return: list of entries of the tree pointed to by the binary tree_sha. An entry
+    :return: list with entries according to the given binary tree-shas, as yielded
+        by ``iter_trees_recursive``, which is preferable for large trees
+    :param tree_shas: iterable of shas pointing to trees. All trees must
+        be on the same level. A tree-sha may be None in which case None
+    :param path_prefix: a prefix to be added to the returned paths on this level,
+        set it '' for the first iteration
+    :param cache: git.util.LRUCache to read trees through, see tree_entries_from_sha"""
+    return list(iter_trees_recursive(odb, list(tree_shas), path_prefix, cache))
+
+
+def iter_tree_recursive(odb, tree_sha, path_prefix, cache=None, paths=None):
+    """Iterate all entries of the tree pointed to by the binary tree_sha and its subtrees, in the order
+    git keeps them in trees. Entries of one tree share their path prefix, and only the trees on the
+    way to the given paths are read.
+
+    :return: iterator yielding tuple(binsha, mode, path) for each blob/commit, path being
+        relative to the repository
+    :param path_prefix: prefix to prepend to the front of all returned paths
+    :param cache: git.util.LRUCache to read trees through, see tree_entries_from_sha
+    :param paths: if not None, iterable of paths relative to the tree, limiting the entries
+        to the ones at these paths and below them"""
+    return _iter_tree_recursive(odb, tree_sha, path_prefix, cache, _path_filter(paths))
+
+
+def _iter_tree_recursive(odb, tree_sha, path_prefix, cache, pathfilter):
+    """As iter_tree_recursive, with paths converted by _path_filter"""
+    # iterators of the trees entered so far, which continue once their subtrees are done
+    stack = [(iter(tree_entries_from_sha(odb, tree_sha, cache)), path_prefix, pathfilter)]
+    while stack:
+        entries, path_prefix, pathfilter = stack[-1]
+        for sha, mode, name in entries:
+            subfilter = None
+            if pathfilter is not None:
+                subfilter = pathfilter.get(name)
+                if subfilter is None:
+                    continue
+                if subfilter is True:
+                    subfilter = None
+                elif not S_ISDIR(mode):
+                    continue
+            # END apply path filter
+
+            if S_ISDIR(mode):
+                stack.append((iter(tree_entries_from_sha(odb, sha, cache)), _join_path(path_prefix, name, '/'),
+                              subfilter))
+                break
+            # END enter subtree
+            yield (sha, mode, _join_path(path_prefix, name))
+        else:
+            stack.pop()
+        # END for each entry
+    # END for each tree
+
+
+def traverse_tree_recursive(odb, tree_sha, path_prefix, cache=None):
+    """
+    :return: list of entries of the tree pointed to by the binary tree_sha, as yielded by
+        ``iter_tree_recursive``, which is preferable for large trees. An entry
         has the following format:
         * [0] 20 byte sha
         * [1] mode as int
         * [2] path relative to the repository
-    :param path_prefix: prefix to prepend to the front of all returned paths"""
-    entries = list()
-    data = tree_entries_from_data(odb.stream(tree_sha).read())
+    :param path_prefix: prefix to prepend to the front of all returned paths
+    :param cache: git.util.LRUCache to read trees through, see tree_entries_from_sha"""
+    return list(_iter_tree_recursive(odb, tree_sha, path_prefix, cache, None))
 
-    # unpacking/packing is faster than accessing individual items
-    for sha, mode, name in data:
-        if S_ISDIR(mode):
-            entries.extend(traverse_tree_recursive(odb, sha, path_prefix + name + '/'))
+
+def commit_header_from_data(data):
+    """Parse the header fields of a commit which are required to walk the commit graph.
+    Parsing stops at the committer line, the author, further headers and the message are skipped.
+
+    :param data: raw data of a commit object
+    :return: tuple(tree_binsha, tuple(parent_binsha, ...), int(committed_date))"""
+    end = data.index(b'\n')
+    tree = hex_to_bin(data[5:end])
+
+    # parent lines have a fixed length, 'parent ' followed by 40 hex characters
+    parents = list()
+    while data.startswith(b'parent ', end + 1):
+        parents.append(hex_to_bin(data[end + 8:end + 48]))
+        end += 48
+    # END for each parent line
+
+    start = data.index(b'\ncommitter ', end)
+    end = data.index(b'\n', start + 1)
+    # the committer line ends with 'timestamp offset'
+    committed_date = int(data[start:end].rsplit(None, 2)[-2])
+    return tree, tuple(parents), committed_date
+
+
+def commit_fields_from_data(data):
+    """Locate all fields of a commit in a single pass over its raw data, without decoding
+    anything but the object ids. Unknown headers, like mergetags, are skipped.
+
+    :param data: raw data of a commit object
+    :return: tuple(tree_binsha, tuple(parent_binsha, ...), author_line, committer_line,
+        encoding, gpgsig, message_offset). The author and committer lines are undecoded bytes
+        including their keyword, encoding and gpgsig are bytes or None if the header is not set,
+        and data[message_offset:] is the undecoded message"""
+    size = len(data)
+    end = data.find(b'\n')
+    if end < 0:
+        end = size
+    # END handle single line
+    tree = hex_to_bin(data[5:end])
+
+    parents = list()
+    while data.startswith(b'parent ', end + 1):
+        parents.append(hex_to_bin(data[end + 8:end + 48]))
+        end += 48
+    # END for each parent line
+
+    author = committer = encoding = gpgsig = None
+    pos = end + 1
+    # headers end with an empty line, which is followed by the message
+    while pos < size and data[pos:pos + 1] != b'\n':
+        end = data.find(b'\n', pos)
+        if end < 0:
+            end = size
+        # END handle missing newline
+
+        if data.startswith(b'author ', pos):
+            author = data[pos:end]
+        elif data.startswith(b'committer ', pos):
+            committer = data[pos:end]
+        elif data.startswith(b'encoding ', pos):
+            encoding = data[pos + 9:end]
+        elif data.startswith(b'gpgsig ', pos):
+            lines = [data[pos + 7:end]]
+            # the signature continues on all following lines starting with a space
+            while data.startswith(b' ', end + 1):
+                pos = end + 1
+                end = data.find(b'\n', pos)
+                if end < 0:
+                    end = size
+                # END handle missing newline
+                lines.append(data[pos + 1:end])
+            # END for each continuation line
+            gpgsig = b'\n'.join(lines).rstrip(b'\n')
+        # END handle header, continuation lines of others are skipped
+        pos = end + 1
+    # END for each header line
+
+    return tree, tuple(parents), author, committer, encoding, gpgsig, min(pos + 1, size)
+
+
+def tree_entries_by_path(odb, tree_sha, paths, trees=None):
+    """
+    :return: tuple with one (binsha, mode) tuple or None per path, for the entries at the given
+        paths below the tree with the given binary sha
+    :param paths: list of repository relative paths, each being a tuple of path components
+    :param trees: if not None, dict(tree_binsha: dict(name: entry)) keeping the trees read so far,
+        which allows to share them among calls"""
+    out = list()
+    if trees is None:
+        trees = dict()
+    for components in paths:
+        entry = (tree_sha, 0o040000)
+        for name in components:
+            if not S_ISDIR(entry[1]):
+                entry = None
+                break
+            # END handle non-trees within the path
+            entries = trees.get(entry[0])
+            if entries is None:
+                entries = trees[entry[0]] = dict((e[2], e) for e in tree_entries_from_data(odb.stream(entry[0]).read()))
+            # END read tree once
+            entry = entries.get(name)
+            if entry is None:
+                break
+        # END for each path component
+        out.append(entry and entry[:2])
+    # END for each path
+    return tuple(out)
+
+
+def _write_tree_changes(odb, binsha, changes, cache, keep_empty=False):
+    """:return: binary sha of the tree with the given binary sha, or of an empty one if it is None,
+        after applying the nested changes, or None if it would be empty and keep_empty is False"""
+    entries = dict()
+    if binsha is not None:
+        for entry in tree_entries_from_sha(odb, binsha, cache):
+            entries[entry[2]] = entry
+        # END for each entry
+    # END read existing tree
+
+    for name, change in changes.items():
+        if isinstance(change, dict):
+            entry = entries.get(name)
+            subtree = entry is not None and S_ISDIR(entry[1]) and entry[0] or None
+            change = _write_tree_changes(odb, subtree, change, cache)
+            if change is not None:
+                change = (change, S_IFDIR)
+        # END handle trees
+        if change is None:
+            entries.pop(name, None)
         else:
-            entries.append((sha, mode, path_prefix + name))
-    # END for each item
+            entries[name] = (change[0], change[1], name)
+        # END handle removal
+    # END for each change
+
+    if not entries and not keep_empty:
+        return None
+    stream = BytesIO()
+    tree_to_stream(sorted(entries.values(), key=tree_entry_sort_key), stream.write)
+    stream.seek(0)
+    return odb.store(IStream(str_tree_type, len(stream.getvalue()), stream)).binsha
+
+
+def write_tree_with_changes(odb, tree_sha, changes, cache=None):
+    """Apply many changes to the tree with the given binary sha at once, and write all trees
+    changed by them into the object database. Each tree is read and written only once, no matter
+    how many of the changes affect it, and trees no change affects are left untouched.
+
+    :param tree_sha: binary sha of the tree to change, or None to start with an empty one
+    :param changes: iterable of (path, entry) tuples, path being relative to the tree and
+        entry either a tuple(binsha, mode) of the item to put at the path, or None to remove
+        the item at the path. Trees on the way are created as needed, and removed if they
+        become empty. Later changes win over earlier ones to the same path or the trees on it
+    :param cache: see tree_entries_from_sha
+    :return: binary sha of the changed tree"""
+    root = dict()
+    for path, entry in changes:
+        tokens = path.split('/')
+        node = root
+        for token in tokens[:-1]:
+            child = node.get(token)
+            if not isinstance(child, dict):
+                child = node[token] = dict()
+            # END create tree
+            node = child
+        # END for each tree on the way
+        node[tokens[-1]] = entry
+    # END for each change
+    return _write_tree_changes(odb, tree_sha, root, cache, keep_empty=True)
+
+
+# amount of uninteresting commits to walk after the last interesting one, to cope with clock skew
+_WALK_SLOP = 5
+
+
+def iter_commits_by_date(read_header, include, exclude=(), first_parent=False, since=None, treesame=None):
+    """Walk the commit graph like git-rev-list does by default, newest commits first.
+
+    Commits are kept in a priority queue ordered by their commit date. Once a commit is
+    popped, it is yielded and its parents are queued. Commits reachable from any of the
+    excluded commits are marked uninteresting, which is inherited by their parents. If there
+    are excluded commits, the walk has to end before the first commit can be yielded, which is
+    once only uninteresting commits are left.
+
+    :param read_header: callable(binsha) returning tuple(tree_binsha, tuple(parent_binsha, ...), committed_date),
+        see commit_header_from_data
+    :param include: iterable of binary shas of the commits to start at
+    :param exclude: iterable of binary shas of commits whose history is not of interest
+    :param first_parent: if True, only the first parent of merge commits is followed
+    :param since: if not None, commits older than this timestamp are not yielded, and
+        the walk does not continue past them
+    :param treesame: if not None, callable(tree_binsha, parent_tree_binsha_or_None) returning
+        True if the given trees are equal as far as we are concerned, like in the paths the
+        history is limited to. Commits treesame to their parent are not yielded. Merges treesame
+        to one of their parents are not yielded either, and only that parent is followed.
+    :return: iterator yielding tuple(binsha, committed_date) of each commit"""
+    headers = dict()
+    queue = list()
+    seen = set()            # commits that were queued at some point
+    queued = set()
+    uninteresting = set()
+    tick = [0]
+    interesting = [0]       # amount of queued commits which are not uninteresting
+
+    def header(binsha):
+        try:
+            return headers[binsha]
+        except KeyError:
+            headers[binsha] = rval = read_header(binsha)
+            return rval
+        # END handle cache miss
+
+    def mark_uninteresting(binsha):
+        # uninteresting commits pass this on to all their ancestors we have seen so far,
+        # those we see later will check the set when they are queued
+        stack = [binsha]
+        while stack:
+            binsha = stack.pop()
+            if binsha in uninteresting:
+                continue
+            uninteresting.add(binsha)
+            if binsha in queued:
+                interesting[0] -= 1
+            elif binsha in seen:
+                stack.extend(headers[binsha][1])
+            # END handle queued and walked commits
+        # END while there are commits to mark
+
+    def push(binsha):
+        if binsha in seen:
+            return
+        date = header(binsha)[2]
+        tick[0] += 1
+        heappush(queue, (-date, tick[0], binsha))
+        seen.add(binsha)
+        queued.add(binsha)
+        if binsha not in uninteresting:
+            interesting[0] += 1
+    # END utilities
+
+    for binsha in exclude:
+        mark_uninteresting(binsha)
+        push(binsha)
+    # END for each excluded commit
+    for binsha in include:
+        push(binsha)
+    # END for each included commit
+
+    # Without excluded commits, every commit can be shown once it is popped. Otherwise, like
+    # git does, we walk until only uninteresting commits are left, plus a few more in case of clock
+    # skew, before we know which commits are not reachable from any of the excluded ones.
+    limited = bool(uninteresting)
+    walked = list()
+    last_date = None
+    slop = _WALK_SLOP
+    while queue and (limited or interesting[0]):
+        binsha = heappop(queue)[2]
+        queued.remove(binsha)
+        tree, parents, date = headers[binsha]
+        if binsha not in uninteresting:
+            interesting[0] -= 1
+            if since is not None and date < since:
+                if not limited:
+                    continue
+                mark_uninteresting(binsha)
+            # END stop walking at old commits
+        # END handle interesting commits
+
+        if binsha in uninteresting:
+            for parent in parents:
+                mark_uninteresting(parent)
+                push(parent)
+            # END for each parent
+            if interesting[0] or (queue and last_date is not None and last_date <= -queue[0][0]):
+                slop = _WALK_SLOP
+            else:
+                slop -= 1
+                if not slop:
+                    break
+            # END handle end of walk
+            continue
+        # END handle uninteresting commits
+
+        if first_parent:
+            parents = parents[:1]
+        # END handle first parent
+
+        show = True
+        if treesame is not None:
+            if not parents:
+                show = not treesame(tree, None)
+            else:
+                for parent in parents:
+                    if treesame(tree, header(parent)[0]):
+                        parents = (parent, )
+                        show = False
+                        break
+                    # END follow the parent we are equal to
+                # END for each parent
+            # END handle root commits
+        # END simplify history
+
+        for parent in parents:
+            push(parent)
+        # END for each parent
+        last_date = date
+        if not show:
+            continue
+        if limited:
+            walked.append((binsha, date))
+        else:
+            yield binsha, date
+        # END handle limited walk
+    # END while there are commits to walk
+
+    for binsha, date in walked:
+        if binsha not in uninteresting:
+            yield binsha, date
+        # END skip commits which turned out to be uninteresting
+    # END for each walked commit
+
+
+#{ Ancestry
+
+# generation of commits which are not part of a commit-graph, which is larger than any real one
+GENERATION_INFINITY = 0xffffffff
+
+# flags used while painting the commit graph
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+
+
+def _paint_down_to_common(read_header, generation, one, twos, min_generation=0, stop_at_one=False):
+    """Walk down from one and twos at the same time, newest commits first, marking every commit
+    with the sides it is reachable from. Commits reachable from both sides are merge base candidates,
+    whose ancestors are marked stale as they cannot be the best common ancestors anymore. The walk
+    ends once only stale commits are left.
+
+    Commits are ordered by generation number first and commit date second. With generation
+    numbers, commits below min_generation cannot reach any commit of interest and end the walk.
+
+    :param read_header: callable(binsha) returning tuple(tree_binsha, tuple(parent_binsha, ...), committed_date)
+    :param generation: callable(binsha) returning the generation number of a commit,
+        or GENERATION_INFINITY if it is unknown
+    :param stop_at_one: if True, the walk ends as soon as one is known to be reachable from twos
+    :return: tuple(list(binsha, ...) of merge base candidates, dict(binsha: flags))"""
+    flags = dict()
+    headers = dict()
+    queue = list()
+    queued = dict()         # amount of queue entries per commit
+    nonstale = [0]          # amount of queue entries of commits which are not stale
+    tick = [0]
+
+    def push(binsha, commit_flags):
+        header = headers.get(binsha)
+        if header is None:
+            header = headers[binsha] = read_header(binsha)
+        tick[0] += 1
+        heappush(queue, (-generation(binsha), -header[2], tick[0], binsha))
+        queued[binsha] = queued.get(binsha, 0) + 1
+        if not commit_flags & _STALE:
+            nonstale[0] += 1
+    # END utilities
+
+    flags[one] = _PARENT1
+    for binsha in twos:
+        flags[binsha] = flags.get(binsha, 0) | _PARENT2
+    # END mark twos
+    push(one, flags[one])
+    for binsha in twos:
+        push(binsha, flags[binsha])
+    # END for each two
+
+    result = list()
+    while nonstale[0]:
+        gen, date, _, binsha = heappop(queue)
+        commit_flags = flags[binsha]
+        queued[binsha] -= 1
+        if not commit_flags & _STALE:
+            nonstale[0] -= 1
+        if -gen < min_generation:
+            break
+        # END prune by generation
+
+        commit_flags &= _PARENT1 | _PARENT2 | _STALE
+        if commit_flags == _PARENT1 | _PARENT2:
+            if binsha not in result:
+                result.append(binsha)
+            if stop_at_one and binsha == one:
+                break
+            # parents of merge bases cannot be the best merge bases
+            commit_flags |= _STALE
+        # END handle common commits
+
+        for parent in headers[binsha][1]:
+            parent_flags = flags.get(parent, 0)
+            if parent_flags & commit_flags == commit_flags:
+                continue
+            if commit_flags & _STALE and not parent_flags & _STALE:
+                # queued entries of the parent are stale now
+                nonstale[0] -= queued.get(parent, 0)
+            flags[parent] = parent_flags | commit_flags
+            push(parent, flags[parent])
+        # END for each parent
+    # END while there are commits which are not stale
+    return result, flags
+
+
+def is_ancestor(read_header, generation, ancestor, binsha):
+    """
+    :return: True if the commit with the binary sha ancestor is reachable from the commit binsha,
+        or is the same commit
+    :param read_header: see _paint_down_to_common
+    :param generation: see _paint_down_to_common"""
+    if ancestor == binsha:
+        return True
+    min_generation = generation(ancestor)
+    if min_generation > generation(binsha):
+        return False
+    # END commits cannot reach commits of a larger generation
+    if min_generation == GENERATION_INFINITY:
+        min_generation = 0
+    # END handle commits which are not part of the commit-graph
+    flags = _paint_down_to_common(read_header, generation, ancestor, [binsha], min_generation, True)[1]
+    return bool(flags[ancestor] & _PARENT2)
+
+
+def merge_bases(read_header, generation, one, twos, all_bases=False):
+    """
+    :return: list of binary shas of the best common ancestors of one and any of twos, newest first,
+        like git merge-base computes them. None of them is reachable from another.
+    :param read_header: see _paint_down_to_common
+    :param generation: see _paint_down_to_common
+    :param all_bases: if False, only the first merge base is returned"""
+    candidates, flags = _paint_down_to_common(read_header, generation, one, twos)
+    candidates = [c for c in candidates if not flags[c] & _STALE]
+
+    # remove candidates reachable from other candidates
+    if len(candidates) > 1:
+        candidates = [c for c in candidates
+                      if not any(is_ancestor(read_header, generation, c, o) for o in candidates if o != c)]
+    # END remove redundant candidates
+
+    # sort by commit date like git does, keeping the order of equal dates
+    dates = dict((c, read_header(c)[2]) for c in candidates)
+    candidates.sort(key=lambda c: -dates[c])
+    if not all_bases:
+        del(candidates[1:])
+    return candidates
 
-    return entries
+#} END ancestry
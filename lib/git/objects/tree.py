@@ -15,83 +15,46 @@ from git.compat import string_types
 
 from .fun import (
     tree_entries_from_data,
-    tree_to_stream
+    tree_entries_from_sha,
+    tree_name_index_from_sha,
+    tree_entry_sort_key,
+    tree_to_stream,
+    write_tree_with_changes,
+    _name_index
 )
 
-from gitdb.utils.compat import PY3
-
-if PY3:
-    cmp = lambda a, b: (a > b) - (a < b)
-
 __all__ = ("TreeModifier", "Tree")
 
 
-def git_cmp(t1, t2):
-    a, b = t1[2], t2[2]
-    len_a, len_b = len(a), len(b)
-    min_len = min(len_a, len_b)
-    min_cmp = cmp(a[:min_len], b[:min_len])
-
-    if min_cmp:
-        return min_cmp
-
-    return len_a - len_b
-
-
-def merge_sort(a, cmp):
-    if len(a) < 2:
-        return
-
-    mid = len(a) // 2
-    lefthalf = a[:mid]
-    righthalf = a[mid:]
-
-    merge_sort(lefthalf, cmp)
-    merge_sort(righthalf, cmp)
-
-    i = 0
-    j = 0
-    k = 0
-
-    while i < len(lefthalf) and j < len(righthalf):
-        if cmp(lefthalf[i], righthalf[j]) <= 0:
-            a[k] = lefthalf[i]
-            i = i + 1
-        else:
-            a[k] = righthalf[j]
-            j = j + 1
-        k = k + 1
-
-    while i < len(lefthalf):
-        a[k] = lefthalf[i]
-        i = i + 1
-        k = k + 1
-
-    while j < len(righthalf):
-        a[k] = righthalf[j]
-        j = j + 1
-        k = k + 1
-
-
 class TreeModifier(object):
 
     """A utility class providing methods to alter the underlying cache in a list-like fashion.
 
     Once all adjustments are complete, the _cache, which really is a refernce to
     the cache of a tree, will be sorted. Assuring it will be in a serializable state"""
-    __slots__ = '_cache'
+    __slots__ = ('_cache', '_tree', '_index')
 
-    def __init__(self, cache):
+    def __init__(self, cache, tree=None):
+        """:param tree: if not None, the Tree owning the cache, whose lookup index is dropped on change"""
         self._cache = cache
+        self._tree = tree
+        self._index = None
 
     def _index_by_name(self, name):
         """:return: index of an item with name, or -1 if not found"""
-        for i, t in enumerate(self._cache):
-            if t[2] == name:
-                return i
-            # END found item
-        # END for each item in cache
-        return -1
+        if self._index is None:
+            self._index = _name_index(self._cache)
+        # END build index
+        return self._index.get(name, -1)
+
+    def _changed(self, keeps_positions=False):
+        """Called after the cache was changed, to drop lookup indices which became invalid
+        :param keeps_positions: if True, entries were added at the end only"""
+        if not keeps_positions:
+            self._index = None
+        if self._tree is not None:
+            self._tree._drop_index()
+        # END handle tree
 
     #{ Interface
     def set_done(self):
@@ -99,7 +62,8 @@ class TreeModifier(object):
         It may be called several times, but be aware that each call will cause
         a sort operation
         :return self:"""
-        merge_sort(self._cache, git_cmp)
+        self._cache.sort(key=tree_entry_sort_key)
+        self._changed()
         return self
     #} END interface
 
@@ -125,9 +89,13 @@ class TreeModifier(object):
         item = (sha, mode, name)
         if index == -1:
             self._cache.append(item)
+            if self._index is not None:
+                self._index[name] = len(self._cache) - 1
+            self._changed(keeps_positions=True)
         else:
             if force:
                 self._cache[index] = item
+                self._changed(keeps_positions=True)
             else:
                 ex_item = self._cache[index]
                 if ex_item[0] != sha or ex_item[1] != mode:
@@ -143,12 +111,16 @@ class TreeModifier(object):
         For more information on the parameters, see ``add``
         :param binsha: 20 byte binary sha"""
         self._cache.append((binsha, mode, name))
+        if self._index is not None:
+            self._index.setdefault(name, len(self._cache) - 1)
+        self._changed(keeps_positions=True)
 
     def __delitem__(self, name):
         """Deletes an item with the given name if it exists"""
         index = self._index_by_name(name)
         if index > -1:
             del(self._cache[index])
+            self._changed()
 
     #} END mutators
 
@@ -167,7 +139,7 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
     """
 
     type = "tree"
-    __slots__ = "_cache"
+    __slots__ = ("_cache", "_index")
 
     # actual integer ids for comparison
     commit_id = 0o16     # equals stat.S_IFDIR | stat.S_IFLNK - a directory link
@@ -193,13 +165,61 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
 
     def _set_cache_(self, attr):
         if attr == "_cache":
-            # Set the data when we need it
-            ostream = self.repo.odb.stream(self.binsha)
-            self._cache = tree_entries_from_data(ostream.read())
+            # Set the data when we need it, trees are immutable so their entries are shared
+            # among all instances. We get our own list as it may be modified
+            self._cache = list(tree_entries_from_sha(self.repo.odb, self.binsha, self.repo.tree_cache))
         else:
             super(Tree, self)._set_cache_(attr)
         # END handle attribute
 
+    def _drop_index(self):
+        """Forget our lookup indices, as our entries changed"""
+        try:
+            del(self._index)
+        except AttributeError:
+            pass
+        # END handle missing index
+
+    def _entry_index(self):
+        """:return: list [entries, dict(name: position), set(binsha) or None] indexing our entries.
+            It is built on first use, and rebuilt if our entries were replaced"""
+        cache = self._cache
+        try:
+            index = self._index
+        except AttributeError:
+            index = None
+        # END handle missing index
+        if index is None or index[0] is not cache:
+            index = self._index = [cache, _name_index(cache), None]
+        # END build index
+        return index
+
+    def _entry_by_name(self, name):
+        """:return: entry tuple(binsha, mode, name) with the given name, or None"""
+        entries, names, shas = self._entry_index()
+        pos = names.get(name)
+        if pos is None:
+            return None
+        return entries[pos]
+
+    def _object_from_entry(self, info, path=None):
+        """:return: Blob, Tree or Submodule for the given entry of ours, or of the tree at path"""
+        if path is None:
+            path = self.path
+        return self._map_id_to_type[info[1] >> 12](self.repo, info[0], info[1], join_path(path, info[2]))
+
+    def _subtree_entry(self, info, name):
+        """:return: entry with the given name in the tree of the given entry of ours or one below,
+            or None if there is none or if the entry is no tree.
+            Trees below us are read from the repository's tree_cache, and are never modified"""
+        if info is None or info[1] >> 12 != self.tree_id:
+            return None
+        entries, names = tree_name_index_from_sha(self.repo.odb, info[0], self.repo.tree_cache)
+        pos = names.get(name)
+        if pos is None:
+            return None
+        return entries[pos]
+
     def _iter_convert_to_object(self, iterable):
         """Iterable yields tuples of (binsha, mode, name), which will be converted
         to the respective object representation"""
@@ -217,32 +237,51 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
 
         :raise KeyError: if given file or tree does not exist in tree"""
         msg = "Blob or Tree named %r not found"
-        if '/' in file:
-            tree = self
-            item = self
-            tokens = file.split('/')
-            for i, token in enumerate(tokens):
-                item = tree[token]
-                if item.type == 'tree':
-                    tree = item
-                else:
-                    # safety assertion - blobs are at the end of the path
-                    if i != len(tokens) - 1:
-                        raise KeyError(msg % file)
-                    return item
-                # END handle item type
-            # END for each token of split path
-            if item == self:
-                raise KeyError(msg % file)
-            return item
-        else:
-            for info in self._cache:
-                if info[2] == file:     # [2] == name
-                    return self._map_id_to_type[info[1] >> 12](self.repo, info[0], info[1],
-                                                               join_path(self.path, info[2]))
-            # END for each obj
+        tokens = file.split('/')
+        info = self._entry_by_name(tokens[0])
+        path = self.path
+        for token in tokens[1:]:
+            # blobs can only be at the end of the path
+            path = join_path(path, info and info[2] or '')
+            info = self._subtree_entry(info, token)
+        # END for each token of split path
+        if info is None:
             raise KeyError(msg % file)
-        # END handle long paths
+        return self._object_from_entry(info, path)
+
+    def resolve_many(self, paths):
+        """Find the objects at many paths at once, reading each tree on the way only once
+        for all paths below it
+
+        :param paths: iterable of paths relative to this tree, like the ones ``join`` takes
+        :return: list with the ``git.Blob``, ``git.Tree`` or ``git.Submodule`` at each of the
+            given paths, or None where a path does not exist"""
+        entries = dict()
+
+        def entry(path):
+            """:return: our entry or the one below us at the given path, or None"""
+            try:
+                return entries[path]
+            except KeyError:
+                parent, _, name = path.rpartition('/')
+                if parent:
+                    info = self._subtree_entry(entry(parent), name)
+                else:
+                    info = self._entry_by_name(name)
+                # END handle our own entries
+                entries[path] = info
+                return info
+            # END handle unknown paths
+        # END utility
+
+        out = list()
+        for path in paths:
+            info = entry(path)
+            if info is not None:
+                info = self._object_from_entry(info, join_path(self.path, path.rpartition('/')[0]))
+            out.append(info)
+        # END for each path
+        return out
 
     def __div__(self, file):
         """For PY2 only"""
@@ -269,10 +308,22 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
             to change the tree's contents. When done, make sure you call ``set_done``
             on the tree modifier, or serialization behaviour will be incorrect.
             See the ``TreeModifier`` for more information on how to alter the cache"""
-        return TreeModifier(self._cache)
-
-    def traverse(self, predicate=lambda i, d: True,
-                 prune=lambda i, d: False, depth=-1, branch_first=True,
+        return TreeModifier(self._cache, self)
+
+    def with_changes(self, changes):
+        """Write a new tree with many changes applied to this one in one pass, along with all
+        changed trees below it. Changes done through the ``cache`` are not taken into account.
+
+        :param changes: iterable of (path, entry) tuples, path being relative to this tree and entry
+            either a tuple(sha, mode) of the item to put at the path, sha being 20 or 40 bytes,
+            or None to remove the item at the path. Trees on the way are created as needed, and
+            removed if they become empty
+        :return: ``git.Tree`` with the changes applied, stored in the object database"""
+        changes = ((path, entry and (to_bin_sha(entry[0]), entry[1])) for path, entry in changes)
+        binsha = write_tree_with_changes(self.repo.odb, self.binsha, changes, self.repo.tree_cache)
+        return Tree(self.repo, binsha, self.mode, self.path)
+
+    def traverse(self, predicate=util._include_all, prune=util._prune_none, depth=-1, branch_first=True,
                  visit_once=False, ignore_self=1):
         """For documentation, see util.Traversable.traverse
         Trees are set to visit_once = False to gain more performance in the traversal"""
@@ -290,8 +341,7 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
 
     def __getitem__(self, item):
         if isinstance(item, int):
-            info = self._cache[item]
-            return self._map_id_to_type[info[1] >> 12](self.repo, info[0], info[1], join_path(self.path, info[2]))
+            return self._object_from_entry(self._cache[item])
 
         if isinstance(item, string_types):
             # compatability
@@ -302,21 +352,24 @@ class Tree(IndexObject, diff.Diffable, util.Traversable, util.Serializable):
 
     def __contains__(self, item):
         if isinstance(item, IndexObject):
-            for info in self._cache:
-                if item.binsha == info[0]:
-                    return True
-                # END compare sha
-            # END for each entry
+            index = self._entry_index()
+            if index[2] is None:
+                index[2] = set(info[0] for info in index[0])
+            # END build sha index
+            return item.binsha in index[2]
         # END handle item is index object
-        # compatability
+        if not isinstance(item, string_types):
+            return False
+        # END handle invalid items
 
         # treat item as repo-relative path
-        path = self.path
-        for info in self._cache:
-            if item == join_path(path, info[2]):
-                return True
-        # END for each item
-        return False
+        prefix = self.path
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        # END handle root
+        if not item.startswith(prefix):
+            return False
+        return item[len(prefix):] in self._entry_index()[1]
 
     def __reversed__(self):
         return reversed(self._iter_convert_to_object(self._cache))
@@ -6,7 +6,8 @@
 """Module for general utility functions"""
 from git.util import (
     IterableList,
-    Actor
+    Actor,
+    LRUCache
 )
 
 import re
@@ -19,10 +20,16 @@ from datetime import datetime, timedelta, tzinfo
 
 __all__ = ('get_object_type_by_name', 'parse_date', 'parse_actor_and_date',
            'ProcessStreamAdapter', 'Traversable', 'altz_to_utctz_str', 'utctz_to_altz',
-           'verify_utctz', 'Actor', 'tzoffset', 'utc')
+           'verify_utctz', 'Actor', 'tzoffset', 'utc', 'intern_actor', 'intern_tzoffset')
 
 ZERO = timedelta(0)
 
+# histories have few distinct actors and timezones, but millions of lines mentioning them.
+# They are parsed once and shared, see intern_actor() and intern_tzoffset()
+_actor_cache = LRUCache(4096)
+_utctz_cache = LRUCache(256)
+_tzoffset_cache = LRUCache(256)
+
 #{ Functions
 
 
@@ -70,7 +77,12 @@ def utctz_to_altz(utctz):
     returns. Git stores it as UTC timezone which has the opposite sign as well,
     which explains the -1 * ( that was made explicit here )
     :param utctz: git utc timezone string, i.e. +0200"""
-    return -1 * int(float(utctz) / 100 * 3600)
+    altz = _utctz_cache.get(utctz)
+    if altz is None:
+        altz = -1 * int(float(utctz) / 100 * 3600)
+        _utctz_cache[utctz] = altz
+    # END handle cache miss
+    return altz
 
 
 def altz_to_utctz_str(altz):
@@ -118,10 +130,36 @@ class tzoffset(tzinfo):
 utc = tzoffset(0, 'UTC')
 
 
+def intern_tzoffset(secs_west_of_utc):
+    """:return: tzoffset instance for the given offset, shared with all other callers asking for it"""
+    tz = _tzoffset_cache.get(secs_west_of_utc)
+    if tz is None:
+        tz = tzoffset(secs_west_of_utc)
+        _tzoffset_cache[secs_west_of_utc] = tz
+    # END handle cache miss
+    return tz
+
+
+def intern_actor(string):
+    """:return: Actor parsed from the given 'name <email>' string, shared with all other callers passing
+        the same string.
+    :note: Assign new Actor instances instead of changing the returned one, changes would show up in
+        every object sharing it. An actor changed nonetheless is not handed out anymore."""
+    entry = _actor_cache.get(string)
+    if entry is not None:
+        actor, name, email = entry
+        if actor.name is name and actor.email is email:
+            return actor
+    # END handle cache hit
+    actor = Actor._from_string(string)
+    _actor_cache[string] = (actor, actor.name, actor.email)
+    return actor
+
+
 def from_timestamp(timestamp, tz_offset):
     """Converts a timestamp + tz_offset into an aware datetime instance."""
     utc_dt = datetime.fromtimestamp(timestamp, utc)
-    local_dt = utc_dt.astimezone(tzoffset(tz_offset))
+    local_dt = utc_dt.astimezone(intern_tzoffset(tz_offset))
     return local_dt
 
 
@@ -218,7 +256,7 @@ def parse_actor_and_date(line):
     else:
         m = _re_only_actor.search(line)
         actor = m.group(1) if m else line or ''
-    return (Actor._from_string(actor), int(epoch), utctz_to_altz(offset))
+    return (intern_actor(actor), int(epoch), utctz_to_altz(offset))
 
 #} END functions
 
@@ -242,6 +280,16 @@ class ProcessStreamAdapter(object):
         return getattr(self._stream, attr)
 
 
+def _include_all(item, depth):
+    """Default predicate of Traversable.traverse, which is known to include everything"""
+    return True
+
+
+def _prune_none(item, depth):
+    """Default prune function of Traversable.traverse, which is known to prune nothing"""
+    return False
+
+
 class Traversable(object):
 
     """Simple interface to perform depth-first or breadth-first traversals
@@ -267,8 +315,7 @@ class Traversable(object):
         out.extend(self.traverse(*args, **kwargs))
         return out
 
-    def traverse(self, predicate=lambda i, d: True,
-                 prune=lambda i, d: False, depth=-1, branch_first=True,
+    def traverse(self, predicate=_include_all, prune=_prune_none, depth=-1, branch_first=True,
                  visit_once=True, ignore_self=1, as_edge=False):
         """:return: iterator yieling of items found when traversing self
 
@@ -299,7 +346,22 @@ class Traversable(object):
         :param as_edge:
             if True, return a pair of items, first being the source, second the
             destinatination, i.e. tuple(src, dest) with the edge spanning from
-            source to destination"""
+            source to destination
+
+        :note: with the default predicate and prune functions, neither is called, and subclasses
+            may walk their items more efficiently, see ``_traverse_all``"""
+        if predicate is _include_all and prune is _prune_none and not as_edge:
+            return self._traverse_all(depth, branch_first, visit_once, ignore_self)
+        # END use fast path
+        return self._traverse(predicate, prune, depth, branch_first, visit_once, ignore_self, as_edge)
+
+    def _traverse_all(self, depth, branch_first, visit_once, ignore_self):
+        """:return: iterator yielding all items traverse() would yield with the default predicate and prune
+            functions, and without edges. Subclasses may override it with a more efficient implementation"""
+        return self._traverse(None, None, depth, branch_first, visit_once, ignore_self, False)
+
+    def _traverse(self, predicate, prune, depth, branch_first, visit_once, ignore_self, as_edge):
+        """Implements traverse(), predicate and prune may be None to include everything"""
         visited = set()
         stack = Deque()
         stack.append((0, self, None))       # self is always depth level 0
@@ -325,11 +387,11 @@ class Traversable(object):
                 visited.add(item)
 
             rval = (as_edge and (src, item)) or item
-            if prune(rval, d):
+            if prune is not None and prune(rval, d):
                 continue
 
             skipStartItem = ignore_self and (item is self)
-            if not skipStartItem and predicate(rval, d):
+            if not skipStartItem and (predicate is None or predicate(rval, d)):
                 yield rval
 
             # only continue to next level if this is appropriate !
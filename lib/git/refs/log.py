@@ -16,6 +16,7 @@ from git.objects.util import (
     parse_date,
     Serializable,
     altz_to_utctz_str,
+    intern_actor,
 )
 from git.compat import (
     PY3,
@@ -123,7 +124,7 @@ class RefLogEntry(tuple):
             raise ValueError("Missing token: >")
         # END handle missing end brace
 
-        actor = Actor._from_string(info[82:email_end + 1])
+        actor = intern_actor(info[82:email_end + 1])
         time, tz_offset = parse_date(info[email_end + 2:])
 
         return RefLogEntry((oldhexsha, newhexsha, actor, (time, tz_offset), msg))
@@ -24,8 +24,14 @@ from git.objects import (
     RootModule,
     Commit
 )
+from git.objects.fun import (
+    TreePrefetcher,
+    merge_bases,
+    is_ancestor as commit_is_ancestor
+)
 from git.util import (
     Actor,
+    LRUCache,
     finalize_process
 )
 from git.index import IndexFile
@@ -36,7 +42,15 @@ from git.remote import (
     to_progress_instance
 )
 
-from git.db import GitCmdObjectDB
+from git.db import (
+    GitCmdObjectDB,
+    GitDB,
+    CommitGraph
+)
+from git.diff import (
+    Diff,
+    DiffIndex
+)
 
 from gitdb.util import (
     join,
@@ -59,9 +73,15 @@ from git.compat import (
 )
 
 import os
+import io
 import sys
 import re
-from collections import namedtuple
+from contextlib import contextmanager
+from collections import (
+    namedtuple,
+    deque
+)
+from subprocess import PIPE
 
 DefaultDBType = GitCmdObjectDB
 if sys.version_info[:2] < (2, 5):     # python 2.4 compatiblity
@@ -93,7 +113,8 @@ class Repo(object):
 
     'git_dir' is the .git repository directory, which is always set."""
     DAEMON_EXPORT_FILE = 'git-daemon-export-ok'
-    __slots__ = ("working_dir", "_working_tree_dir", "git_dir", "_bare", "git", "odb")
+    __slots__ = ("working_dir", "_working_tree_dir", "git_dir", "_bare", "git", "odb", "_commit_graph",
+                 "_ancestry_cache", "_tree_cache")
 
     # precompiled regex
     re_whitespace = re.compile(r'\s+')
@@ -110,6 +131,12 @@ class Repo(object):
     # Subclasses may easily bring in their own custom types by placing a constructor or type here
     GitCommandWrapperType = Git
 
+    # amount of merge_base and is_ancestor answers to keep
+    ancestry_cache_size = 4096
+    # bounds of the tree_cache, in trees and bytes of raw tree data
+    tree_cache_size = 4096
+    tree_cache_bytes = 16 * 1024 * 1024
+
     def __init__(self, path=None, odbt=DefaultDBType, search_parent_directories=False):
         """Create a new Repo instance
 
@@ -232,6 +259,18 @@ class Repo(object):
         """:return: True if the repository is bare"""
         return self._bare
 
+    @property
+    def commit_graph(self):
+        """:return: git.CommitGraph providing the commit-graph file or chain of this repository,
+            or None if git did not write one. It is read on first access only.
+        :note: Commits created after the commit-graph was written are not contained"""
+        try:
+            return self._commit_graph
+        except AttributeError:
+            self._commit_graph = CommitGraph.from_objects_dir(join(self.git_dir, 'objects'))
+            return self._commit_graph
+        # END handle first access
+
     @property
     def heads(self):
         """A list of ``Head`` objects representing the branch heads in
@@ -478,11 +517,153 @@ class Repo(object):
 
         return Commit.iter_items(self, rev, paths, **kwargs)
 
+    def iter_commit_records(self, rev=None, paths='', **kwargs):
+        """As ``iter_commits``, but yield compact records, which are cheap enough to keep
+        large histories in memory. Use ``CommitRecord.to_commit`` to obtain the full Commit.
+
+        :return: iterator yielding ``git.CommitRecord`` items"""
+        if rev is None:
+            rev = self.head.commit
+
+        return Commit.iter_records(self, rev, paths, **kwargs)
+
+    def iter_commit_diffs(self, commits, paths=None, **kwargs):
+        """Diff many commits using a single git-diff-tree process, which is fed with one
+        commit pair after another. Diffs are read as they arrive, so results are yielded
+        while later commits are still being diffed.
+
+        :param commits:
+            iterable of Commit objects, each of which will be diffed against its first
+            parent, or the empty tree if it has none, or of tuple(Commit, other_commit)
+            pairs to diff the commit against other_commit instead.
+
+        :param paths:
+            is a list of paths or a single path to limit the diffs to.
+
+        :param kwargs:
+            Additional arguments passed to git-diff-tree
+
+        :return:
+            iterator yielding tuple(Commit, DiffIndex) pairs in the order of the given
+            commits. Diffs describe the change from the parent to the commit, like
+            ``parent.diff(commit)`` would, and are rename-aware."""
+        args = ['--stdin', '--always', '--root', '-r', '-M', '--raw', '-z',
+                '--abbrev=40', '--full-index', '--no-color']
+        if paths:
+            if not isinstance(paths, (tuple, list)):
+                paths = [paths]
+            args.append('--')
+            args.extend(paths)
+        # END handle paths
+
+        proc = self.git.diff_tree(*args, istream=PIPE, as_process=True, **kwargs)
+        stdout = proc.stdout
+        if not hasattr(stdout, 'read1'):
+            # we must not wait for more data than git gave us, or we would wait forever
+            stdout = io.open(stdout.fileno(), 'rb', closefd=False)
+        # END assure we can read what is available
+
+        commits = iter(commits)
+        sent = deque()      # commits git will print the diffs of next
+
+        def send_next():
+            """Hand the next commit to git, and close its input once there is none"""
+            for item in commits:
+                if isinstance(item, tuple):
+                    commit, other = item
+                    line = "%s %s\n" % (commit.hexsha, other.hexsha)
+                else:
+                    commit = item
+                    line = commit.hexsha + "\n"
+                    if commit.parents:
+                        line = "%s %s\n" % (commit.hexsha, commit.parents[0].hexsha)
+                    # END use first parent only
+                # END handle pairs
+                proc.stdin.write(line.encode('ascii'))
+                proc.stdin.flush()
+                sent.append(commit)
+                return
+            # END for each commit
+            proc.stdin.close()
+        # END send next
+
+        # git prints a commit's sha before its diffs. Staying exactly one commit ahead tells
+        # us when a commit is done, and assures git never waits for input we are waiting for.
+        commit = index = None
+        send_next()
+        for item in Diff._iter_from_raw_z_format(self, stdout, headers=True):
+            if isinstance(item, Diff):
+                index.append(item)
+                continue
+            # END handle diff
+
+            if commit is not None:
+                yield commit, index
+            commit = sent.popleft()
+            assert item == commit.hexsha.encode('ascii'), "Unexpected diff-tree output: %r" % item
+            index = DiffIndex()
+            send_next()
+        # END for each item
+        if commit is not None:
+            yield commit, index
+        # END handle last commit
+        proc.wait()
+
+    @property
+    def ancestry_cache(self):
+        """:return: git.util.LRUCache with answers of merge_base and is_ancestor, which never change
+            as commits are immutable. It keeps up to ``ancestry_cache_size`` answers"""
+        try:
+            return self._ancestry_cache
+        except AttributeError:
+            self._ancestry_cache = LRUCache(self.ancestry_cache_size)
+            return self._ancestry_cache
+        # end handle first access
+
+    @property
+    def tree_cache(self):
+        """:return: git.util.LRUCache with the parsed entries of trees read recently, keyed by their
+            binary sha. It keeps up to ``tree_cache_size`` trees, as long as they don't exceed
+            ``tree_cache_bytes`` of raw tree data"""
+        try:
+            return self._tree_cache
+        except AttributeError:
+            self._tree_cache = LRUCache(self.tree_cache_size, self.tree_cache_bytes)
+            return self._tree_cache
+        # end handle first access
+
+    @contextmanager
+    def prefetch_trees(self, workers=4, max_pending=1024):
+        """Context manager to read trees ahead of time while it is active. All trees read through
+        the ``tree_cache``, by Tree objects, native diffs, IndexFile.new or functions given the cache,
+        have their subtrees read by a pool of threads, which inflate them in parallel.
+        IndexFile.from_tree runs git read-tree and does not benefit.
+
+        :param workers: amount of threads reading trees
+        :param max_pending: maximum amount of trees waiting to be read
+        :return: the git.objects.fun.TreePrefetcher taking the place of the ``tree_cache``"""
+        cache = self.tree_cache
+        odb = self.odb
+        if isinstance(odb, GitCmdObjectDB):
+            # the git process can only read one object at a time
+            odb = GitDB(join(self.git_dir, 'objects'))
+        # end handle git command database
+        prefetcher = TreePrefetcher(odb, cache, workers, max_pending)
+        self._tree_cache = prefetcher
+        try:
+            yield prefetcher
+        finally:
+            self._tree_cache = cache
+            prefetcher.close()
+        # end restore cache
+
     def merge_base(self, *rev, **kwargs):
         """Find the closest common ancestor for the given revision (e.g. Commits, Tags, References, etc)
 
         :param rev: At least two revs to find the common ancestor for.
-        :param kwargs: Additional arguments to be passed to the repo.git.merge_base() command which does all the work.
+        :param kwargs: Additional arguments to be passed to the repo.git.merge_base() command. Without any,
+            or with ``all`` only, the merge base is computed in-process, using generation numbers of the
+            commit-graph if there is one. Answers are kept in the ``ancestry_cache``.
         :return: A list of Commit objects. If --all was not specified as kwarg, the list will have at max one Commit,
             or is empty if no common merge base exists.
         :raises ValueError: If not at least two revs are provided
@@ -491,6 +672,23 @@ class Repo(object):
             raise ValueError("Please specify at least two revs, got only %i" % len(rev))
         # end handle input
 
+        # common queries are answered in-process, git handles everything else
+        binshas = None
+        if not kwargs or list(kwargs) == ['all']:
+            binshas = [Commit._native_rev_binsha(self, r) for r in rev]
+        # end check for native support
+        if binshas is not None and None not in binshas:
+            all_bases = bool(kwargs.get('all'))
+            key = ('merge_base', tuple(binshas), all_bases)
+            bases = self.ancestry_cache.get(key)
+            if bases is None:
+                bases = tuple(merge_bases(Commit._header_reader(self), Commit._generation_reader(self),
+                                          binshas[0], binshas[1:], all_bases))
+                self.ancestry_cache[key] = bases
+            # end handle cache miss
+            return [Commit(self, binsha) for binsha in bases]
+        # end handle native query
+
         res = list()
         try:
             lines = self.git.merge_base(*rev, **kwargs).splitlines()
@@ -515,7 +713,22 @@ class Repo(object):
         :param ancestor_rev: Rev which should be an ancestor
         :param rev: Rev to test against ancestor_rev
         :return: ``True``, ancestor_rev is an accestor to rev.
+        :note: The answer is computed in-process and kept in the ``ancestry_cache``, git is
+            only asked if a rev cannot be resolved natively
         """
+        ancestor = Commit._native_rev_binsha(self, ancestor_rev)
+        binsha = Commit._native_rev_binsha(self, rev)
+        if ancestor is not None and binsha is not None:
+            key = ('is_ancestor', ancestor, binsha)
+            answer = self.ancestry_cache.get(key)
+            if answer is None:
+                answer = commit_is_ancestor(Commit._header_reader(self), Commit._generation_reader(self),
+                                            ancestor, binsha)
+                self.ancestry_cache[key] = answer
+            # end handle cache miss
+            return answer
+        # end handle native query
+
         try:
             self.git.merge_base(ancestor_rev, rev, is_ancestor=True)
         except GitCommandError as err:
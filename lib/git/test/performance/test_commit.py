@@ -7,10 +7,24 @@ from __future__ import print_function
 from io import BytesIO
 from time import time
 import sys
+import os
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+# END handle python 2
+
+from nose import SkipTest
 
 from .lib import TestBigRepoRW
-from git import Commit
+from git import (
+    Repo,
+    Commit,
+    GitCommandError
+)
 from gitdb import IStream
+from gitdb.test.lib import with_rw_directory
 from git.compat import xrange
 from git.test.test_commit import assert_commit_serialization
 
@@ -103,3 +117,95 @@ class TestPerformance(TestBigRepoRW):
 
         print("Serialized %i commits to loose objects in %f s ( %f commits / s )"
               % (nc, elapsed, nc / elapsed), file=sys.stderr)
+
+    def test_ancestry(self):
+        # compare in-process ancestry queries with asking git, on pairs of commits far apart
+        repo = self.gitrorepo
+        hexshas = repo.git.rev_list(repo.head, max_count=2000).split()
+        step = max(len(hexshas) // 50, 1)
+        pairs = [(hexshas[-1 - i], hexshas[i]) for i in range(0, len(hexshas) // 2, step)]
+
+        def git_is_ancestor(ancestor, rev):
+            try:
+                repo.git.merge_base(ancestor, rev, is_ancestor=True)
+            except GitCommandError as err:
+                if err.status == 1:
+                    return False
+                raise
+            return True
+        # END git query
+
+        def git_merge_base(*revs):
+            return [repo.commit(line) for line in repo.git.merge_base(*revs).splitlines()]
+        # END git query
+
+        commit_graph = repo.commit_graph
+        for name, graph, is_ancestor, merge_base in (
+                ("git", None, git_is_ancestor, git_merge_base),
+                ("native, cold cache, no commit-graph", None, repo.is_ancestor, repo.merge_base),
+                ("native, cold cache, with commit-graph", commit_graph, repo.is_ancestor, repo.merge_base),
+                ("native, warm cache", commit_graph, repo.is_ancestor, repo.merge_base)):
+            if "with commit-graph" in name and commit_graph is None:
+                continue
+            # END skip without commit-graph
+            repo._commit_graph = graph
+            if "cold" in name:
+                repo.ancestry_cache.clear()
+            # END handle cache
+
+            st = time()
+            for ancestor, rev in pairs:
+                assert is_ancestor(ancestor, rev)
+                assert not is_ancestor(rev, ancestor)
+                assert merge_base(ancestor, rev)[0].hexsha == ancestor
+            # END for each pair
+            elapsed = time() - st
+            nq = len(pairs) * 3
+            print("%s: answered %i ancestry queries in %f s ( %f queries / s )"
+                  % (name, nq, elapsed, nq / elapsed), file=sys.stderr)
+        # END for each method
+        repo._commit_graph = commit_graph
+
+    @with_rw_directory
+    def test_commit_records_memory(self, path):
+        if tracemalloc is None:
+            raise SkipTest("tracemalloc is required to measure memory usage")
+        # END skip without tracemalloc
+
+        # a synthetic history with many commits by few authors, like real projects have
+        nc = 20000
+        rwrepo = Repo.init(path)
+        stream_path = os.path.join(path, 'fast-import')
+        with open(stream_path, 'wb') as fp:
+            for i in xrange(nc):
+                actor = "Author %i <author%i@example.com> %i +0%i00" % (i % 25, i % 25, 1400000000 + i * 60, i % 3)
+                message = "Change %i\n\nA longer description of change number %i.\n" % (i, i)
+                content = "%i\n" % i
+                fp.write(("commit refs/heads/master\nauthor %s\ncommitter %s\ndata %i\n%s"
+                          "M 644 inline file%i\ndata %i\n%s\n"
+                          % (actor, actor, len(message), message, i % 100, len(content), content)).encode('ascii'))
+            # END for each commit
+        # END write fast-import stream
+        with open(stream_path, 'rb') as fp:
+            rwrepo.git.fast_import(quiet=True, istream=fp)
+        # END import history
+
+        for name, iter_commits in (("Commit", lambda: [self._query_commit_info(c) or c
+                                                       for c in rwrepo.iter_commits('master')]),
+                                   ("CommitRecord", lambda: list(rwrepo.iter_commit_records('master')))):
+            tracemalloc.start()
+            try:
+                st = time()
+                base = tracemalloc.get_traced_memory()[0]
+                commits = iter_commits()
+                elapsed = time() - st
+                used = tracemalloc.get_traced_memory()[0] - base
+            finally:
+                tracemalloc.stop()
+            # END measure memory
+            assert len(commits) == nc
+            del commits
+
+            print("Loaded %i commits as %s in %f s ( %f commits / s ), taking %i bytes each"
+                  % (nc, name, elapsed, nc / elapsed, used / nc), file=sys.stderr)
+        # END for each type
@@ -0,0 +1,51 @@
+"""Performance tests for diffs"""
+from __future__ import print_function
+from time import time
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+# END handle python 2
+
+from nose import SkipTest
+
+from .lib import (
+    TestBigRepoR
+)
+
+
+class TestDiffPerformance(TestBigRepoR):
+
+    # sha of the empty tree, which git knows even if it is not in the object database
+    empty_tree_sha = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+    def test_diff_memory(self):
+        if tracemalloc is None:
+            raise SkipTest("tracemalloc is required to measure memory usage")
+        # END skip without tracemalloc
+
+        commit = self.gitrorepo.commit(self.gitrorepo.head)
+
+        # diffing against the empty tree lists every file of the head commit
+        tracemalloc.start()
+        try:
+            st = time()
+            base = tracemalloc.get_traced_memory()[0]
+            index = commit.diff(self.empty_tree_sha)
+            nd = len(index)
+            elapsed = time() - st
+            compact = tracemalloc.get_traced_memory()[0] - base
+
+            # diffs used to hold a Blob per side, created right away
+            blobs = [(d.a_blob, d.b_blob) for d in index]
+            with_blobs = tracemalloc.get_traced_memory()[0] - base
+        finally:
+            tracemalloc.stop()
+        # END measure memory
+        assert nd and len(blobs) == nd
+
+        print("Parsed %i diffs in %f s ( %f diffs / s )" % (nd, elapsed, nd / elapsed), file=sys.stderr)
+        print("Diffs take %i bytes each, or %i bytes with their blobs created eagerly as before"
+              % (compact / nd, with_blobs / nd), file=sys.stderr)
@@ -0,0 +1,112 @@
+"""Performance tests for the index"""
+from __future__ import print_function
+from io import BytesIO
+from time import time
+import os
+import sys
+import tempfile
+
+from .lib import (
+    TestBigRepoR
+)
+from git.index.fun import (
+    read_cache,
+    write_cache,
+    write_tree_from_cache
+)
+from git.index.typ import (
+    IndexEntry,
+    CacheTree
+)
+from gitdb.db import MemoryDB
+from git.util import file_contents_ro
+from git.compat import xrange
+
+
+class TestIndexPerformance(TestBigRepoR):
+
+    def _make_entries(self, ne):
+        """:return: list of ne index entries, spread over 100 entries per directory"""
+        stat = (b'\0' * 8, b'\0' * 8, 0, 0, 0, 0, 0)
+        return [IndexEntry((0o100644, ('%020i' % i).encode('ascii'), 0,
+                            u'dir_%05i/sub/file_%07i.py' % (i // 100, i)) + stat)
+                for i in xrange(ne)]
+
+    def test_read_cache(self):
+        ne = 500000
+        stream = BytesIO()
+        write_cache(self._make_entries(ne), stream)
+        data = stream.getvalue()
+
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, data)
+            for name, make_stream in (("memory", lambda: BytesIO(data)),
+                                      ("memory map", lambda: file_contents_ro(fd, stream=True))):
+                st = time()
+                entries = read_cache(make_stream())[1]
+                elapsed = time() - st
+                assert len(entries) == ne
+                print("Read an index of %i entries ( %i KiB ) from %s in %f s ( %f entries / s )"
+                      % (ne, len(data) / 1024, name, elapsed, ne / elapsed), file=sys.stderr)
+            # END for each kind of stream
+        finally:
+            os.close(fd)
+            os.remove(path)
+        # END cleanup
+
+        keys = [(u'dir_%05i/sub/file_%07i.py' % (i // 100, i), 0) for i in xrange(0, ne, 100)]
+        st = time()
+        for key in keys:
+            entries[key]
+        # END for each key
+        elapsed = time() - st
+        print("Looked up %i entries in %f s ( %f entries / s )"
+              % (len(keys), elapsed, len(keys) / elapsed), file=sys.stderr)
+
+        st = time()
+        assert sum(1 for entry in entries.values()) == ne
+        elapsed = time() - st
+        print("Iterated %i entries in %f s ( %f entries / s )" % (ne, elapsed, ne / elapsed), file=sys.stderr)
+
+        # paths sharing long prefixes compress well in version 4
+        stream = BytesIO()
+        write_cache(list(entries.values()), stream, version=4)
+        data_v4 = stream.getvalue()
+        st = time()
+        assert len(read_cache(BytesIO(data_v4))[1]) == ne
+        elapsed = time() - st
+        print("Read an index of %i entries ( %i KiB instead of %i KiB ) in version 4 in %f s ( %f entries / s )"
+              % (ne, len(data_v4) / 1024, len(data) / 1024, elapsed, ne / elapsed), file=sys.stderr)
+
+    def test_write_cache(self):
+        ne = 500000
+        entries = self._make_entries(ne)
+        for version in (2, 4):
+            stream = BytesIO()
+            st = time()
+            write_cache(entries, stream, version=version)
+            elapsed = time() - st
+            print("Wrote an index of %i entries ( %i KiB ) in version %i in %f s ( %f entries / s )"
+                  % (ne, len(stream.getvalue()) / 1024, version, elapsed, ne / elapsed), file=sys.stderr)
+        # END for each version
+
+    def test_write_tree(self):
+        ne = 500000
+        stream = BytesIO()
+        write_cache(self._make_entries(ne), stream)
+        entries = read_cache(BytesIO(stream.getvalue()))[1]
+        entries.cache_tree = CacheTree()
+
+        for name in ("all trees", "one changed file"):
+            odb = MemoryDB()
+            st = time()
+            write_tree_from_cache(entries.sorted_values(), odb, slice(0, ne), 0, entries.cache_tree)
+            elapsed = time() - st
+            print("Wrote the trees of an index of %i entries with %s in %f s ( %i trees )"
+                  % (ne, name, elapsed, odb.size()), file=sys.stderr)
+
+            key = (u'dir_%05i/sub/file_%07i.py' % (ne // 200, ne // 2), 0)
+            entry = entries[key]
+            entries[key] = IndexEntry((entry.mode, b'\1' * 20) + entry[2:])
+        # END for each amount of changes
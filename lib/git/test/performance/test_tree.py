@@ -0,0 +1,144 @@
+"""Performance tests for trees"""
+from __future__ import print_function
+from io import BytesIO
+from time import time
+from stat import (
+    S_IFDIR,
+    S_IFREG
+)
+from multiprocessing import cpu_count
+import random
+import sys
+
+from .lib import (
+    TestBigRepoR,
+    TestBigRepoRW
+)
+from git.objects.fun import (
+    tree_to_stream,
+    tree_entries_from_data,
+    traverse_tree_recursive,
+    write_tree_with_changes
+)
+from git.objects.tree import TreeModifier
+from git.util import LRUCache
+from git.compat import xrange
+
+
+class TestTreePerformance(TestBigRepoR):
+
+    def _make_tree_data(self, ne):
+        """:return: raw data of a tree with the given amount of entries of all kinds"""
+        modes = (0o100644, 0o100755, 0o40000, 0o120000, 0o160000)
+        entries = [(('%020i' % i).encode('ascii'), modes[i % len(modes)], u'entry_%06i.py' % i)
+                   for i in xrange(ne)]
+        stream = BytesIO()
+        tree_to_stream(entries, stream.write)
+        return stream.getvalue()
+
+    def test_tree_entries_from_data(self):
+        ni = 20
+        for ne in (10000, 50000):
+            data = self._make_tree_data(ne)
+            for name, parse in (("list", lambda: tree_entries_from_data(data)),
+                                ("view", lambda: tree_entries_from_data(data, as_view=True)),
+                                ("view, iterated", lambda: list(tree_entries_from_data(data, as_view=True)))):
+                st = time()
+                for i in xrange(ni):
+                    assert len(parse()) == ne
+                # END for each iteration
+                elapsed = time() - st
+                print("Parsed a tree with %i entries into a %s %i times in %f s ( %f entries / s )"
+                      % (ne, name, ni, elapsed, ne * ni / elapsed), file=sys.stderr)
+            # END for each kind of result
+        # END for each tree size
+
+    def test_tree_cache(self):
+        # consecutive commits share most of their subtrees
+        repo = self.gitrorepo
+        commits = list(repo.iter_commits(repo.head, max_count=50))
+        for name, cache in (("no cache", LRUCache(0)),
+                            ("cold cache", LRUCache(repo.tree_cache_size, repo.tree_cache_bytes)),
+                            ("warm cache", None)):
+            if cache is not None:
+                repo._tree_cache = cache
+            # END handle cache
+            st = time()
+            ni = 0
+            for commit in commits:
+                for item in commit.tree.traverse():
+                    ni += 1
+                # END for each item
+            # END for each commit
+            elapsed = time() - st
+            cache = repo.tree_cache
+            print("Traversed the trees of %i commits with %s in %f s ( %f items / s ), %i hits, %i misses"
+                  % (len(commits), name, elapsed, ni / elapsed, cache.hits, cache.misses), file=sys.stderr)
+        # END for each cache
+
+    def test_prefetch_trees(self):
+        repo = self.puregitrorepo
+        commits = list(repo.iter_commits(repo.head, max_count=20))
+        for workers in (0, 2, 4, 8):
+            repo._tree_cache = LRUCache(repo.tree_cache_size, repo.tree_cache_bytes)
+            st = time()
+            ni = 0
+            if workers:
+                with repo.prefetch_trees(workers):
+                    for commit in commits:
+                        ni += len(traverse_tree_recursive(repo.odb, commit.tree.binsha, '', repo.tree_cache))
+                    # END for each commit
+                # END with prefetcher
+            else:
+                for commit in commits:
+                    ni += len(traverse_tree_recursive(repo.odb, commit.tree.binsha, '', repo.tree_cache))
+                # END for each commit
+            # END handle workers
+            elapsed = time() - st
+            print("Listed the trees of %i commits with %i prefetching threads on %i cores in %f s ( %f entries / s )"
+                  % (len(commits), workers, cpu_count(), elapsed, ni / elapsed), file=sys.stderr)
+        # END for each amount of workers
+
+
+class TestTreeWritePerformance(TestBigRepoRW):
+
+    def test_write_tree_with_changes(self):
+        odb = self.puregitrwrepo.odb
+        blob = b'\1' * 20
+        nd, nf = 100, 500
+
+        # sort the entries of a flat tree, half of them being trees
+        entries = [(blob, i % 2 and S_IFDIR or S_IFREG | 0o644, u'entry_%06i' % i) for i in xrange(nd * nf)]
+        random.shuffle(entries)
+        st = time()
+        TreeModifier(entries).set_done()
+        elapsed = time() - st
+        print("Sorted a tree with %i entries in %f s ( %f entries / s )"
+              % (len(entries), elapsed, len(entries) / elapsed), file=sys.stderr)
+
+        # a tree with nd subtrees of nf files each
+        changes = [('dir_%03i/file_%04i' % (d, f), (blob, S_IFREG | 0o644)) for d in xrange(nd) for f in xrange(nf)]
+        st = time()
+        root = write_tree_with_changes(odb, None, changes)
+        elapsed = time() - st
+        print("Wrote a tree with %i files in %f s ( %f files / s )"
+              % (len(changes), elapsed, len(changes) / elapsed), file=sys.stderr)
+
+        # change every hundredth file, at once and one by one
+        changes = [(path, (b'\2' * 20, entry[1])) for path, entry in changes[::100]]
+        cache = self.puregitrwrepo.tree_cache
+        st = time()
+        batch = write_tree_with_changes(odb, root, changes, cache)
+        elapsed = time() - st
+        print("Applied %i changes to a tree of %i files at once in %f s ( %f changes / s )"
+              % (len(changes), nd * nf, elapsed, len(changes) / elapsed), file=sys.stderr)
+
+        st = time()
+        single = root
+        for change in changes:
+            single = write_tree_with_changes(odb, single, [change], cache)
+        # END for each change
+        elapsed = time() - st
+        assert single == batch
+        print("Applied %i changes to a tree of %i files one by one in %f s ( %f changes / s )"
+              % (len(changes), nd * nf, elapsed, len(changes) / elapsed), file=sys.stderr)
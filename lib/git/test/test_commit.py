@@ -19,6 +19,7 @@ from git import (
     Actor,
 )
 from gitdb import IStream
+from gitdb.util import hex_to_bin
 from gitdb.test.lib import with_rw_directory
 from git.compat import (
     string_types,
@@ -177,6 +178,13 @@ class TestCommit(TestBase):
         # predicate
         assert next(start.traverse(branch_first=1, predicate=lambda i, d: i == p1)) == p1
 
+        # without predicate and prune, parents are walked by sha, in the same order
+        include_all = lambda i, d: True
+        for kwargs in (dict(), dict(branch_first=False), dict(depth=3, ignore_self=False),
+                       dict(visit_once=False, depth=4), dict(depth=0)):
+            assert list(start.traverse(**kwargs)) == list(start.traverse(predicate=include_all, **kwargs))
+        # END for each set of arguments
+
         # traversal should stop when the beginning is reached
         self.failUnlessRaises(StopIteration, next, first.traverse())
 
@@ -206,6 +214,36 @@ class TestCommit(TestBase):
         # pretty not allowed
         self.failUnlessRaises(ValueError, Commit.iter_items, self.rorepo, 'master', pretty="raw")
 
+    def test_iter_items_native(self):
+        # the in-process walk must produce what git rev-list does
+        def rev_list(rev, paths, **kwargs):
+            args = ['--']
+            if paths:
+                args.append(paths)
+            return [Commit(self.rorepo, hex_to_bin(hexsha))
+                    for hexsha in self.rorepo.git.rev_list(rev, *args, **kwargs).split()]
+        # END rev_list helper
+
+        since = self.rorepo.commit('0.1.5').committed_date
+        for rev in ('0.1.6', '0.1.5..0.1.6', self.rorepo.commit('0.3.0')):
+            for paths in ('', 'CHANGES', ['lib/git/diff.py', 'AUTHORS'], 'lib/git/'):
+                for kwargs in ({}, dict(max_count=5, skip=3), dict(first_parent=True), dict(since=since),
+                               dict(until=since), dict(max_count=0)):
+                    commits = Commit._iter_native(self.rorepo, rev, paths, dict(kwargs))
+                    assert commits is not None
+                    assert_equal(list(commits), rev_list(rev, paths, **kwargs))
+                # END for each option
+            # END for each path
+        # END for each revision
+
+        # everything else is left to git
+        for rev, paths, kwargs in (('0.1.5...0.1.6', '', {}), ('0.1.6', '*.py', {}),
+                                   ('0.1.6', '', dict(since='2 weeks ago')), ('0.1.6', '', dict(reverse=True)),
+                                   (['0.1.5', '0.1.6'], '', {})):
+            assert Commit._iter_native(self.rorepo, rev, paths, kwargs) is None
+            assert list(Commit.iter_items(self.rorepo, rev, paths, **kwargs)) == rev_list(rev, paths, **kwargs)
+        # END for each unsupported query
+
     def test_rev_list_bisect_all(self):
         """
         'git rev-list --bisect-all' returns additional information
@@ -353,6 +391,65 @@ JzJMZDRLQLFvnzqZuCjE
         cmt._serialize(cstream)
         assert not re.search(r"^gpgsig ", cstream.getvalue().decode('ascii'), re.MULTILINE)
 
+    def test_iter_records(self):
+        for kwargs in (dict(), dict(max_count=10, skip=3), dict(merges=True)):
+            commits = list(self.rorepo.iter_commits('0.1.6', **kwargs))
+            records = list(self.rorepo.iter_commit_records('0.1.6', **kwargs))
+            assert len(commits) == len(records)
+
+            for commit, record in zip(commits, records):
+                assert record == commit and record.hexsha == commit.hexsha
+                assert record.tree == commit.tree.binsha
+                assert record.parents == tuple(p.binsha for p in commit.parents)
+                assert record.author == commit.author and record.committer == commit.committer
+                assert record.authored_date == commit.authored_date
+                assert record.author_tz_offset == commit.author_tz_offset
+                assert record.committed_date == commit.committed_date
+                assert record.committer_tz_offset == commit.committer_tz_offset
+
+                full = record.to_commit()
+                assert full == commit and full.parents == commit.parents
+                assert full.message == commit.message
+                assert full.author == commit.author
+            # END for each commit
+        # END for each query
+
+        # actors are shared among the records and commits
+        records = list(self.rorepo.iter_commit_records('0.1.6'))
+        assert len(set(id(r.author) for r in records)) < len(records) // 2
+        assert records[0].author is self.rorepo.commit('0.1.6').author
+
+        self.failUnlessRaises(ValueError, self.rorepo.iter_commit_records, '0.1.6', pretty='raw')
+
+    def test_lazy_deserialization(self):
+        data = open(fixture_path('commit_invalid_data'), 'rb').read()
+        data = data.replace(b'\n\n', b'\nencoding ISO-8859-1\n\n') + b'\xe4\n'
+
+        cmt = Commit(self.rorepo, Commit.NULL_BIN_SHA)
+        cmt._deserialize(BytesIO(data))
+        assert cmt.encoding == 'ISO-8859-1'
+        assert len(cmt.parents) == 1
+        assert cmt.committed_date == 1306710073
+        assert cmt.committer_tz_offset == -10800
+
+        # walking the graph doesn't decode the actors or the message
+        for attr in ('author', 'committer', 'message'):
+            self.failUnlessRaises(AttributeError, object.__getattribute__, cmt, attr)
+        # END for each lazy attribute
+        assert cmt.message == u'add environjs\n\xe4\n'
+        assert cmt.author.email == 'azer@kodfabrik.com'
+        assert cmt.authored_date == 1306710073
+
+        # the commit serializes to the same data, including its encoding
+        cstream = BytesIO()
+        cmt._serialize(cstream)
+        assert cstream.getvalue() == data
+
+        # deserializing new data drops all values decoded previously
+        cmt._deserialize(BytesIO(data.replace(b'1306710073', b'1306710074')))
+        assert cmt.authored_date == 1306710074
+        assert cmt.message == u'add environjs\n\xe4\n'
+
     def test_datetimes(self):
         commit = self.rorepo.commit('4251bd5')
         assert commit.authored_date == 1255018625
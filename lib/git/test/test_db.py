@@ -3,8 +3,15 @@
 #
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
-from git.test.lib import TestBase
-from git.db import GitCmdObjectDB
+from git.test.lib import (
+    TestBase,
+    with_rw_repo
+)
+from git.db import (
+    GitCmdObjectDB,
+    CommitGraph
+)
+from git.objects.fun import commit_header_from_data
 from gitdb.util import bin_to_hex
 from git.exc import BadObject
 import os
@@ -24,3 +31,35 @@ class TestDB(TestBase):
         # fails with BadObject
         for invalid_rev in ("0000", "bad/ref", "super bad"):
             self.failUnlessRaises(BadObject, gdb.partial_to_complete_sha_hex, invalid_rev)
+
+    @with_rw_repo('0.1.6')
+    def test_commit_graph(self, rw_repo):
+        objects_dir = os.path.join(rw_repo.git_dir, 'objects')
+        assert CommitGraph.from_objects_dir(objects_dir) is None
+
+        def assert_graph_matches_objects(graph):
+            hexshas = rw_repo.git.rev_list('--all').split()
+            assert len(graph) == len(hexshas)
+            for hexsha in hexshas:
+                commit = rw_repo.commit(hexsha)
+                assert graph.header(commit.binsha) == commit_header_from_data(
+                    rw_repo.odb.stream(commit.binsha).read())
+                generation = graph.generation(commit.binsha)
+                for parent in commit.parents:
+                    assert graph.generation(parent.binsha) < generation
+                # END for each parent
+            # END for each commit
+        # END assertion helper
+
+        rw_repo.git.commit_graph('write', '--reachable')
+        assert_graph_matches_objects(CommitGraph.from_objects_dir(objects_dir))
+
+        # a split chain with an octopus merge on top, whose parents are listed as extra edges
+        parents = [rw_repo.commit('0.1.6~%i' % i) for i in range(3)]
+        octopus = rw_repo.index.commit("octopus", parent_commits=parents, head=True)
+        rw_repo.git.commit_graph('write', '--reachable', '--split=no-merge')
+        graph = CommitGraph.from_objects_dir(objects_dir)
+        assert_graph_matches_objects(graph)
+        assert graph.header(octopus.binsha)[1] == tuple(p.binsha for p in parents)
+        assert octopus.binsha in graph and b'\0' * 20 not in graph
+        assert graph.header(b'\0' * 20) is None
@@ -4,7 +4,10 @@
 #
 # This module is part of GitPython and is released under
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
+import copy
 import os
+import subprocess
+import sys
 
 from git.test.lib import (
     TestBase,
@@ -22,7 +25,11 @@ from git import (
     GitCommandError,
     Diff,
     DiffIndex,
+    Diffable,
+    RenameDetector,
     NULL_TREE,
+    PATCH_SKIP,
+    PATCH_SPOOL,
 )
 
 
@@ -136,12 +143,87 @@ class TestDiff(TestBase):
         dr = res[3]
         assert dr.diff.endswith(b"+Binary files a/rps and b/rps differ\n")
 
+    def test_diff_patch_format_streaming(self):
+        data = fixture('diff_index_patch')
+        expected = Diff._index_from_patch_format(None, StringProcessAdapter(data).stdout)
+        # sections must be found no matter where chunks end
+        for chunk_size in (1, 13, 64 * 1024):
+            res = list(Diff._iter_from_patch_format(None, StringProcessAdapter(data).stdout,
+                                                    chunk_size=chunk_size))
+            assert res == expected
+        # END for each chunk size
+
+        res = list(Diff._iter_from_patch_format(None, StringProcessAdapter(data).stdout, PATCH_SKIP))
+        assert [d.b_path for d in res] == [d.b_path for d in expected]
+        assert all(d.diff is None for d in res)
+
+        res = list(Diff._iter_from_patch_format(None, StringProcessAdapter(data).stdout, PATCH_SPOOL))
+        assert [d.diff.read() for d in res] == [d.diff for d in expected]
+        assert str(res[3])
+
+        self.failUnlessRaises(ValueError, list, Diff._iter_from_patch_format(None, None, 'invalid'))
+
     def test_diff_index_raw_format(self):
         output = StringProcessAdapter(fixture('diff_index_raw'))
         res = Diff._index_from_raw_format(None, output.stdout)
         assert res[0].deleted_file
         assert res[0].b_path is None
 
+    def test_diff_raw_z_format(self):
+        data = fixture('diff_raw_z')
+        # parsing must not depend on how the output is chunked
+        for chunk_size in (1, 7, 64 * 1024):
+            res = list(Diff._iter_from_raw_z_format(None, StringProcessAdapter(data).stdout, chunk_size))
+            assert len(res) == 6
+            assert res[0].change_type == 'M' and res[0].a_path == 'd/e/deep.txt'
+            assert res[1].deleted_file and res[1].a_path == 'f2.txt'
+            assert res[2].renamed_file
+            assert res[2].raw_rename_from == b'f1.txt'
+            assert res[2].raw_rename_to == b'g1.txt'
+            assert res[3].new_file and res[3].b_blob is not None and res[3].a_blob is None
+            assert res[3].b_blob.binsha == res[3].b_binsha and len(res[3].b_binsha) == 20
+            assert res[3].b_blob.path == 'n.txt'
+            # equal modes are shared among diffs
+            assert res[0].a_mode is res[5].b_mode
+            # paths are taken literally, there is no quoting in this format
+            assert res[4].b_rawpath == b'new\nline.txt'
+            assert res[5].b_rawpath == b'tab\tname.txt'
+        # END for each chunk size
+
+    def test_diff_index_lazy(self):
+        data = fixture('diff_raw_z')
+        index = DiffIndex(Diff._iter_from_raw_z_format(None, StringProcessAdapter(data).stdout))
+
+        # only what is needed is pulled from the source
+        assert index
+        assert index[1].deleted_file
+        assert list.__len__(index) == 2
+
+        # queries see all diffs
+        assert [d.b_path for d in index.iter_change_type('A')] == ['n.txt', 'new\nline.txt']
+        assert len(index) == 6
+        assert [d.change_type for d in index.iter_a_path('f2.txt')] == ['D']
+        assert [d.change_type for d in index.iter_b_path(b'g1.txt')] == ['R100']
+        assert not list(index.iter_a_path('does/not/exist'))
+
+        # altering the index drops the lookup tables
+        assert len(list(index.iter_change_type('M'))) == 2
+        index.pop()
+        assert len(list(index.iter_change_type('M'))) == 1
+        self.failUnlessRaises(ValueError, list, index.iter_change_type('X'))
+
+        # list operations see all diffs, of both operands
+        def lazy():
+            return DiffIndex(iter([1, 2, 3]))
+        assert lazy() == lazy() and not lazy() != lazy()
+        assert lazy() > [0] and [0] < lazy() and lazy() >= lazy() and lazy() <= [1, 2, 3]
+        assert [0] + lazy() == [0, 1, 2, 3] and lazy() + lazy() == [1, 2, 3] * 2
+        assert copy.copy(lazy()) == copy.deepcopy(lazy()) == [1, 2, 3]
+        assert isinstance(copy.copy(lazy()), DiffIndex)
+        if hasattr(list, 'copy'):
+            assert lazy().copy() == [1, 2, 3]
+        # END handle python 3
+
     def test_diff_initial_commit(self):
         initial_commit = self.rorepo.commit('33ebe7acec14b25c5f84f35a664803fcab2f7781')
 
@@ -251,8 +333,95 @@ class TestDiff(TestBase):
             assert value, "Did not find diff for %s" % key
         # END for each iteration type
 
+        # lazy diffs must yield exactly what the regular raw format produces
+        c = self.rorepo.commit('0.1.6')
+        for other in (NULL_TREE, c.parents[0]):
+            assert list(c.diff(other, lazy=True)) == c.diff(other)
+        # END for each other side
+
         # test path not existing in the index - should be ignored
         c = self.rorepo.head.commit
         cp = c.parents[0]
         diff_index = c.diff(cp, ["does/not/exist"])
         assert len(diff_index) == 0
+
+    def test_native_diff(self):
+        # native diffs must agree with git, renames included
+        c = self.rorepo.commit('0.1.6')
+        for other in (c.parents[0], c.parents[0].tree, '0.1.5'):
+            native = c.native_diff(other)
+            assert len(native)
+            assert native == c.diff(other)
+        # END for each other side
+        initial_commit = self.rorepo.commit('33ebe7acec14b25c5f84f35a664803fcab2f7781')
+        assert initial_commit.native_diff(NULL_TREE) == initial_commit.diff(NULL_TREE)
+
+        diff_index = c.native_diff(c.parents[0], paths='lib/git')
+        assert diff_index
+        for diff in diff_index:
+            assert diff.b_path.startswith('lib/git/')
+        # END for each diff
+
+        self.failUnlessRaises(ValueError, c.native_diff, None)
+        self.failUnlessRaises(ValueError, c.native_diff, Diffable.Index)
+
+    @with_rw_directory
+    def test_rename_detector(self, rw_dir):
+        r = Repo.init(rw_dir)
+        sources = (('same.txt', 'moved.txt', 0), ('similar.txt', 'edited.txt', 80), ('other.txt', 'replaced.txt', 0))
+        for src, dst, kept in sources:
+            with open(os.path.join(rw_dir, src), 'w') as fp:
+                fp.writelines("line %i of %s\n" % (i, src) for i in range(100))
+            # END write source
+        # END for each source
+        r.git.add(A=True)
+        r.git.commit(message="sources")
+        for src, dst, kept in sources:
+            if src == 'same.txt':
+                os.rename(os.path.join(rw_dir, src), os.path.join(rw_dir, dst))
+                continue
+            # END handle pure rename
+            os.remove(os.path.join(rw_dir, src))
+            with open(os.path.join(rw_dir, dst), 'w') as fp:
+                fp.writelines("line %i of %s\n" % (i, src) for i in range(kept))
+                fp.writelines("line %i of %s\n" % (i, dst) for i in range(kept, 100))
+            # END write destination
+        # END for each destination
+        r.git.add(A=True)
+        r.git.commit(message="destinations")
+
+        head = r.head.commit
+        diff_index = head.parents[0].native_diff(head)
+        assert diff_index == head.parents[0].diff(head)
+        renames = dict((d.rename_from, (d.rename_to, d.change_type)) for d in diff_index.iter_change_type('R'))
+        assert renames == {'same.txt': ('moved.txt', 'R100'), 'similar.txt': ('edited.txt', 'R079')}
+        assert [d.a_path for d in diff_index.iter_change_type('D')] == ['other.txt']
+        assert [d.b_path for d in diff_index.iter_change_type('A')] == ['replaced.txt']
+
+        # stricter thresholds and too many candidates only leave the exact rename
+        for detector in (RenameDetector(similarity=90), RenameDetector(max_candidates=0)):
+            diff_index = head.parents[0].native_diff(head, renames=detector)
+            assert [d.change_type for d in diff_index.iter_change_type('R')] == ['R100']
+        # END for each detector
+        diff_index = head.parents[0].native_diff(head, renames=RenameDetector(max_fingerprint_size=8))
+        assert len(list(diff_index.iter_change_type('R'))) == 2
+        assert not list(head.parents[0].native_diff(head, renames=False).iter_change_type('R'))
+
+    def test_rename_detector_is_stable(self):
+        # sampled fingerprints of large blobs must not depend on the hash seed of the process
+        script = ("from git.diff import RenameDetector, _fingerprint, _sample, _sample_level\n"
+                  "def record(data):\n"
+                  "    counts = _fingerprint(data)\n"
+                  "    level = _sample_level(counts, 4096)\n"
+                  "    return level, _sample(counts, level), len(data)\n"
+                  "a = ''.join('line %i\\n' % i for i in range(20000)).encode('ascii')\n"
+                  "b = ''.join('line %i\\n' % (i % 3 and i or -i) for i in range(20000)).encode('ascii')\n"
+                  "print(RenameDetector()._score(record(a), record(b)))\n")
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        scores = set()
+        for seed in ('1', '2'):
+            env['PYTHONHASHSEED'] = seed
+            scores.add(subprocess.check_output([sys.executable, '-c', script], env=env).strip())
+        # END for each hash seed
+        assert len(scores) == 1
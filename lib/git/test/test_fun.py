@@ -3,10 +3,14 @@ from git.test.lib import (
     with_rw_repo
 )
 from git.objects.fun import (
+    iter_tree_recursive,
+    iter_trees_recursive,
     traverse_tree_recursive,
     traverse_trees_recursive,
     tree_to_stream,
-    tree_entries_from_data
+    tree_entries_from_data,
+    tree_entry_sort_key,
+    write_tree_with_changes
 )
 
 from git.index.fun import (
@@ -15,6 +19,7 @@ from git.index.fun import (
 
 from gitdb.util import bin_to_hex
 from gitdb.base import IStream
+from gitdb.db import MemoryDB
 from gitdb.typ import str_tree_type
 
 from stat import (
@@ -24,6 +29,7 @@ from stat import (
 )
 
 from git.index import IndexFile
+from git.util import LRUCache
 from io import BytesIO
 
 
@@ -67,6 +73,14 @@ class TestFun(TestBase):
         trees = [B.binsha, H.binsha, M.binsha]
         self._assert_index_entries(aggressive_tree_merge(odb, trees), trees)
 
+        # trees may be read through a cache
+        cache = LRUCache(1000)
+        assert aggressive_tree_merge(odb, trees, cache) == aggressive_tree_merge(odb, trees)
+        misses = cache.misses
+        assert misses and len(cache) == misses
+        assert aggressive_tree_merge(odb, trees, cache) == aggressive_tree_merge(odb, trees)
+        assert cache.misses == misses
+
         # too many trees
         self.failUnlessRaises(ValueError, aggressive_tree_merge, odb, trees * 2)
 
@@ -244,6 +258,16 @@ class TestFun(TestBase):
         entries = traverse_trees_recursive(odb, [B.binsha, H.binsha, M.binsha], '')
         self._assert_tree_entries(entries, 3)
 
+        # entries come in the order of the trees, and those being the same in all trees can be skipped
+        single = traverse_trees_recursive(odb, [B.binsha], '')
+        paths = [e[0][2] for e in single]
+        assert paths == [i.path for i in B.traverse(predicate=is_no_tree, branch_first=False)]
+        changed = [e for e in traverse_trees_recursive(odb, [B.binsha, H.binsha], '')
+                   if not (e[0] and e[1] and e[0][:2] == e[1][:2])]
+        assert changed and list(iter_trees_recursive(odb, [B.binsha, H.binsha], '', skip_same=True)) == changed
+        assert not list(iter_trees_recursive(odb, [B.binsha, B.binsha, B.binsha], '', skip_same=True))
+        assert list(iter_trees_recursive(odb, [B.binsha, B.binsha], '')) == [e * 2 for e in single]
+
     def test_tree_traversal_single(self):
         max_count = 50
         count = 0
@@ -256,6 +280,106 @@ class TestFun(TestBase):
             assert entries
         # END for each commit
 
+    def test_tree_traversal_paths(self):
+        odb = self.rorepo.odb
+        tree = self.rorepo.tree('0.1.6')
+        entries = traverse_tree_recursive(odb, tree.binsha, '')
+        assert list(iter_tree_recursive(odb, tree.binsha, '')) == entries
+        assert list(iter_tree_recursive(odb, tree.binsha, '', paths=['lib', ''])) == entries
+
+        # paths limit the entries to themselves and everything below them
+        for paths in (['lib'], ['lib/git/', 'CHANGES'], ['lib/git/objects', 'lib/git', 'lib/git/missing'],
+                      ['CHANGES/foo', 'missing'], []):
+            prefixes = tuple(p.rstrip('/') + '/' for p in paths)
+            expected = [e for e in entries if (e[2] + '/').startswith(prefixes)]
+            assert list(iter_tree_recursive(odb, tree.binsha, '', paths=paths)) == expected
+            assert list(iter_trees_recursive(odb, [tree.binsha], '', paths=paths)) == [(e,) for e in expected]
+        # END for each set of paths
+        prefixed = list(iter_tree_recursive(odb, tree.binsha, 'prefix/', paths=['lib']))
+        assert prefixed and prefixed[0][2].startswith('prefix/lib/')
+
+        # trees not on the way to the paths are not read
+        cache = LRUCache(100)
+        assert len(list(iter_tree_recursive(odb, tree.binsha, '', cache, ['CHANGES', 'lib/missing']))) == 1
+        assert cache.misses == 2
+
+    def test_tree_traversal_undecodable_names(self):
+        # names which are no valid text are bytes, they sort and join paths by their encoding
+        odb = MemoryDB()
+        mode = S_IFREG | 0o644
+
+        def store(entries):
+            stream = BytesIO()
+            tree_to_stream(sorted(entries, key=tree_entry_sort_key), stream.write)
+            return odb.store(IStream(str_tree_type, len(stream.getvalue()), BytesIO(stream.getvalue()))).binsha
+
+        trees = list()
+        for blob in (b'\1' * 20, b'\2' * 20):
+            sub = store([(blob, mode, u'f')])
+            trees.append(store([(sub, S_IFDIR, b'bad\xff'), (blob, mode, u'c'), (sub, S_IFDIR, u'bad'),
+                                (b'\3' * 20, mode, u'bad.txt')]))
+        # END for each tree
+
+        assert [e[2] for e in tree_entries_from_data(odb.stream(trees[0]).read())] == [
+            u'bad.txt', u'bad', b'bad\xff', u'c']
+        paths = [e[2] for e in traverse_tree_recursive(odb, trees[0], '')]
+        assert paths == [u'bad.txt', u'bad/f', b'bad\xff/f', u'c']
+        assert [e[2] for e in iter_tree_recursive(odb, trees[0], '')] == paths
+        changed = list(iter_trees_recursive(odb, trees, '', skip_same=True))
+        assert [(a[2], b[2]) for a, b in changed] == [(p, p) for p in paths[1:]]
+
     def test_tree_entries_from_data_with_failing_name_decode(self):
         r = tree_entries_from_data(b'100644 \x9f\0aaa')
         assert r == [(b'aaa', 33188, b'\x9f')], r
+
+    def test_tree_entries_from_data(self):
+        entries = [(b'\1' * 20, 0o100644, u'a'), (b'\2' * 20, 0o100755, u'b\xe4'), (b'\3' * 20, 0o120000, u'c'),
+                   (b'\4' * 20, 0o40000, u'd'), (b'\5' * 20, 0o160000, u'e')]
+        stream = BytesIO()
+        tree_to_stream(entries, stream.write)
+        data = stream.getvalue() + b'644 f\0' + b'\6' * 20
+        entries.append((b'\6' * 20, 0o644, u'f'))
+        assert tree_entries_from_data(data) == entries
+
+        view = tree_entries_from_data(data, as_view=True)
+        assert len(view) == len(entries)
+        assert list(view) == entries
+        assert view[1] == entries[1] and view[-1] == entries[-1]
+        assert view[1:3] == entries[1:3] and view[::-2] == entries[::-2] and view[10:] == []
+        assert view.name(1) == u'b\xe4' and view.mode(3) == 0o40000 and view.binsha(4) == b'\5' * 20
+
+        self.failUnlessRaises(ValueError, tree_entries_from_data, b'100644 name')
+
+    @with_rw_repo('0.1.6', bare=True)
+    def test_write_tree_with_changes(self, rwrepo):
+        root = rwrepo.tree('0.1.6')
+        blob = root['CHANGES'].binsha
+        mode = S_IFREG | 0o644
+        changes = [('lib/git/new.py', (blob, mode)), ('lib/git.py', (blob, mode)), ('lib/git-x', (blob, mode)),
+                   ('new/dir/file', (blob, mode)), ('README', None), ('missing', None)]
+        new = root.with_changes(changes)
+        assert new.binsha == write_tree_with_changes(rwrepo.odb, root.binsha, changes)
+        assert new.path == root.path and new.mode == root.mode
+
+        # trees sort as if their name had a trailing slash
+        names = ['git-x', 'git.py', 'git']
+        assert [e[2] for e in (new / 'lib')._cache] == names
+        lib = root / 'lib'
+        lib.cache.add(blob, mode, 'git.py').add(blob, mode, 'git-x').set_done()
+        assert [e[2] for e in lib._cache] == names
+
+        assert (new / 'lib/git/new.py').binsha == blob and (new / 'new/dir/file').binsha == blob
+        assert 'README' not in new and 'missing' not in new
+        # unchanged trees are shared
+        assert (new / 'test').binsha == (root / 'test').binsha
+        assert (new / 'lib/git/objects').binsha == (root / 'lib/git/objects').binsha
+
+        # trees become part of the database, and are removed once empty
+        assert rwrepo.git.ls_tree('-r', '--name-only', new.hexsha).splitlines() == [
+            item.path for item in new.traverse(branch_first=False) if item.type == 'blob']
+        blobs = [item.path for item in new.traverse() if item.path.startswith('lib/git/objects/')
+                 and item.type == 'blob']
+        empty = new.with_changes((path, None) for path in blobs)
+        assert 'lib/git/objects' not in empty / 'lib/git'
+        assert empty.with_changes([('lib', None), ('new', None)]).binsha == root.with_changes(
+            [('lib', None), ('new/a', (blob, mode)), ('new/a', None), ('README', None)]).binsha
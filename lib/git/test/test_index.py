@@ -29,6 +29,7 @@ from git import (
 )
 from git.compat import string_types
 from gitdb.util import hex_to_bin
+import copy
 import os
 import sys
 import tempfile
@@ -40,12 +41,26 @@ from stat import (
 
 from io import BytesIO
 from gitdb.base import IStream
+from gitdb.db import MemoryDB
 from git.objects import Blob
 from git.index.typ import (
     BaseIndexEntry,
-    IndexEntry
+    IndexEntry,
+    IndexEntries,
+    CacheTree,
+    CE_SKIP_WORKTREE,
+    CE_INTENT_TO_ADD
 )
-from git.index.fun import hook_path
+from git.index.fun import (
+    hook_path,
+    read_cache,
+    write_cache,
+    read_cache_tree,
+    write_cache_tree,
+    write_tree_from_cache
+)
+from git.index.util import pack
+from git.util import file_contents_ro
 from gitdb.test.lib import with_rw_directory
 
 
@@ -119,6 +134,123 @@ class TestIndex(TestBase):
         fp.close()
         os.remove(tmpfile)
 
+    def test_read_cache(self):
+        # all kinds of streams yield the same entries
+        for name in ("index", "index_merge"):
+            data = fixture(name)
+            info = read_cache(BytesIO(data))
+            fd = os.open(fixture_path(name), os.O_RDONLY)
+            try:
+                assert read_cache(file_contents_ro(fd, stream=True)) == info
+            finally:
+                os.close(fd)
+            # END cleanup
+            with open(fixture_path(name), 'rb') as fp:
+                assert read_cache(fp) == info
+            # END with file
+        # END for each fixture
+
+        # paths too long for the flags are terminated by a null byte
+        path = b'dir/' * 1024 + b'file'
+        data = b'DIRC' + pack(">LL", 2, 1)
+        data += pack(">8s8sLLLLLL20sH", b'\0' * 8, b'\0' * 8, 0, 0, 0o100644, 0, 0, 0, b'\2' * 20,
+                     0x3fff)
+        data += path + b'\0' * (8 - (62 + len(path)) % 8) + b'\1' * 20
+        version, entries, extension_data, content_sha = read_cache(BytesIO(data))
+        assert list(entries) == [(path.decode('ascii'), 3)]
+        assert extension_data == b'' and content_sha == b'\1' * 20
+
+    def test_index_entries(self):
+        entries = read_cache(BytesIO(fixture("index_merge")))[1]
+        assert isinstance(entries, IndexEntries)
+        expected = dict(entries.items())
+        assert len(expected) == len(entries) == 106
+        for key, entry in expected.items():
+            assert key in entries and entries[key] == entry
+            assert key == (entry.path, entry.stage)
+        # END for each entry
+        assert ('missing', 0) not in entries and 'missing' not in entries
+        self.failUnlessRaises(KeyError, entries.__getitem__, ('missing', 0))
+
+        # changes behave like those of a dict
+        unmerged = [key for key in expected if key[1]]
+        for key in unmerged[:10]:
+            del(entries[key])
+            del(expected[key])
+        # END for each key to remove
+        self.failUnlessRaises(KeyError, entries.__delitem__, unmerged[0])
+        for key in unmerged[10:20]:
+            entries[key] = expected[key] = IndexEntry.from_base(entries[key])
+        # END for each key to replace
+        new_key = ('new', 0)
+        entries[new_key] = expected[new_key] = IndexEntry.from_base(BaseIndexEntry((0o100644, b'\1' * 20, 0, 'new')))
+        assert entries == expected
+        assert sorted(entries) == sorted(expected)
+        assert len(entries) == len(expected) and len(entries.values()) == len(entries)
+
+        # copies change independently, like those of a dict
+        entries.cache_tree = CacheTree(1, b'\1' * 20)
+        for copied in (entries.copy(), copy.copy(entries)):
+            assert copied == entries and copied.cache_tree.binsha == entries.cache_tree.binsha
+            copied[('other', 0)] = expected[new_key]
+            del(copied[new_key])
+            del(copied[unmerged[-1]])
+            assert len(copied) == len(entries) - 1 and copied.cache_tree.binsha is None
+        # END for each way to copy
+        assert entries == expected and entries.cache_tree.binsha == b'\1' * 20
+
+        entries.clear()
+        assert len(entries) == 0 and not list(entries.values())
+
+    def test_index_versions(self):
+        entries = sorted(read_cache(BytesIO(fixture("index_merge")))[1].values(), key=lambda e: (e.path, e.stage))
+        sizes = dict()
+        for version in (2, 3, 4):
+            stream = BytesIO()
+            write_cache(entries, stream, version=version)
+            sizes[version] = len(stream.getvalue())
+            info = read_cache(BytesIO(stream.getvalue()))
+            assert info[0] == version
+            assert sorted(info[1].values(), key=lambda e: (e.path, e.stage)) == entries
+        # END for each version
+        assert sizes[4] < sizes[3] == sizes[2]
+
+        # extended flags require version 3 at least
+        entries[0] = IndexEntry((entries[0][0], entries[0][1], entries[0][2] | CE_SKIP_WORKTREE) + entries[0][3:])
+        for version in (2, 4):
+            stream = BytesIO()
+            write_cache(entries, stream, version=version)
+            info = read_cache(BytesIO(stream.getvalue()))
+            assert info[0] == max(version, 3)
+            assert info[1][(entries[0].path, entries[0].stage)].flags & CE_SKIP_WORKTREE
+            assert sorted(info[1].values(), key=lambda e: (e.path, e.stage)) == entries
+        # END for each version
+
+    def test_cache_tree(self):
+        entries = read_cache(BytesIO(fixture("index")))[1]
+        sorted_entries = entries.sorted_values()
+        odb = MemoryDB()
+        binsha = write_tree_from_cache(sorted_entries, odb, slice(0, len(entries)))[0]
+        num_trees = odb.size()
+
+        # the cache tree gets filled while writing, and survives a round trip through its extension
+        entries.cache_tree = CacheTree()
+        write_tree_from_cache(sorted_entries, MemoryDB(), slice(0, len(entries)), 0, entries.cache_tree)
+        assert entries.cache_tree.entry_count == len(entries) and entries.cache_tree.binsha == binsha
+        cache_tree, extension_data = read_cache_tree(write_cache_tree(entries.cache_tree) + b'ABCD\0\0\0\0')
+        assert extension_data == b'ABCD\0\0\0\0'
+        assert write_cache_tree(cache_tree) == write_cache_tree(entries.cache_tree)
+
+        # changes invalidate the directories containing them, only their trees are written
+        entry = max(entries.values(), key=lambda e: e.path.count('/'))
+        entries[(entry.path, entry.stage)] = IndexEntry((entry.mode, b'\1' * 20) + entry[2:])
+        assert entries.cache_tree.entry_count == -1
+        odb = MemoryDB()
+        binsha = write_tree_from_cache(entries.sorted_values(), odb, slice(0, len(entries)), 0, entries.cache_tree)[0]
+        assert odb.size() == entry.path.count('/') + 1 < num_trees
+        assert binsha == write_tree_from_cache(entries.sorted_values(), MemoryDB(), slice(0, len(entries)))[0]
+        assert entries.cache_tree.binsha == binsha
+
     def _cmp_tree_index(self, tree, index):
         # fail unless both objects contain the same paths and blobs
         if isinstance(tree, str):
@@ -807,3 +939,29 @@ class TestIndex(TestBase):
         r = Repo.init(rw_dir)
         r.index.add([fp])
         r.index.commit('Added [.exe')
+
+    @with_rw_directory
+    def test_write_tree_intent_to_add(self, rw_dir):
+        r = Repo.init(rw_dir)
+        for path in ('a', 'd/b', 'e/c', 'ita', 'd/ita', 'n/m/only'):
+            if not os.path.isdir(os.path.join(rw_dir, os.path.dirname(path))):
+                os.makedirs(os.path.join(rw_dir, os.path.dirname(path)))
+            with open(os.path.join(rw_dir, path), 'w') as fp:
+                fp.write(path)
+        # END for each path
+        r.git.add('a', 'd/b', 'e/c')
+        r.git.commit(message="files")
+        r.git.add('ita', 'd/ita', 'n/m/only', N=True)
+
+        # entries to be added are no part of trees, nor are directories containing only those
+        index = IndexFile(r)
+        binsha = hex_to_bin(r.git.write_tree())
+        assert index.write_tree().binsha == binsha
+        assert index.entries.cache_tree.entry_count == -1
+        assert index.entries.cache_tree.children['e'].entry_count == 1
+        assert index.write_tree().binsha == binsha
+
+        index.write()
+        assert IndexFile(r).entries[('ita', 0)].flags & CE_INTENT_TO_ADD
+        assert hex_to_bin(r.git.write_tree()) == binsha
+        assert index.commit("no intent to add").tree.binsha == binsha
@@ -810,6 +810,25 @@ class TestRepo(TestBase):
 
         assert 'BAD MESSAGE' not in contents, 'log is corrupt'
 
+    def test_iter_commit_diffs(self):
+        repo = self.rorepo
+        commits = list(repo.iter_commits('0.1.6', max_count=10))
+        res = list(repo.iter_commit_diffs(commits))
+        assert [c for c, index in res] == commits
+        for commit, index in res:
+            if commit.parents:
+                assert index == commit.parents[0].diff(commit)
+            # END compare with regular diff
+        # END for each result
+
+        # explicit pairs and paths
+        res = list(repo.iter_commit_diffs([(commits[0], commits[-1])], paths='lib'))
+        assert len(res) == 1 and res[0][0] == commits[0]
+        assert res[0][1] == commits[-1].diff(commits[0], paths='lib')
+        assert all(d.b_path.startswith('lib') for d in res[0][1] if d.b_path)
+
+        assert list(repo.iter_commit_diffs([])) == []
+
     def test_merge_base(self):
         repo = self.rorepo
         c1 = 'f6aa8d1'
@@ -848,6 +867,29 @@ class TestRepo(TestBase):
         for i, j in itertools.permutations([c1, 'ffffff', ''], r=2):
             self.assertRaises(GitCommandError, repo.is_ancestor, i, j)
 
+    def test_ancestry_native(self):
+        # in-process answers must match what git says
+        repo = self.rorepo
+        revs = ['0.1.5', '0.1.6', '0.3.0', 'f6aa8d1', '763ef75', 'd46e3fe', '0.1.6~3']
+        for a, b in itertools.permutations(revs, r=2):
+            for kwargs in ({}, dict(all=True)):
+                expected = repo.git.merge_base(a, b, **kwargs).splitlines()
+                assert [c.hexsha for c in repo.merge_base(a, b, **kwargs)] == expected
+            # end for each option
+            try:
+                repo.git.merge_base(a, b, is_ancestor=True)
+                expected = True
+            except GitCommandError:
+                expected = False
+            # end ask git
+            assert repo.is_ancestor(a, b) == expected
+        # end for each pair
+
+        # answers are cached
+        hits = repo.ancestry_cache.hits
+        assert repo.is_ancestor('f6aa8d1', '763ef75')
+        assert repo.ancestry_cache.hits == hits + 1
+
     @with_rw_directory
     def test_work_tree_unsupported(self, rw_dir):
         git = Git(rw_dir)
@@ -10,6 +10,12 @@ from git import (
     Tree,
     Blob
 )
+from git.objects.fun import (
+    iter_tree_recursive,
+    traverse_tree_recursive,
+    TreePrefetcher
+)
+from git.util import LRUCache
 
 from io import BytesIO
 
@@ -92,3 +98,87 @@ class TestTree(TestBase):
             assert root[item.path] == item == root / item.path
         # END for each item
         assert found_slash
+
+    def test_tree_cache(self):
+        cache = self.rorepo.tree_cache
+        cache.clear()
+        root = self.rorepo.tree('0.1.6')
+        hits, misses = cache.hits, cache.misses
+        entries = root._cache
+        assert cache.misses == misses + 1 and len(cache) == 1 and cache.nbytes == root.size
+
+        # other instances of the same tree share the parsed entries
+        other = Tree(self.rorepo, root.binsha)
+        assert other._cache == entries and other._cache is not entries
+        assert cache.hits == hits + 1 and cache.misses == misses + 1
+
+        # changing the entries of one instance doesn't affect any other
+        mod = root.cache
+        mod.add(Tree.NULL_HEX_SHA, Tree.blob_id << 12, 'zzz_new_file').set_done()
+        assert len(root._cache) == len(other._cache) + 1
+        assert Tree(self.rorepo, root.binsha)._cache == other._cache
+
+        # the cache is bounded by the size of the raw tree data
+        max_bytes = cache.max_bytes
+        cache.max_bytes = root.size - 1
+        try:
+            cache.clear()
+            Tree(self.rorepo, root.binsha)._cache
+            assert len(cache) == 0 and cache.nbytes == 0
+        finally:
+            cache.max_bytes = max_bytes
+        # END restore budget
+
+    def test_prefetch_trees(self):
+        repo = self.rorepo
+        root = repo.tree('0.1.6')
+        items = [(item.path, item.binsha) for item in root.traverse()]
+        entries = traverse_tree_recursive(repo.odb, root.binsha, '')
+        cache = repo.tree_cache
+        cache.clear()
+
+        with repo.prefetch_trees(workers=2) as prefetcher:
+            assert repo.tree_cache is prefetcher
+            tree = Tree(repo, root.binsha, path='')
+            assert [(item.path, item.binsha) for item in tree.traverse()] == items
+            assert traverse_tree_recursive(repo.odb, root.binsha, '', prefetcher) == entries
+        # END with prefetcher
+        assert repo.tree_cache is cache and len(cache) > 1
+
+        # nothing is read anymore once closed
+        tree = cache.get(root.binsha)
+        cache.clear()
+        prefetcher.set(root.binsha, tree)
+        assert len(cache) == 1 and not prefetcher.pending
+
+        # trees the caller reads itself leave the queue, even if no thread gets to them
+        prefetcher = TreePrefetcher(repo.odb, LRUCache(1000), workers=0, max_pending=4)
+        pending = [prefetcher.pending for entry in iter_tree_recursive(repo.odb, root.binsha, '', prefetcher)]
+        assert len(pending) == len(entries) and max(pending) <= 4 and not prefetcher.pending
+
+    def test_lookup(self):
+        root = self.rorepo.tree('0.1.6')
+        items = list(root.traverse())
+        paths = [item.path for item in items]
+        assert root.resolve_many(paths) == items
+        assert [o.path for o in root.resolve_many(paths)] == paths
+        for item in items:
+            assert root / item.path == item
+            assert item in root or '/' in item.path
+            assert (item.path in root) == ('/' not in item.path)
+        # END for each item
+
+        lib = root / 'lib'
+        assert 'lib/git' in lib and 'git' not in lib and lib / 'git' == root / 'lib/git'
+        assert root.resolve_many(['missing', 'lib/missing', 'CHANGES/foo', 'lib/git/']) == [None] * 4
+        for path in ('missing', 'CHANGES/foo', 'lib/git/', ''):
+            self.failUnlessRaises(KeyError, root.join, path)
+        # END for each missing path
+        assert None not in root and 1 not in root
+
+        # the index follows changes done through the modifier
+        mod = lib.cache
+        del(mod['git'])
+        assert 'lib/git' not in lib and lib.resolve_many(['git']) == [None]
+        mod.add(root['CHANGES'].binsha, Tree.blob_id << 12, 'git').set_done()
+        assert lib / 'git' == root['CHANGES'] and root['CHANGES'] in lib
@@ -15,13 +15,18 @@ from git.util import (
     BlockingLockFile,
     get_user_id,
     Actor,
-    IterableList
+    IterableList,
+    LRUCache
 )
 from git.objects.util import (
     altz_to_utctz_str,
     utctz_to_altz,
     verify_utctz,
     parse_date,
+    parse_actor_and_date,
+    intern_actor,
+    intern_tzoffset,
+    from_timestamp,
 )
 from git.cmd import dashify
 from git.compat import string_types
@@ -131,6 +136,49 @@ class TestUtils(TestBase):
             assert isinstance(Actor.author(cr), Actor)
         # END assure config reader is handled
 
+    def test_lru_cache(self):
+        cache = LRUCache(3, max_bytes=100)
+        for i in range(4):
+            cache[i] = str(i)
+        # END for each item
+        assert len(cache) == 3 and 0 not in cache
+        assert cache.get(0) is None and cache.get(1) == '1'
+        assert cache.hits == 1 and cache.misses == 1
+
+        # 1 was used most recently, and items are dropped once their sizes exceed the budget
+        cache.set(4, '4', 60)
+        assert 2 not in cache and 1 in cache and cache.nbytes == 60
+        cache.set(5, '5', 30)
+        assert len(cache) == 3 and cache.nbytes == 90
+        cache.set(5, '5', 50)
+        assert len(cache) == 1 and 5 in cache and cache.nbytes == 50
+
+        # items larger than the budget are not kept
+        cache.set(6, '6', 101)
+        assert 6 not in cache and len(cache) == 0 and cache.nbytes == 0
+
+        cache[7] = '7'
+        cache.clear()
+        assert len(cache) == 0 and cache.nbytes == 0 and cache.hits == 1
+
+    def test_interning(self):
+        actor = intern_actor(u"Jane Doe <jane@example.com>")
+        assert actor.name == u"Jane Doe" and actor.email == u"jane@example.com"
+        assert intern_actor(u"Jane Doe <jane@example.com>") is actor
+        assert parse_actor_and_date(u"author Jane Doe <jane@example.com> 1191999972 -0700")[0] is actor
+        assert intern_actor(u"John Doe <jane@example.com>") is not actor
+
+        # changed actors are not handed out anymore
+        actor.name = u"Joe"
+        other = intern_actor(u"Jane Doe <jane@example.com>")
+        assert other is not actor and other.name == u"Jane Doe"
+        assert intern_actor(u"Jane Doe <jane@example.com>") is other
+
+        tz = intern_tzoffset(-7200)
+        assert intern_tzoffset(-7200) is tz
+        assert from_timestamp(1191999972, -7200).tzinfo is tz
+        assert utctz_to_altz('+0200') == utctz_to_altz('+0200') == -7200
+
     def test_iterable_list(self):
         for args in (('name',), ('name', 'prefix_')):
             l = IterableList('name')
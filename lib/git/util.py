@@ -18,6 +18,7 @@ import logging
 # NOTE:  Some of the unused imports might be used/imported by others.
 # Handle once test-cases are back up and running.
 from .exc import InvalidGitRepositoryError
+from .odict import OrderedDict
 
 from .compat import (
     MAXSIZE,
@@ -39,7 +40,7 @@ from gitdb.util import (  # NOQA
 __all__ = ("stream_copy", "join_path", "to_native_path_windows", "to_native_path_linux",
            "join_path_native", "Stats", "IndexFileSHA1Writer", "Iterable", "IterableList",
            "BlockingLockFile", "LockFile", 'Actor', 'get_user_id', 'assure_directory_exists',
-           'RemoteProgress', 'CallableRemoteProgress', 'rmtree', 'WaitGroup', 'unbare_repo')
+           'RemoteProgress', 'CallableRemoteProgress', 'rmtree', 'WaitGroup', 'unbare_repo', 'LRUCache')
 
 #{ Utility Methods
 
@@ -783,6 +784,74 @@ class WaitGroup(object):
         self.cv.release()
 
 
+class LRUCache(object):
+
+    """A mapping of bounded size, which discards the least recently used items first once
+    it is full. Lookups are counted as hits and misses, which helps to size the cache.
+    Items may be given a size in bytes, to bound the memory the cache takes as well."""
+    __slots__ = ('_data', '_sizes', 'max_size', 'max_bytes', 'nbytes', 'hits', 'misses')
+
+    def __init__(self, max_size, max_bytes=None):
+        """:param max_size: maximum amount of items to keep
+        :param max_bytes: if not None, maximum sum of the sizes of all items, see ``set``"""
+        self._data = OrderedDict()
+        self._sizes = dict()
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """:return: value stored for key, which becomes the most recently used one, or default"""
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # END handle miss
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, size=0):
+        """Store value for key as the most recently used item.
+
+        :param size: amount of bytes the value takes, counted against ``max_bytes``. Items larger than
+            that are not kept at all"""
+        data = self._data
+        sizes = self._sizes
+        data.pop(key, None)
+        self.nbytes -= sizes.pop(key, 0)
+        data[key] = value
+        if size:
+            sizes[key] = size
+            self.nbytes += size
+        # END account size
+
+        max_bytes = self.max_bytes
+        while len(data) > self.max_size or (max_bytes is not None and self.nbytes > max_bytes):
+            oldest = next(iter(data))
+            del(data[oldest])
+            self.nbytes -= sizes.pop(oldest, 0)
+        # END drop least recently used items
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """Drop all items, counters are kept"""
+        self._data.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+
 class NullHandler(logging.Handler):
     def emit(self, record):
         pass